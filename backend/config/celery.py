@@ -1,8 +1,33 @@
 import os
 from celery import Celery
+from celery.schedules import crontab
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 app = Celery("config")
 app.config_from_object("django.conf:settings", namespace="CELERY")
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@app.on_after_configure.connect
+def setup_periodic_tasks(sender, **kwargs):
+    # beat schedule (`celery -A config beat`); intervals come from settings, crontabs use CELERY_TIMEZONE
+    from django.conf import settings
+
+    schedule = {
+        # wallet tasks fan out into shards (core.tasks); run keys make repeated runs no-ops
+        "daily-reward-add": (crontab(hour=0, minute=0), "core.tasks.daily_reward_add"),
+        "end-of-month-unlock-daily": (crontab(day_of_month=1, hour=0, minute=30),
+                                      "core.tasks.end_of_month_unlock_daily"),
+        "unlock-self-profit-and-principal": (settings.UNLOCK_EVERY, "core.tasks.unlock_self_profit_and_principal"),
+        "resume-wallet-tasks": (settings.WALLET_TASK_RESUME_AFTER, "core.tasks.resume_wallet_tasks"),
+        "compact-ledger-checkpoints": (settings.LEDGER_COMPACTION_EVERY, "core.tasks.compact_ledger_checkpoints"),
+        "extend-ledger-partitions": (crontab(hour=1, minute=0), "core.tasks.extend_ledger_partitions"),
+        # purchases and caches
+        "refresh-ton-rate": (settings.TON_RATE_REFRESH_EVERY, "core.tasks.refresh_ton_rate"),
+        "resume-purchase-intakes": (settings.PURCHASE_INTAKE_RESUME_AFTER, "core.tasks.resume_purchase_intakes"),
+        "verify-purchases": (settings.PURCHASE_VERIFY_EVERY, "core.tasks.verify_purchases"),
+        "flush-ledger-buffer": (settings.LEDGER_BUFFER_FLUSH_EVERY, "core.tasks.flush_ledger_buffer"),
+    }
+    for name, (every, task) in schedule.items():
+        sender.add_periodic_task(every, sender.signature(task), name=name)
@@ -1,14 +1,27 @@
 from pathlib import Path
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+
+def env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(int(default))).strip().lower() in ("1", "true", "yes", "on")
+
+
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY", "dev-secret")
-DEBUG = True
-ALLOWED_HOSTS = ["*"]
+# development by default; production sets DJANGO_DEBUG=0 (see gunicorn.conf.py)
+DEBUG = env_bool("DJANGO_DEBUG", True)
+ALLOWED_HOSTS = [h for h in os.getenv("DJANGO_ALLOWED_HOSTS", "*").split(",") if h]
+if not DEBUG:
+    # the development defaults above are not allowed in production
+    if SECRET_KEY == "dev-secret":
+        raise ImproperlyConfigured("DJANGO_SECRET_KEY must be set when DJANGO_DEBUG=0")
+    if not ALLOWED_HOSTS or "*" in ALLOWED_HOSTS:
+        raise ImproperlyConfigured("DJANGO_ALLOWED_HOSTS must list the served host names when DJANGO_DEBUG=0")
 
 INSTALLED_APPS = [
     "django.contrib.admin",
@@ -24,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -35,6 +49,7 @@ MIDDLEWARE = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ["X-Next-Cursor", "Link"]  # keyset pagination (core.pagination)
 
 ROOT_URLCONF = "config.urls"
 
@@ -54,12 +69,52 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "config.wsgi.application"
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# PostgreSQL when POSTGRES_DB is set (docker-compose "db" service), SQLite otherwise
+if os.getenv("POSTGRES_DB"):
+    # the pool is per process: gunicorn workers (WEB_CONCURRENCY) + Celery worker processes,
+    # times DB_POOL_MAX_SIZE, must stay below PostgreSQL max_connections (100 by default)
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "0"))
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB"),
+            "USER": os.getenv("POSTGRES_USER", ""),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "db"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {"connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5"))},
+        }
+    }
+    if DB_POOL_MAX_SIZE:
+        # psycopg 3 pool per worker process; Django requires CONN_MAX_AGE = 0 with it
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+        }
+    else:
+        # persistent connection per worker thread
+        DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", "60"))
+else:
+    # writers take the lock at BEGIN and wait for it instead of failing with "database is locked"
+    SQLITE_INIT = f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))};"
+    if env_bool("SQLITE_WAL", False):
+        # WAL lets readers run alongside the single writer; it converts the database file,
+        # so it is opt-in (the repository ships db.sqlite3)
+        SQLITE_INIT = "PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;" + SQLITE_INIT
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", str(BASE_DIR / "db.sqlite3")),
+            "OPTIONS": {
+                "init_command": SQLITE_INIT,
+                "transaction_mode": "IMMEDIATE",
+                "timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")) / 1000,
+            },
+        }
     }
-}
 
 AUTH_PASSWORD_VALIDATORS = []
 
@@ -69,11 +124,105 @@ USE_I18N = True
 USE_TZ = True
 
 STATIC_URL = "static/"
+STATIC_ROOT = os.getenv("STATIC_ROOT", str(BASE_DIR / "staticfiles"))  # collectstatic; nginx serves it without DEBUG
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Celery
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
-CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://127.0.0.1:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://127.0.0.1:6379/0")  # needed by the shard chords
+CELERY_TIMEZONE = TIME_ZONE  # beat crontabs (config/celery.py) and task run keys use local dates
+# periodic wallet/unlock tasks fan out into this many id-range shards (core.tasks); 1 runs them inline
+PERIODIC_TASK_SHARDS = int(os.getenv("PERIODIC_TASK_SHARDS", "4"))
+UNLOCK_EVERY = int(os.getenv("UNLOCK_EVERY", "600"))  # seconds between unlock_self_profit_and_principal runs
+
+# Cache (shared Redis when REDIS_URL is set, otherwise per-process)
+REDIS_URL = os.getenv("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL}}
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# Metrics (core.metrics): per-process samples flushed into a shared Redis hash
+METRICS_REDIS_URL = os.getenv("METRICS_REDIS_URL", REDIS_URL)
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# /metrics answers "Authorization: Bearer <METRICS_TOKEN>" or these addresses/networks; METRICS_PUBLIC=1 opens it
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_ALLOWED_IPS = os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1")
+METRICS_PUBLIC = env_bool("METRICS_PUBLIC", False)
+
+# Span tracing of the service layer (core.tracing): share of purchase/referral calls recorded
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+
+# Per-wallet response cache for the polling endpoints (core.cache)
+WALLET_CACHE_TTL = int(os.getenv("WALLET_CACHE_TTL", "300"))
+
+# Async reward_status / wallet_view (core.async_views); on by default when served over ASGI
+ASYNC_POLLING_VIEWS = env_bool("ASYNC_POLLING_VIEWS", os.getenv("SERVER_MODE", "wsgi") == "asgi")
+
+# In-process LRU of wallet_address -> user id for read-only lookups (core.services.find_user)
+USER_LOOKUP_CACHE_SIZE = int(os.getenv("USER_LOOKUP_CACHE_SIZE", "10000"))
+
+# TON/USD rate provider (core.rates)
+TON_RATE_SOURCE = os.getenv("TON_RATE_SOURCE", "core.rates.CoinGeckoSource")
+TON_RATE_URL = os.getenv(
+    "TON_RATE_URL", "https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=usd"
+)
+TON_RATE_STATIC = os.getenv("TON_RATE_STATIC", "5")
+TON_RATE_TTL = int(os.getenv("TON_RATE_TTL", "60"))  # seconds a sample is fresh
+TON_RATE_STALE_TTL = int(os.getenv("TON_RATE_STALE_TTL", "600"))  # extra seconds it may be served stale
+TON_RATE_REFRESH_EVERY = int(os.getenv("TON_RATE_REFRESH_EVERY", str(max(TON_RATE_TTL * 3 // 4, 1))))
+
+# Purchase ingestion: "sync" runs register_purchase in the request, "async"
+# records a PurchaseIntake and returns 202 (core.tasks.process_purchase_intake)
+PURCHASE_INGEST_MODE = os.getenv("PURCHASE_INGEST_MODE", "sync")
+PURCHASE_INTAKE_RESUME_AFTER = int(os.getenv("PURCHASE_INTAKE_RESUME_AFTER", "300"))
+
+# Unlock engine (core.unlocks): purchases released per short transaction
+UNLOCK_CHUNK_SIZE = int(os.getenv("UNLOCK_CHUNK_SIZE", "1000"))
+
+# Buffered ledger writes of the tick claim (core.ledger_buffer); empty URL writes rows directly
+LEDGER_BUFFER_REDIS_URL = os.getenv("LEDGER_BUFFER_REDIS_URL", REDIS_URL)
+LEDGER_BUFFER_FLUSH_EVERY = int(os.getenv("LEDGER_BUFFER_FLUSH_EVERY", "5"))  # seconds
+LEDGER_BUFFER_FLUSH_SIZE = int(os.getenv("LEDGER_BUFFER_FLUSH_SIZE", "5000"))  # rows that trigger an early flush
+
+# Monthly Ledger partitions (core.partitions, PostgreSQL): converting locks and copies the
+# whole table, so migrate only does it when asked; the daily task keeps months ahead created
+LEDGER_PARTITIONING = env_bool("LEDGER_PARTITIONING", False)
+LEDGER_PARTITION_MONTHS_AHEAD = int(os.getenv("LEDGER_PARTITION_MONTHS_AHEAD", "3"))
+
+# Mass wallet tasks (core.bulk): wallets per short transaction, ledger rows per insert batch
+WALLET_TASK_CHUNK_SIZE = int(os.getenv("WALLET_TASK_CHUNK_SIZE", "5000"))
+LEDGER_BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", "5000"))
+# share of wall time a mass task may spend inside chunk transactions (1 = no pause between chunks)
+WALLET_TASK_DUTY_CYCLE = float(os.getenv("WALLET_TASK_DUTY_CYCLE", "0.5"))
+# checkpointed runs (core.models.TaskCheckpoint) without progress for this long are re-queued
+WALLET_TASK_RESUME_AFTER = int(os.getenv("WALLET_TASK_RESUME_AFTER", "600"))
+
+# Ledger checkpoints (core.audit): ledger ids folded per short transaction, seconds between passes
+LEDGER_COMPACTION_CHUNK_SIZE = int(os.getenv("LEDGER_COMPACTION_CHUNK_SIZE", "50000"))
+LEDGER_COMPACTION_EVERY = int(os.getenv("LEDGER_COMPACTION_EVERY", "300"))
+# rows younger than this are not folded yet; must exceed the longest transaction that writes ledger rows
+LEDGER_COMPACTION_SAFETY_SECONDS = int(os.getenv("LEDGER_COMPACTION_SAFETY_SECONDS", "600"))
+
+# Admin payout runs (core.payouts): requests per transition statement / export fetch
+PAYOUT_CHUNK_SIZE = int(os.getenv("PAYOUT_CHUNK_SIZE", "2000"))
+
+# On-chain purchase verification (core.verification): when on, purchases are
+# registered PENDING and credited only after the worker confirms the transaction
+PURCHASE_VERIFICATION = env_bool("PURCHASE_VERIFICATION", False)
+CHAIN_CLIENT = os.getenv("CHAIN_CLIENT", "core.chain.TonCenterClient")
+CHAIN_FAKE_ACCEPT_ALL = env_bool("CHAIN_FAKE_ACCEPT_ALL", False)  # core.chain.FakeChainClient
+TON_API_URL = os.getenv("TON_API_URL", "https://toncenter.com/api/v3")
+TON_API_KEY = os.getenv("TON_API_KEY", "")
+TON_API_TIMEOUT = float(os.getenv("TON_API_TIMEOUT", "10"))
+TON_RECEIVER_ADDRESS = os.getenv("TON_RECEIVER_ADDRESS", "")  # the project wallet purchases must pay into
+CHAIN_VERIFY_BATCH_SIZE = int(os.getenv("CHAIN_VERIFY_BATCH_SIZE", "200"))  # purchases per worker pass
+CHAIN_VERIFY_CONCURRENCY = int(os.getenv("CHAIN_VERIFY_CONCURRENCY", "8"))  # parallel chain requests
+CHAIN_VERIFY_MAX_ATTEMPTS = int(os.getenv("CHAIN_VERIFY_MAX_ATTEMPTS", "20"))
+CHAIN_VERIFY_RETRY_DELAY = int(os.getenv("CHAIN_VERIFY_RETRY_DELAY", "30"))  # seconds, doubles per attempt
+PURCHASE_VERIFY_EVERY = int(os.getenv("PURCHASE_VERIFY_EVERY", "15"))
+if PURCHASE_VERIFICATION and not TON_RECEIVER_ADDRESS:
+    raise ImproperlyConfigured("TON_RECEIVER_ADDRESS must be set when PURCHASE_VERIFICATION is on")
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [],
@@ -1,5 +1,10 @@
-from django.contrib import admin
-from .models import AppUser, Wallet, Ledger, Purchase, WithdrawRequest
+from django.contrib import admin, messages
+from django.db.models import DecimalField, F, IntegerField
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from . import payouts
+from .cache import invalidate_wallet
+from .models import AppUser, Wallet, Ledger, LedgerCheckpoint, Purchase, PurchaseIntake, TaskCheckpoint, WithdrawRequest
 
 @admin.register(AppUser)
 class AppUserAdmin(admin.ModelAdmin):
@@ -21,23 +26,88 @@ class WalletAdmin(admin.ModelAdmin):
     )
     search_fields = ("user__wallet_address",)
 
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+        else:
+            # only the fields the operator changed; balances move by the edit's delta so credits and
+            # debits that landed on the row since the form was opened are kept
+            updates = {}
+            for name in form.changed_data:
+                value, initial = form.cleaned_data[name], form.initial.get(name)
+                if isinstance(Wallet._meta.get_field(name), (DecimalField, IntegerField)) and initial is not None:
+                    updates[name] = F(name) + (value - initial)
+                else:
+                    updates[name] = value
+            if updates:
+                Wallet.objects.filter(pk=obj.pk).update(updated_at=timezone.now(), **updates)
+        invalidate_wallet(obj.user.wallet_address)
+
 @admin.register(Ledger)
 class LedgerAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "typ", "amount", "created_at")
+    list_display = ("id", "user", "typ", "amount", "invoice", "created_at")
     list_filter = ("typ", "created_at")
-    search_fields = ("user__wallet_address",)
+    search_fields = ("user__wallet_address", "=invoice")
     readonly_fields = ("created_at",)
 
 @admin.register(Purchase)
 class PurchaseAdmin(admin.ModelAdmin):
-    list_display = ("id", "invoice_no", "user", "ton_amount", "usd_value", "ecg_value", "ton_tx_hash", "created_at")
+    list_display = ("id", "invoice_no", "user", "ton_amount", "usd_value", "ecg_value", "ton_tx_hash",
+                    "verification_status", "created_at")
     search_fields = ("invoice_no", "ton_tx_hash", "user__wallet_address")
-    list_filter = ("created_at",)
+    list_filter = ("verification_status", "created_at")
     readonly_fields = ("created_at",)
 
+@admin.register(PurchaseIntake)
+class PurchaseIntakeAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "ton_amount", "ton_tx_hash", "status", "attempts", "purchase", "updated_at")
+    list_filter = ("status", "created_at")
+    search_fields = ("ton_tx_hash", "user__wallet_address")
+    readonly_fields = ("created_at", "updated_at")
+
+@admin.register(TaskCheckpoint)
+class TaskCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("run_key", "status", "next_pk", "end_pk", "wallets", "ledgers", "chunks", "started_at",
+                    "finished_at")
+    list_filter = ("status", "task")
+    search_fields = ("run_key",)
+    readonly_fields = ("started_at", "updated_at", "finished_at")
+
+@admin.register(LedgerCheckpoint)
+class LedgerCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("user", "next_ledger_id", "rewards_count", "updated_at")
+    search_fields = ("user__wallet_address",)
+    readonly_fields = ("updated_at",)
+    list_select_related = ("user",)
+
 @admin.register(WithdrawRequest)
 class WithdrawRequestAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "scope", "amount", "destination_wallet", "status", "created_at")
+    list_display = ("id", "user", "scope", "amount", "destination_wallet", "status", "created_at", "processed_at")
     list_filter = ("status", "scope", "created_at")
     search_fields = ("user__wallet_address", "destination_wallet")
-    readonly_fields = ("created_at",)
\ No newline at end of file
+    readonly_fields = ("debited", "created_at", "processed_at")
+    list_select_related = ("user",)
+    actions = ("approve_selected", "reject_selected", "export_payouts_csv", "export_payouts_jsonl")
+
+    @admin.action(description="Approve selected pending requests")
+    def approve_selected(self, request, queryset):
+        n = payouts.approve_withdrawals(queryset)
+        self.message_user(request, f"{n} requests approved.", messages.SUCCESS)
+
+    @admin.action(description="Reject selected pending requests (refund to wallet)")
+    def reject_selected(self, request, queryset):
+        n = payouts.reject_withdrawals(queryset)
+        self.message_user(request, f"{n} requests rejected and refunded.", messages.SUCCESS)
+
+    @admin.action(description="Export approved payouts (CSV)")
+    def export_payouts_csv(self, request, queryset):
+        response = StreamingHttpResponse(payouts.stream_csv(payouts.payout_rows(queryset)), content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="payouts-{timezone.now():%Y%m%d-%H%M%S}.csv"'
+        return response
+
+    @admin.action(description="Export approved payouts (JSON lines)")
+    def export_payouts_jsonl(self, request, queryset):
+        response = StreamingHttpResponse(payouts.stream_jsonl(payouts.payout_rows(queryset)),
+                                         content_type="application/x-ndjson")
+        response["Content-Disposition"] = f'attachment; filename="payouts-{timezone.now():%Y%m%d-%H%M%S}.jsonl"'
+        return response
\ No newline at end of file
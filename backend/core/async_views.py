@@ -0,0 +1,42 @@
+"""
+نسخه‌های async از endpoint های پرتکرارِ polling (reward_status و wallet_view)
+
+زیر ASGI یک پروسه می‌تواند هزاران polling همزمان را بدون گرفتن یک thread برای
+هر درخواست جواب دهد: کش از Redis با redis.asyncio خوانده می‌شود (core.cache)
+و فقط در cache miss سراغ ORM async می‌رویم. خروجی دقیقا همان خروجی view های
+sync است (همان payload و همان JSONRenderer). core.urls بر اساس
+ASYNC_POLLING_VIEWS یکی از دو نسخه را وصل می‌کند؛ زیر WSGI همان view های sync.
+"""
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.renderers import JSONRenderer
+
+from . import cache as wallet_cache
+from .services import afind_user
+from .views import reward_status_payload, reward_status_response, wallet_payload
+
+_renderer = JSONRenderer()
+
+
+def _json(data, status: int = 200) -> HttpResponse:
+    return HttpResponse(_renderer.render(data), status=status, content_type="application/json")
+
+
+@require_GET
+async def wallet_view(request, wallet_address):
+    async def build():
+        return wallet_payload(await afind_user(wallet_address))
+
+    return _json(await wallet_cache.aget_or_build("wallet", wallet_address, build))
+
+
+@require_GET
+async def reward_status(request):
+    wallet_address = request.GET.get("wallet_address")
+    if not wallet_address:
+        return _json({"error": "wallet_address required"}, status=400)
+
+    async def build():
+        return reward_status_payload(await afind_user(wallet_address))
+
+    return _json(reward_status_response(await wallet_cache.aget_or_build("reward_status", wallet_address, build)))
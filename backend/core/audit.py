@@ -0,0 +1,343 @@
+"""
+Ledger-derived balances and per-user ledger checkpoints.
+
+``LEDGER_EFFECTS`` says how every ``Ledger.typ`` moves the ``Wallet`` buckets.
+Withdrawals write one row per bucket they take from (and refunds one per
+bucket they give back), so every bucket is checked on its own.
+
+``LedgerCheckpoint`` stores those per-bucket totals for each user up to a
+ledger id. ``compact_checkpoints`` (task ``compact_ledger_checkpoints``) folds
+new ledger rows into the checkpoints in id-range chunks. Ids are handed out
+at insert, not at commit, so a row can become visible below ids that were
+already folded. A pass therefore only goes up to the horizon the previous
+pass fixed, and that horizon stays behind the ledger by
+``LEDGER_COMPACTION_SAFETY_SECONDS``: it ends before the first row created
+inside that window, and after the newest row created before it. A row is only
+skipped if its transaction stayed open longer than the margin.
+``expected_balances`` is the checkpoint plus
+the user's rows after it, which keeps recomputation and ``audit_wallet`` O(delta).
+
+``reconcile`` checks every wallet at once: one grouped aggregation over
+``Ledger`` in user order, merge-joined with the ``Wallet`` table streamed in
+the same order, yielding only the users that disagree
+(``manage.py reconcile_wallets``). Wallets older than the ledger need their
+``OPENING_*`` rows first (``manage.py backfill_opening_balances``, once).
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.utils import timezone
+
+from .bulk import apply_wallet_deltas
+from .models import Ledger, LedgerCheckpoint, TaskCheckpoint, Wallet
+from .services import WITHDRAW_LEDGER_TYPES
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (
+    "referral_bonus",
+    "daily_reward_locked",
+    "daily_reward_unlocked",
+    "downline_profit_instant",
+    "self_profit_locked",
+    "self_profit_unlocked",
+    "principal_locked",
+    "principal_unlocked",
+)
+
+# bucket -> typ of the row carrying what a wallet held before the ledger existed
+# (backfill_opening_balances); the amount of OPENING_REWARDS_COUNT is a claim count
+OPENING_LEDGER_TYPES = {field: "OPENING_" + field.upper() for field in BUCKETS + ("rewards_count",)}
+
+# typ -> {bucket: sign}
+LEDGER_EFFECTS = {
+    "REF_BONUS": {"referral_bonus": 1},
+    "DAILY_ADD": {"daily_reward_locked": 1},
+    "DAILY_RELEASE": {"daily_reward_locked": -1, "daily_reward_unlocked": 1},
+    "DAILY_UNLOCK": {"daily_reward_unlocked": 1},
+    "BUY_PRINCIPAL": {"principal_locked": 1},
+    "BUY_SELF_PROFIT": {"self_profit_locked": 1},
+    "SELF_PROFIT_UNLOCK": {"self_profit_locked": -1, "self_profit_unlocked": 1},
+    "PRINCIPAL_UNLOCK": {"principal_locked": -1, "principal_unlocked": 1},
+    "DOWNLINE_PROFIT": {"downline_profit_instant": 1},
+    # withdrawals: one row per bucket taken from, one per bucket refunded to
+    **{debit: {bucket: -1} for bucket, (debit, _) in WITHDRAW_LEDGER_TYPES.items()},
+    **{refund: {bucket: 1} for bucket, (_, refund) in WITHDRAW_LEDGER_TYPES.items()},
+    **{typ: {field: 1} for field, typ in OPENING_LEDGER_TYPES.items()},
+}
+# typ -> counter incremented once per row
+LEDGER_COUNTS = {"DAILY_UNLOCK": "rewards_count"}
+
+CHECKPOINT_FIELDS = BUCKETS + ("rewards_count",)
+COMPACTION_KEY = "LEDGER_COMPACTION"
+
+
+def effects(typ: str) -> dict:
+    try:
+        return LEDGER_EFFECTS[typ]
+    except KeyError:
+        raise ValueError(f"no LEDGER_EFFECTS entry for ledger type {typ!r}")
+
+
+def add_effects(totals: dict, typ: str, amount: Decimal, rows: int) -> None:
+    """Fold ``rows`` ledger rows of ``typ`` summing to ``amount`` into ``totals``."""
+    for field, sign in effects(typ).items():
+        totals[field] += amount * sign
+    counter = LEDGER_COUNTS.get(typ)
+    if counter:
+        totals[counter] += rows
+
+
+def compare(wallet: dict, expected: dict) -> list:
+    """``[(field, wallet value, expected value)]`` for every bucket that disagrees."""
+    mismatches = []
+    for field in BUCKETS:
+        if wallet[field] != expected.get(field, 0):
+            mismatches.append((field, wallet[field], expected.get(field, Decimal("0"))))
+    if "rewards_count" in wallet and wallet["rewards_count"] != expected.get("rewards_count", 0):
+        mismatches.append(("rewards_count", wallet["rewards_count"], expected.get("rewards_count", 0)))
+    return mismatches
+
+
+# ---------------------------------------------------------------------------
+# per-user recomputation
+
+def expected_balances(user_id: int) -> dict:
+    """Ledger totals per bucket for one user: checkpoint + rows after it."""
+    checkpoint = LedgerCheckpoint.objects.filter(user_id=user_id).first()
+    totals = defaultdict(Decimal)
+    since = 0
+    if checkpoint is not None:
+        since = checkpoint.next_ledger_id
+        for field in CHECKPOINT_FIELDS:
+            totals[field] = getattr(checkpoint, field)
+    rows = (Ledger.objects.filter(user_id=user_id, id__gte=since)
+            .values_list("typ").annotate(total=Sum("amount"), rows=Count("id")).order_by())
+    for typ, total, n in rows:
+        add_effects(totals, typ, total, n)
+    totals["rewards_count"] = int(totals["rewards_count"])
+    return dict(totals)
+
+
+def audit_wallet(user_id: int) -> list:
+    """Bucket mismatches between a user's Wallet and their ledger."""
+    wallet = Wallet.objects.filter(user_id=user_id).values(*BUCKETS, "rewards_count").get()
+    return compare(wallet, expected_balances(user_id))
+
+
+# ---------------------------------------------------------------------------
+# compaction
+
+def compact_range(lo: int, hi: int) -> tuple:
+    """Fold ledger rows with ``lo <= id < hi`` into the checkpoints. Returns (rows, users)."""
+    deltas = defaultdict(lambda: defaultdict(Decimal))
+    rows = 0
+    sums = (Ledger.objects.filter(id__gte=lo, id__lt=hi)
+            .values_list("user_id", "typ").annotate(total=Sum("amount"), rows=Count("id")).order_by())
+    for user_id, typ, total, n in sums:
+        add_effects(deltas[user_id], typ, total, n)
+        rows += n
+    if not deltas:
+        return 0, 0
+    LedgerCheckpoint.objects.bulk_create([LedgerCheckpoint(user_id=u) for u in deltas], ignore_conflicts=True)
+    apply_wallet_deltas(deltas, model=LedgerCheckpoint, next_ledger_id=hi)
+    return rows, len(deltas)
+
+
+def settled_horizon(since: int, now) -> int:
+    """
+    First ledger id (>= ``since``) the next pass must not reach: past the newest
+    row created before the safety margin, but not past any row created inside it.
+    """
+    cutoff = now - timedelta(seconds=settings.LEDGER_COMPACTION_SAFETY_SECONDS)
+    newer = Ledger.objects.filter(id__gte=since)
+    settled = newer.filter(created_at__lt=cutoff).aggregate(hi=Max("id"))["hi"]
+    if settled is None:
+        return since
+    recent = newer.filter(id__lt=settled, created_at__gte=cutoff).aggregate(lo=Min("id"))["lo"]
+    return recent if recent is not None else settled + 1
+
+
+def compact_checkpoints(chunk_size: int = None, max_chunks: int = None, now=None) -> dict:
+    """One incremental compaction pass (resumable: progress lives in a ``TaskCheckpoint``)."""
+    chunk_size = chunk_size or settings.LEDGER_COMPACTION_CHUNK_SIZE
+    started = time.monotonic()
+    state, _ = TaskCheckpoint.objects.get_or_create(run_key=COMPACTION_KEY)
+    lo, horizon = state.next_pk, state.end_pk
+    rows = users = chunks = 0
+    while lo < horizon and (max_chunks is None or chunks < max_chunks):
+        hi = min(lo + chunk_size, horizon)
+        with transaction.atomic():
+            # claim the range; a concurrent pass stops here
+            if not TaskCheckpoint.objects.filter(pk=state.pk, next_pk=lo).update(
+                    next_pk=hi, chunks=F("chunks") + 1, updated_at=timezone.now()):
+                logger.warning("[COMPACT] range %s.. taken by another pass", lo)
+                break
+            n_rows, n_users = compact_range(lo, hi)
+            TaskCheckpoint.objects.filter(pk=state.pk).update(ledgers=F("ledgers") + n_rows)
+        rows += n_rows
+        users += n_users
+        chunks += 1
+        lo = hi
+    else:
+        # the next pass may go up to what has settled by now
+        newest = settled_horizon(horizon, now or timezone.now())
+        TaskCheckpoint.objects.filter(pk=state.pk, end_pk__lt=newest).update(end_pk=newest, updated_at=timezone.now())
+
+    report = {"rows": rows, "users": users, "chunks": chunks, "next_ledger_id": lo,
+              "duration_ms": int((time.monotonic() - started) * 1000)}
+    logger.info("[COMPACT] %s", report)
+    return report
+
+
+# ---------------------------------------------------------------------------
+# streaming reconciliation
+
+class _Stream:
+    """Sorted ``(user_id, value)`` iterator with one row of lookahead."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.head = next(self._rows, None)
+
+    def take(self, user_id):
+        """The value for ``user_id`` (None if absent); skipped keys are returned as ``orphans``."""
+        orphans = []
+        while self.head is not None and self.head[0] < user_id:
+            orphans.append(self.head[0])
+            self.head = next(self._rows, None)
+        if self.head is not None and self.head[0] == user_id:
+            value = self.head[1]
+            self.head = next(self._rows, None)
+            return value, orphans
+        return None, orphans
+
+    def rest(self):
+        while self.head is not None:
+            yield self.head[0]
+            self.head = next(self._rows, None)
+
+
+def ledger_totals(since: int = 0, chunk_size: int = 5000):
+    """
+    Yield ``(user_id, totals)`` in user order from one grouped aggregation
+    (``GROUP BY user_id, typ``, streamed); only one user's totals are in memory.
+    """
+    qs = Ledger.objects.all()
+    if since:
+        qs = qs.filter(id__gte=since)
+    rows = (qs.values_list("user_id", "typ").annotate(total=Sum("amount"), rows=Count("id"))
+            .order_by("user_id", "typ"))
+    current, totals = None, None
+    for user_id, typ, total, n in rows.iterator(chunk_size=chunk_size):
+        if user_id != current:
+            if current is not None:
+                yield current, totals
+            current, totals = user_id, defaultdict(Decimal)
+        add_effects(totals, typ, total, n)
+    if current is not None:
+        yield current, totals
+
+
+def checkpoint_totals(chunk_size: int = 5000):
+    rows = LedgerCheckpoint.objects.order_by("user_id").values_list("user_id", *CHECKPOINT_FIELDS)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield row[0], dict(zip(CHECKPOINT_FIELDS, row[1:]))
+
+
+def reconcile(incremental: bool = False, chunk_size: int = 5000):
+    """
+    Merge-join ``Wallet`` (in user order) with the expected balances and yield
+    ``(user_id, wallet_address, mismatches)`` for every user that disagrees.
+    Ledger rows or checkpoints of users without a wallet are reported (once)
+    with a ``wallet`` mismatch. With ``incremental`` the expectation is the
+    checkpoints plus the rows from the compaction watermark on, instead of the
+    whole ledger.
+    """
+    since = 0
+    checkpoints = None
+    if incremental:
+        state = TaskCheckpoint.objects.filter(run_key=COMPACTION_KEY).first()
+        since = state.next_pk if state else 0
+        checkpoints = _Stream(checkpoint_totals(chunk_size))
+    ledger = _Stream(ledger_totals(since, chunk_size))
+    wallets = (Wallet.objects.order_by("user_id")
+               .values_list("user_id", "user__wallet_address", "rewards_count", *BUCKETS))
+
+    for user_id, address, rewards_count, *buckets in wallets.iterator(chunk_size=chunk_size):
+        expected = defaultdict(Decimal)
+        orphans = set()
+        if checkpoints is not None:
+            base, skipped = checkpoints.take(user_id)
+            expected.update(base or {})
+            orphans.update(skipped)
+        delta, skipped = ledger.take(user_id)
+        orphans.update(skipped)
+        for orphan in sorted(orphans):
+            yield orphan, None, [("wallet", None, "missing")]
+        for field, amount in (delta or {}).items():
+            expected[field] += amount
+        wallet = dict(zip(BUCKETS, buckets), rewards_count=rewards_count)
+        mismatches = compare(wallet, expected)
+        if mismatches:
+            yield user_id, address, mismatches
+    orphans = set(ledger.rest())
+    if checkpoints is not None:
+        orphans.update(checkpoints.rest())
+    for orphan in sorted(orphans):
+        yield orphan, None, [("wallet", None, "missing")]
+
+
+def backfill_opening_balances(chunk_size: int = 1000) -> dict:
+    """
+    Give every wallet the ledger does not explain (wallets from before the
+    ledger existed) one ``OPENING_*`` row per bucket for the difference, so
+    ``reconcile`` starts from a clean slate. Meant to run once, before
+    reconciliation is relied on; users that already have opening rows are
+    skipped, so a rerun never stacks a second opening on top of real drift.
+    Each chunk locks its wallets and recomputes their expectation.
+    """
+    started = time.monotonic()
+    pending = [user_id for user_id, address, _ in reconcile(chunk_size=chunk_size) if address is not None]
+    users = rows = 0
+    for i in range(0, len(pending), chunk_size):
+        chunk = pending[i:i + chunk_size]
+        with transaction.atomic():
+            opened = set(Ledger.objects.filter(user_id__in=chunk, typ__in=OPENING_LEDGER_TYPES.values())
+                         .values_list("user_id", flat=True))
+            wallets = (Wallet.objects.select_for_update().filter(user_id__in=chunk).exclude(user_id__in=opened)
+                       .order_by("user_id").values("user_id", *OPENING_LEDGER_TYPES))
+            opening = []
+            for wallet in wallets:
+                expected = expected_balances(wallet["user_id"])
+                user_rows = [
+                    Ledger(user_id=wallet["user_id"], typ=typ, amount=wallet[field] - expected.get(field, 0),
+                           meta={"source": "opening_backfill"})
+                    for field, typ in OPENING_LEDGER_TYPES.items() if wallet[field] != expected.get(field, 0)
+                ]
+                users += bool(user_rows)
+                opening.extend(user_rows)
+            Ledger.objects.bulk_create(opening)
+        rows += len(opening)
+    report = {"users": users, "rows": rows, "duration_ms": int((time.monotonic() - started) * 1000)}
+    logger.info("[OPENING] %s", report)
+    return report
+
+
+@contextmanager
+def snapshot():
+    """One consistent read snapshot for both streams (PostgreSQL); a no-op elsewhere."""
+    if connection.vendor != "postgresql":
+        yield
+        return
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        yield
@@ -0,0 +1,274 @@
+"""
+Benchmark harness for the core API endpoints and the heavy service paths.
+
+``manage.py benchmark`` runs everything against a throwaway database:
+
+- a threaded WSGI server in this process serves the project, wrapped so every
+  response carries the number of SQL queries it ran (``X-Bench-Queries``);
+- a local stand-in answers the CoinGecko price request, so purchase pricing
+  goes through the real ``CoinGeckoSource`` without touching the network;
+- each endpoint is hit with a pool of client threads per concurrency level,
+  and latency percentiles, requests/second and queries/request are recorded;
+- micro-benchmarks time ``register_purchase`` and the Celery tasks in-process.
+
+Results are plain JSON so runs from different commits can be diffed with
+``--compare``.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+import itertools
+import json
+import math
+import subprocess
+import threading
+import time
+
+import requests
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+ENDPOINTS = ("connect_wallet", "tick", "reward_status", "create_purchase", "request_withdraw")
+QUERIES_HEADER = "X-Bench-Queries"
+
+
+# ---------------------------------------------------------------------------
+# local servers
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class QueryCountingApp:
+    """WSGI wrapper that reports the request's SQL query count in a response header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        count = [0]
+
+        def counter(execute, sql, params, many, context):
+            count[0] += 1
+            return execute(sql, params, many, context)
+
+        def counting_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [(QUERIES_HEADER, str(count[0]))], exc_info)
+
+        with connection.execute_wrapper(counter):
+            return self.app(environ, counting_start_response)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def start_api_server():
+    server = make_server("127.0.0.1", 0, QueryCountingApp(WSGIHandler()),
+                         server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    return _serve(server)
+
+
+def start_rate_stub(rate="5.0"):
+    """Local stand-in for the CoinGecko simple/price endpoint."""
+    body = json.dumps({"the-open-network": {"usd": float(rate)}}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = type("RateStub", (ThreadingMixIn, HTTPServer), {"daemon_threads": True})(("127.0.0.1", 0), Handler)
+    return _serve(server)
+
+
+def server_url(server) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+# ---------------------------------------------------------------------------
+# statistics
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies_ms, queries, errors, wall_s):
+    latencies_ms = sorted(latencies_ms)
+    n = len(latencies_ms)
+    return {
+        "requests": n,
+        "errors": errors,
+        "rps": round(n / wall_s, 1) if wall_s else None,
+        "p50_ms": round(percentile(latencies_ms, 50), 2) if n else None,
+        "p95_ms": round(percentile(latencies_ms, 95), 2) if n else None,
+        "p99_ms": round(percentile(latencies_ms, 99), 2) if n else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# endpoint load
+
+class EndpointLoad:
+    """Builds the HTTP call for request number ``i`` of one endpoint run."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+
+    def request(self, name: str, i: int):
+        address = f"bench-{self.run_id}-{i}"
+        if name == "connect_wallet":
+            return "POST", "/api/connect/", {"wallet_address": address}
+        if name == "tick":
+            return "POST", "/api/wallet/tick/", {"wallet_address": address}
+        if name == "reward_status":
+            return "GET", "/api/wallet/reward_status/", {"wallet_address": address}
+        if name == "create_purchase":
+            return "POST", "/api/purchase/create/", {
+                "wallet_address": address, "ton_amount": "1.5", "ton_tx_hash": f"bench-{self.run_id}-{i}-tx",
+            }
+        if name == "request_withdraw":
+            return "POST", "/api/withdraw/request/", {
+                "wallet_address": address, "scope": "DOWNLINE_ONLY", "amount": "60", "destination_wallet": "bench-dest",
+            }
+        raise ValueError(f"unknown endpoint {name}")
+
+
+def seed_users(run_id: str, count: int) -> None:
+    """Users (with enough downline balance to withdraw) for the endpoint runs."""
+    from .models import AppUser, Wallet
+
+    users = AppUser.objects.bulk_create(
+        [AppUser(wallet_address=f"bench-{run_id}-{i}", referral_code=f"b{run_id}{i}"[:32]) for i in range(count)]
+    )
+    Wallet.objects.bulk_create(
+        [Wallet(user=u, downline_profit_instant=Decimal("100")) for u in users]
+    )
+
+
+def run_endpoint(base_url: str, name: str, load: EndpointLoad, requests_n: int, concurrency: int, offset: int):
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, queries = [], []
+    errors = 0
+
+    def one(i):
+        nonlocal errors
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        method, path, data = load.request(name, offset + i)
+        started = time.perf_counter()
+        if method == "GET":
+            r = session.get(base_url + path, params=data, timeout=30)
+        else:
+            r = session.post(base_url + path, json=data, timeout=30)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if QUERIES_HEADER in r.headers:
+                queries.append(int(r.headers[QUERIES_HEADER]))
+            if r.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_n)))
+    return summarize(latencies, queries, errors, time.perf_counter() - started)
+
+
+# ---------------------------------------------------------------------------
+# micro-benchmarks
+
+def _timed(fn, repeat=1):
+    durations, counts = [], []
+    result = None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            result = fn()
+            durations.append((time.perf_counter() - started) * 1000)
+        counts.append(len(ctx))
+    durations.sort()
+    return {
+        "runs": repeat,
+        "p50_ms": round(percentile(durations, 50), 2),
+        "max_ms": round(durations[-1], 2),
+        "queries": round(sum(counts) / len(counts), 2),
+    }, result
+
+
+def run_micro(run_id: str, iterations: int) -> dict:
+    from .models import Purchase
+    from .services import apply_referral, get_or_create_user, register_purchase
+    from .tasks import daily_reward_add, end_of_month_unlock_daily, unlock_self_profit_and_principal
+
+    inviter = get_or_create_user(f"micro-{run_id}-inviter")
+    buyer = get_or_create_user(f"micro-{run_id}-buyer")
+    apply_referral(inviter.referral_code, buyer)
+    buyer.refresh_from_db()
+
+    counter = itertools.count()
+    results = {}
+    results["register_purchase"], _ = _timed(
+        lambda: register_purchase(buyer, Decimal("1"), f"micro-{run_id}-{next(counter)}"), repeat=iterations
+    )
+
+    past = timezone.now() - timezone.timedelta(days=1)
+    Purchase.objects.update(self_profit_unlock_at=past, principal_unlock_at=past)
+    results["unlock_self_profit_and_principal"], report = _timed(lambda: unlock_self_profit_and_principal(shards=1))
+    results["unlock_self_profit_and_principal"]["report"] = report
+    results["daily_reward_add"], report = _timed(
+        lambda: daily_reward_add(run_key=f"micro-{run_id}-daily", shards=1))
+    results["daily_reward_add"]["report"] = report
+    results["end_of_month_unlock_daily"], report = _timed(
+        lambda: end_of_month_unlock_daily(run_key=f"micro-{run_id}-month", shards=1))
+    results["end_of_month_unlock_daily"]["report"] = report
+    return results
+
+
+# ---------------------------------------------------------------------------
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(old: dict, new: dict):
+    """Yield ``(label, metric, old, new, change %)`` for every shared numeric result."""
+    def walk(a, b, path):
+        for key in sorted(set(a) & set(b)):
+            if isinstance(a[key], dict) and isinstance(b[key], dict):
+                yield from walk(a[key], b[key], path + [key])
+            elif isinstance(a[key], (int, float)) and isinstance(b[key], (int, float)) and key != "requests":
+                change = ((b[key] - a[key]) / a[key] * 100) if a[key] else None
+                yield "/".join(path), key, a[key], b[key], change
+
+    for section in ("endpoints", "micro"):
+        yield from walk(old.get(section, {}), new.get(section, {}), [section])
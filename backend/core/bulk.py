@@ -0,0 +1,292 @@
+"""
+Set-based helpers for mass wallet and ledger writes.
+
+Tasks that credit many wallets at once group their per-user amounts and apply
+them with one ``UPDATE ... SET f = f + CASE user_id WHEN .. END`` per chunk,
+instead of one query (or one ``save()``) per row. ``LedgerWriter`` streams the
+matching ``Ledger`` rows in batches (``COPY`` on PostgreSQL, ``executemany``
+elsewhere), and ``run_wallet_chunks`` walks the wallet table in primary-key
+ranges so both stay in step and memory stays flat. With a run key it
+checkpoints every chunk (``TaskCheckpoint``) so a crashed run can resume, and
+it pauses between chunks to leave room for live traffic.
+"""
+from collections import defaultdict
+from decimal import Decimal
+import csv
+import io
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, Max, Min, Value, When
+from django.utils import timezone
+
+from .models import Ledger, TaskCheckpoint, Wallet
+
+logger = logging.getLogger(__name__)
+
+
+class WalletDeltas:
+    """Accumulates ``{user_id: {field: amount}}`` for a single grouped UPDATE."""
+
+    def __init__(self):
+        self._deltas = defaultdict(lambda: defaultdict(Decimal))
+
+    def add(self, user_id, field, amount) -> None:
+        self._deltas[user_id][field] += amount
+
+    def move(self, user_id, src, dst, amount) -> None:
+        """Move ``amount`` from bucket ``src`` to bucket ``dst``."""
+        self.add(user_id, src, -amount)
+        self.add(user_id, dst, amount)
+
+    def __bool__(self):
+        return bool(self._deltas)
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def apply(self) -> int:
+        return apply_wallet_deltas(self._deltas)
+
+
+def apply_wallet_deltas(deltas, batch_size: int = 500, model=Wallet, **assign) -> int:
+    """
+    Apply ``{user_id: {field: amount}}`` to ``Wallet`` rows (or another
+    per-user ``model``), one statement per ``batch_size`` users (keeps the CASE
+    and its bound parameters small); ``assign`` sets plain values on the same
+    rows. Returns the number of rows updated.
+    """
+    user_ids = list(deltas)
+    updated = 0
+    for start in range(0, len(user_ids), batch_size):
+        updated += _apply_wallet_batch({u: deltas[u] for u in user_ids[start:start + batch_size]}, model, assign)
+    return updated
+
+
+def _apply_wallet_batch(deltas, model=Wallet, assign=None) -> int:
+    by_field = defaultdict(list)
+    for user_id, fields in deltas.items():
+        for field, amount in fields.items():
+            if amount:
+                by_field[field].append(When(user_id=user_id, then=Value(amount)))
+
+    updates = {}
+    for field, whens in by_field.items():
+        output_field = model._meta.get_field(field)
+        updates[field] = F(field) + Case(*whens, default=Value(output_field.to_python(0)), output_field=output_field)
+    if not updates and not assign:
+        return 0
+    return model.objects.filter(user_id__in=list(deltas)).update(**updates, **(assign or {}))
+
+
+class RowWriter:
+    """
+    Buffers plain row tuples for one model and writes them in batches of
+    ``batch_size``: ``COPY`` on PostgreSQL, a single ``executemany`` INSERT
+    elsewhere. ``columns`` are field attnames (``user_id``, not ``user``);
+    explicit values, including primary keys and ``auto_now_add`` timestamps,
+    are written as given.
+
+    Use as a context manager (remaining rows are flushed on a clean exit) or
+    call ``flush()`` yourself; run it inside the transaction that changes the
+    balances so both commit together.
+    """
+
+    def __init__(self, model, columns, batch_size: int = None, using: str = "default"):
+        self.model = model
+        self.columns = tuple(columns)
+        self.fields = [model._meta.get_field(c) for c in self.columns]
+        self.batch_size = batch_size or settings.LEDGER_BATCH_SIZE
+        self.using = using
+        self.written = 0
+        self._rows = []
+
+    def add_row(self, row) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        if connections[self.using].vendor == "postgresql":
+            self._copy(rows)
+        else:
+            self._insert(rows)
+        self.written += len(rows)
+        return len(rows)
+
+    def _table_columns(self) -> str:
+        return ", ".join(connections[self.using].ops.quote_name(f.column) for f in self.fields)
+
+    # field types the database driver takes as-is; everything else goes through get_db_prep_save
+    PASSTHROUGH_TYPES = {
+        "AutoField", "BigAutoField", "BigIntegerField", "BooleanField", "CharField", "DecimalField",
+        "ForeignKey", "IntegerField", "OneToOneField", "PositiveIntegerField",
+        "PositiveSmallIntegerField", "SmallIntegerField", "TextField",
+    }
+
+    def _insert(self, rows) -> None:
+        connection = connections[self.using]
+        placeholders = ", ".join(["%s"] * len(self.fields))
+        sql = f"INSERT INTO {self.model._meta.db_table} ({self._table_columns()}) VALUES ({placeholders})"
+        adapt = [
+            (i, f) for i, f in enumerate(self.fields) if f.get_internal_type() not in self.PASSTHROUGH_TYPES
+        ]
+        params = []
+        for row in rows:
+            row = list(row)
+            for i, f in adapt:
+                row[i] = f.get_db_prep_save(row[i], connection)
+            params.append(row)
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+    @staticmethod
+    def _copy_value(value):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return value
+
+    def _copy(self, rows) -> None:
+        sql = f"COPY {self.model._meta.db_table} ({self._table_columns()}) FROM STDIN"
+        with connections[self.using].cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, "copy"):  # psycopg 3
+                with raw.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row([self._copy_value(v) for v in row])
+            else:  # psycopg2
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                for row in rows:
+                    writer.writerow([
+                        v.isoformat() if hasattr(v, "isoformat") else self._copy_value(v) for v in row
+                    ])
+                buf.seek(0)
+                raw.copy_expert(sql + " WITH (FORMAT csv)", buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+class LedgerWriter(RowWriter):
+    """``RowWriter`` for ``Ledger`` rows."""
+
+    COLUMNS = ("user_id", "typ", "amount", "invoice", "meta", "created_at")
+
+    def __init__(self, batch_size: int = None, using: str = "default"):
+        super().__init__(Ledger, self.COLUMNS, batch_size=batch_size, using=using)
+
+    def add(self, user_id, typ, amount, invoice="", meta=None, created_at=None) -> None:
+        self.add_row((user_id, typ, amount, invoice, meta or {}, created_at or timezone.now()))
+
+
+def pk_ranges(model, chunk_size: int, start: int = None, end: int = None):
+    """Yield half-open ``(lo, hi)`` primary-key ranges covering ``model``'s table (or ``[start, end)``)."""
+    bounds = model.objects.aggregate(lo=Min("pk"), hi=Max("pk"))
+    if bounds["lo"] is None:
+        return
+    lo = max(bounds["lo"], start or 0)
+    hi = bounds["hi"] if end is None else min(bounds["hi"], end - 1)
+    while lo <= hi:
+        yield lo, min(lo + chunk_size, hi + 1)
+        lo += chunk_size
+
+
+def shard_ranges(model, shards: int, field: str = "pk"):
+    """Split ``[min(field), max(field)]`` into up to ``shards`` equal half-open ``(lo, hi)`` ranges."""
+    bounds = model.objects.aggregate(lo=Min(field), hi=Max(field))
+    if bounds["lo"] is None:
+        return []
+    lo, hi = bounds["lo"], bounds["hi"] + 1
+    step = max(1, -(-(hi - lo) // max(shards, 1)))
+    return [(a, min(a + step, hi)) for a in range(lo, hi, step)]
+
+
+def throttle(elapsed: float) -> None:
+    """
+    Pause after a chunk so a mass task holds row locks at most
+    ``WALLET_TASK_DUTY_CYCLE`` of the time (slower chunks -> longer pauses).
+    """
+    duty = settings.WALLET_TASK_DUTY_CYCLE
+    if 0 < duty < 1:
+        time.sleep(elapsed * (1 / duty - 1))
+
+
+def _checkpoint(run_key: str, task: str, start: int = None, end: int = None):
+    # the bounds are fixed by the first attempt, so a resumed run covers the same wallets
+    if end is None:
+        end = (Wallet.objects.aggregate(hi=Max("pk"))["hi"] or 0) + 1
+    checkpoint, _ = TaskCheckpoint.objects.get_or_create(
+        run_key=run_key, defaults={"task": task, "next_pk": start or 0, "end_pk": end})
+    return checkpoint
+
+
+def run_wallet_chunks(name: str, apply_chunk, chunk_size: int = None, key: str = None, task: str = "",
+                      start: int = None, end: int = None) -> dict:
+    """
+    Run ``apply_chunk(wallets, ledger)`` for every primary-key range of the
+    wallet table (or of ``[start, end)``, one shard), each in its own short
+    transaction with its own ``LedgerWriter``. ``apply_chunk`` returns the
+    number of wallets it changed.
+
+    With a ``key`` the run is checkpointed in ``TaskCheckpoint``: each chunk
+    advances ``next_pk`` in its own transaction, so running the same key again
+    (a crashed or redelivered task, see ``resume_wallet_tasks``) continues after
+    the last committed chunk, and a finished key does nothing.
+    """
+    chunk_size = chunk_size or settings.WALLET_TASK_CHUNK_SIZE
+    started = time.monotonic()
+    wallets = ledgers = chunks = 0
+
+    checkpoint = _checkpoint(key, task, start, end) if key else None
+    if checkpoint is not None:
+        if checkpoint.status == "DONE":
+            logger.info("[%s] run %s already done", name, key)
+            return {"wallets": 0, "ledgers": 0, "duration_ms": 0, "run_key": key, "skipped": True}
+        if checkpoint.chunks:
+            logger.info("[%s] resuming run %s at wallet pk %s", name, key, checkpoint.next_pk)
+        start, end = checkpoint.next_pk, checkpoint.end_pk
+
+    ranges = pk_ranges(Wallet, chunk_size, start=start, end=end)
+    for lo, hi in ranges:
+        chunk_started = time.monotonic()
+        with transaction.atomic():
+            if checkpoint is not None:
+                # claim the range first: a second runner of the same key stops here (row lock + condition)
+                claimed = TaskCheckpoint.objects.filter(
+                    pk=checkpoint.pk, status="RUNNING", next_pk__lte=lo,
+                ).update(next_pk=hi, chunks=F("chunks") + 1, updated_at=timezone.now())
+                if not claimed:
+                    logger.warning("[%s] run %s advanced elsewhere, stopping", name, key)
+                    break
+            with LedgerWriter() as ledger:
+                changed = apply_chunk(Wallet.objects.filter(pk__gte=lo, pk__lt=hi), ledger)
+            if checkpoint is not None:
+                TaskCheckpoint.objects.filter(pk=checkpoint.pk).update(
+                    wallets=F("wallets") + changed, ledgers=F("ledgers") + ledger.written)
+        wallets += changed
+        ledgers += ledger.written
+        chunks += 1
+        throttle(time.monotonic() - chunk_started)
+    else:
+        if checkpoint is not None:
+            TaskCheckpoint.objects.filter(pk=checkpoint.pk, status="RUNNING").update(
+                status="DONE", finished_at=timezone.now())
+
+    report = {"wallets": wallets, "ledgers": ledgers, "duration_ms": int((time.monotonic() - started) * 1000)}
+    if key:
+        report["run_key"] = key
+    logger.info("[%s] wallets=%s ledgers=%s chunks=%s duration_ms=%s", name, wallets, ledgers, chunks,
+                report["duration_ms"])
+    return report
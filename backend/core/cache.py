@@ -0,0 +1,128 @@
+"""
+Per-wallet response cache for the polling endpoints.
+
+``wallet_view`` and ``reward_status`` payloads are cached in the shared Django
+cache (Redis in production) under ``wallet:<generation>:<kind>:<address>``.
+Code that changes one wallet calls ``invalidate_wallet`` (after commit); bulk
+tasks call ``invalidate_all_wallets``, which bumps the generation so every old
+key is orphaned in one step and left to expire.
+
+The ASGI polling views use ``aget_or_build``: with Redis it talks to the server
+through ``redis.asyncio``, building keys and values exactly as Django's
+``RedisCache`` does (``make_and_validate_key``, ``RedisSerializer``), so sync
+and async code share the same entries and a cache hit never leaves the event
+loop. Without Redis it falls back to the Django cache's own async API.
+"""
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache, RedisSerializer
+from django.db import transaction
+
+GENERATION_KEY = "wallet:gen"
+KINDS = ("wallet", "reward_status")
+
+
+def _generation() -> int:
+    gen = cache.get(GENERATION_KEY)
+    if gen is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        gen = cache.get(GENERATION_KEY, 1)
+    return gen
+
+
+def _key(kind: str, wallet_address: str, gen: int) -> str:
+    return f"wallet:{gen}:{kind}:{wallet_address}"
+
+
+def get_or_build(kind: str, wallet_address: str, build):
+    """Return the cached payload, or ``build()`` it and cache it. ``None`` is not cached."""
+    key = _key(kind, wallet_address, _generation())
+    payload = cache.get(key)
+    if payload is None:
+        payload = build()
+        if payload is not None:
+            cache.set(key, payload, timeout=settings.WALLET_CACHE_TTL)
+    return payload
+
+
+# -- async (ASGI) ----------------------------------------------------------
+
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> redis.asyncio client
+_serializer = RedisSerializer()
+
+
+def _async_redis():
+    if not (settings.REDIS_URL and isinstance(caches[DEFAULT_CACHE_ALIAS], RedisCache)):
+        return None
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import redis.asyncio as aioredis
+        client = _async_clients[loop] = aioredis.from_url(settings.REDIS_URL)
+    return client
+
+
+async def _aget(key: str):
+    client = _async_redis()
+    if client is None:
+        return await cache.aget(key)
+    value = await client.get(cache.make_and_validate_key(key))
+    return None if value is None else _serializer.loads(value)
+
+
+async def _aset(key: str, value, timeout: int) -> None:
+    client = _async_redis()
+    if client is None:
+        await cache.aset(key, value, timeout=timeout)
+        return
+    await client.set(cache.make_and_validate_key(key), _serializer.dumps(value), ex=timeout)
+
+
+async def _ageneration() -> int:
+    gen = await _aget(GENERATION_KEY)
+    if gen is None:
+        # first use after a flush: let the sync path create the counter
+        gen = await sync_to_async(_generation)()
+    return gen
+
+
+async def aget_or_build(kind: str, wallet_address: str, abuild):
+    """``get_or_build`` for async views; ``abuild`` is a coroutine function."""
+    key = _key(kind, wallet_address, await _ageneration())
+    payload = await _aget(key)
+    if payload is None:
+        payload = await abuild()
+        if payload is not None:
+            await _aset(key, payload, settings.WALLET_CACHE_TTL)
+    return payload
+
+
+# -- invalidation ----------------------------------------------------------
+
+def invalidate_wallet(*wallet_addresses) -> None:
+    """Drop cached payloads for these wallets once the current transaction commits."""
+    addresses = [a for a in wallet_addresses if a]
+    if not addresses:
+        return
+
+    def _delete():
+        gen = _generation()
+        cache.delete_many([_key(kind, a, gen) for a in addresses for kind in KINDS])
+
+    transaction.on_commit(_delete)
+
+
+def invalidate_all_wallets() -> None:
+    """Orphan every cached wallet payload (bulk tasks)."""
+
+    def _bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, 2, timeout=None)
+
+    transaction.on_commit(_bump)
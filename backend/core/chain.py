@@ -0,0 +1,179 @@
+"""
+TON chain clients for purchase verification (core.verification).
+
+``ChainClient.get_transaction(tx_hash)`` returns what the chain says about a
+transaction (``ChainTransaction``: amount, sender, destination, outcome), or
+``None`` when it is not known (yet). Addresses are compared with
+``normalize_address``, which maps the raw (``0:<hex>``) and user-friendly
+(base64) forms of the same account to one string, and transaction hashes
+with ``normalize_tx_hash``, which maps the hex, base64 and base64url forms of
+one hash to lowercase hex. ``ChainTransaction.tx_hash`` is the hash the chain
+returned, in that form, so a transfer credits one purchase however its hash
+was submitted.
+The client is pluggable through ``CHAIN_CLIENT`` (a dotted path), like the
+rate source in ``core.rates``:
+
+- ``TonCenterClient`` asks a toncenter v3 compatible API;
+- ``FakeChainClient`` answers from an in-memory registry, for tests and local
+  runs. With ``accept_unknown`` it confirms every transaction with the
+  amount and sender the purchase claims.
+
+Clients are called from several worker threads at once and must be thread-safe.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+import base64
+import binascii
+import threading
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+NANOTON = Decimal("1000000000")
+
+
+def normalize_address(address: str) -> str:
+    """``<workchain>:<hex>`` for raw and user-friendly TON addresses; anything else as given."""
+    address = (address or "").strip()
+    if ":" in address:
+        workchain, _, account = address.partition(":")
+        return f"{workchain}:{account.lower()}"
+    if len(address) == 48:
+        try:
+            data = base64.urlsafe_b64decode(address.replace("+", "-").replace("/", "_"))
+        except (binascii.Error, ValueError):
+            return address
+        if len(data) == 36:
+            # tag, workchain, 32-byte account id, crc16
+            workchain = int.from_bytes(data[1:2], "big", signed=True)
+            return f"{workchain}:{data[2:34].hex()}"
+    return address
+
+
+def normalize_tx_hash(tx_hash: str) -> str:
+    """Lowercase hex for hex, base64 and base64url transaction hashes; anything else as given."""
+    tx_hash = (tx_hash or "").strip()
+    if len(tx_hash) == 64:
+        try:
+            return bytes.fromhex(tx_hash).hex()
+        except ValueError:
+            return tx_hash
+    if len(tx_hash) in (43, 44):
+        try:
+            data = base64.urlsafe_b64decode(tx_hash.replace("+", "-").replace("/", "_").rstrip("=") + "=")
+        except (binascii.Error, ValueError):
+            return tx_hash
+        if len(data) == 32:
+            return data.hex()
+    return tx_hash
+
+
+def same_address(a: str, b: str) -> bool:
+    return bool(a) and bool(b) and normalize_address(a) == normalize_address(b)
+
+
+@dataclass(frozen=True)
+class ChainTransaction:
+    tx_hash: str
+    ton_amount: Decimal
+    destination: str
+    confirmed_at: datetime
+    success: bool = True
+    source: str = ""  # sender of the incoming message
+
+
+class ChainClient:
+    """Verification upstream. Subclasses implement ``get_transaction``."""
+
+    name = "base"
+
+    def get_transaction(self, tx_hash: str, claimed_amount: Decimal = None, claimed_source: str = None):
+        raise NotImplementedError
+
+
+class TonCenterClient(ChainClient):
+    name = "toncenter"
+
+    def __init__(self, url: str = None, api_key: str = None, timeout: float = None):
+        self.url = (url or settings.TON_API_URL).rstrip("/")
+        self.api_key = api_key if api_key is not None else settings.TON_API_KEY
+        self.timeout = timeout or settings.TON_API_TIMEOUT
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            if self.api_key:
+                session.headers["X-API-Key"] = self.api_key
+        return session
+
+    def get_transaction(self, tx_hash: str, claimed_amount: Decimal = None, claimed_source: str = None):
+        r = self._session().get(f"{self.url}/transactions", params={"hash": tx_hash, "limit": 1},
+                                timeout=self.timeout)
+        r.raise_for_status()
+        transactions = r.json().get("transactions") or []
+        if not transactions:
+            return None
+        tx = transactions[0]
+        in_msg = tx.get("in_msg") or {}
+        description = tx.get("description") or {}
+        return ChainTransaction(
+            tx_hash=normalize_tx_hash(tx.get("hash") or tx_hash),
+            ton_amount=Decimal(str(in_msg.get("value") or 0)) / NANOTON,
+            destination=in_msg.get("destination") or "",
+            confirmed_at=datetime.fromtimestamp(int(tx.get("now") or 0), tz=dt_timezone.utc),
+            success=not description.get("aborted", False),
+            source=in_msg.get("source") or "",
+        )
+
+
+class FakeChainClient(ChainClient):
+    """In-memory chain for tests and local runs."""
+
+    name = "fake"
+
+    def __init__(self, accept_unknown: bool = None):
+        self.accept_unknown = settings.CHAIN_FAKE_ACCEPT_ALL if accept_unknown is None else accept_unknown
+        self.transactions = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def add(self, tx_hash: str, ton_amount, source: str, destination: str = None, success: bool = True) -> None:
+        tx_hash = normalize_tx_hash(tx_hash)
+        self.transactions[tx_hash] = ChainTransaction(
+            tx_hash=tx_hash,
+            ton_amount=Decimal(str(ton_amount)),
+            destination=settings.TON_RECEIVER_ADDRESS if destination is None else destination,
+            confirmed_at=datetime.now(tz=dt_timezone.utc),
+            success=success,
+            source=source,
+        )
+
+    def get_transaction(self, tx_hash: str, claimed_amount: Decimal = None, claimed_source: str = None):
+        with self._lock:
+            self.calls += 1
+        tx_hash = normalize_tx_hash(tx_hash)
+        tx = self.transactions.get(tx_hash)
+        if tx is None and self.accept_unknown and claimed_amount is not None:
+            return ChainTransaction(tx_hash, claimed_amount, settings.TON_RECEIVER_ADDRESS,
+                                    datetime.now(tz=dt_timezone.utc), source=claimed_source or "")
+        return tx
+
+
+_client = None
+
+
+def get_client() -> ChainClient:
+    global _client
+    if _client is None:
+        _client = import_string(settings.CHAIN_CLIENT)()
+    return _client
+
+
+def set_client(client) -> None:
+    """Swap the chain client at runtime (tests); ``None`` reloads it from settings."""
+    global _client
+    _client = client
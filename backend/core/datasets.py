@@ -0,0 +1,346 @@
+"""
+Synthetic dataset generator for scale testing.
+
+``manage.py generate_dataset`` builds a referral forest of complete trees
+(``depth`` levels below each root, ``fanout`` invitees per user) and, for each
+user, the rows the application would have written over its lifetime:
+
+- ``Purchase`` rows spread over the user's history, with the usual 30/365 day
+  unlock dates. Purchases that fell due more than ``backlog_days`` ago are
+  already released (with their unlock ledger rows); the rest are left for
+  ``unlock_self_profit_and_principal``.
+- ``DAILY_ADD`` rows for the last ``daily_days`` days and a ``DAILY_RELEASE``
+  at every month start in that window, tick claims (``DAILY_UNLOCK``),
+  referral bonuses and upline profits.
+- some ``ALL_WITHDRAWABLE`` withdrawal requests in every status, with refunds
+  for rejected ones.
+- the ``ReferralPath`` closure rows and the wallet summary counters.
+
+Wallet balances are the sum of the generated ledger rows, so the data passes
+the same checks real data does. Rows are generated a chunk of users at a time
+with explicit primary keys (so children can point at parents without reading
+anything back) and written through ``RowWriter``: ``COPY`` on PostgreSQL,
+``executemany`` elsewhere. The same seed and arguments give the same rows.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import ROUND_DOWN, Decimal
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .bulk import LedgerWriter, RowWriter, WalletDeltas
+from .cache import invalidate_all_wallets
+from .models import AppUser, Purchase, ReferralPath, Wallet, WithdrawRequest
+from .services import (ECG_PER_USD, REFERRAL_TOKEN_REWARD, SELF_BONUS_RATE, UPLINE_RATE, WITHDRAW_LEDGER_TYPES,
+                       WITHDRAW_WATERFALL)
+
+logger = logging.getLogger(__name__)
+
+DAILY_REWARD = Decimal("1")
+MIN_WITHDRAW = Decimal("60")
+SELF_PROFIT_DAYS = 30
+PRINCIPAL_DAYS = 365
+
+USER_COLUMNS = ("id", "wallet_address", "referral_code", "inviter_id", "created_at",
+                "next_daily_claim_at", "invitee_count")
+WALLET_COLUMNS = ("id", "user_id", "referral_bonus", "daily_reward_locked", "daily_reward_unlocked",
+                  "downline_profit_instant", "self_profit_locked", "self_profit_unlocked",
+                  "principal_locked", "principal_unlocked", "rewards_count", "updated_at")
+PURCHASE_COLUMNS = ("id", "user_id", "invoice_no", "ton_amount", "ton_tx_hash", "ton_usd_rate",
+                    "ton_usd_rate_sample", "ton_usd_rate_at", "usd_value", "ecg_value", "self_profit_5",
+                    "principal_unlock_at", "self_profit_unlock_at", "principal_released",
+                    "self_profit_released", "verification_status", "verification_attempts",
+                    "verification_error", "verified_at", "created_at")
+PATH_COLUMNS = ("ancestor_id", "descendant_id", "depth")
+WITHDRAW_COLUMNS = ("id", "user_id", "scope", "amount", "destination_wallet", "status",
+                    "debited", "created_at", "processed_at")
+BALANCE_FIELDS = WALLET_COLUMNS[2:10]
+
+# statuses of generated withdrawal requests, with their weights
+WITHDRAW_STATUSES = (("PENDING", 40), ("APPROVED", 55), ("REJECTED", 5))
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    users: int
+    depth: int = 4  # levels below each root
+    fanout: int = 5  # invitees per user
+    purchases: float = 1.5  # mean purchases per user
+    claims: float = 20  # mean tick claims per user
+    daily_days: int = 45  # days of DAILY_ADD history
+    withdraw_ratio: float = 0.1  # share of users (with enough balance) that withdrew
+    history_days: int = 400  # how far back users were created
+    backlog_days: int = 2  # due purchases younger than this are left unreleased
+    seed: int = 1
+
+
+class ReferralForest:
+    """
+    Index arithmetic for a forest of complete ``fanout``-ary trees laid out
+    breadth-first: user ``i`` sits at position ``i % tree_size`` of tree
+    ``i // tree_size``, so a parent always comes before its children.
+    """
+
+    def __init__(self, users: int, depth: int, fanout: int):
+        self.users = users
+        self.fanout = fanout
+        self.tree_size = sum(fanout ** d for d in range(depth + 1))
+
+    def parent(self, i: int):
+        base, pos = divmod(i, self.tree_size)
+        if pos == 0:
+            return None
+        return base * self.tree_size + (pos - 1) // self.fanout
+
+    def ancestors(self, i: int):
+        """``(index, depth)`` of every ancestor, nearest first."""
+        result = []
+        depth = 1
+        parent = self.parent(i)
+        while parent is not None:
+            result.append((parent, depth))
+            parent = self.parent(parent)
+            depth += 1
+        return result
+
+    def level(self, i: int) -> int:
+        return len(self.ancestors(i))
+
+    def child_count(self, i: int) -> int:
+        base, pos = divmod(i, self.tree_size)
+        first = pos * self.fanout + 1
+        last = min(first + self.fanout, self.tree_size)
+        offset = base * self.tree_size
+        return max(0, min(last + offset, self.users) - (first + offset))
+
+
+def _next_id(model, using) -> int:
+    return (model.objects.using(using).aggregate(m=Max("pk"))["m"] or 0) + 1
+
+
+def _midnight(d: datetime) -> datetime:
+    return datetime(d.year, d.month, d.day, tzinfo=dt_timezone.utc)
+
+
+class DatasetGenerator:
+    def __init__(self, spec: DatasetSpec, chunk_size: int = None, using: str = "default", now=None):
+        self.spec = spec
+        self.chunk_size = chunk_size or settings.WALLET_TASK_CHUNK_SIZE
+        self.using = using
+        self.now = now or timezone.now()
+        self.forest = ReferralForest(spec.users, spec.depth, spec.fanout)
+        self.rng = random.Random(spec.seed)
+        self.counts = {"users": 0, "purchases": 0, "ledgers": 0, "withdraws": 0, "paths": 0}
+
+        self.user_base = _next_id(AppUser, using)
+        self.wallet_base = _next_id(Wallet, using)
+        self.next_purchase = _next_id(Purchase, using)
+        self.next_withdraw = _next_id(WithdrawRequest, using)
+
+        self.daily_start = _midnight(self.now) - timedelta(days=spec.daily_days)
+        self.release_before = self.now - timedelta(days=spec.backlog_days)
+
+    def user_id(self, i: int) -> int:
+        return self.user_base + i
+
+    def run(self, on_chunk=None) -> dict:
+        started = time.monotonic()
+        for lo in range(0, self.spec.users, self.chunk_size):
+            hi = min(lo + self.chunk_size, self.spec.users)
+            self._chunk(lo, hi)
+            if on_chunk:
+                on_chunk(hi, dict(self.counts))
+
+        self._reset_sequences()
+        invalidate_all_wallets()
+        report = dict(self.counts, duration_ms=int((time.monotonic() - started) * 1000))
+        logger.info("[DATASET] %s", report)
+        return report
+
+    def _chunk(self, lo: int, hi: int) -> None:
+        writer = lambda model, columns: RowWriter(model, columns, using=self.using)
+        with transaction.atomic(using=self.using):
+            self.users_out = writer(AppUser, USER_COLUMNS)
+            self.wallets_out = writer(Wallet, WALLET_COLUMNS)
+            self.purchases_out = writer(Purchase, PURCHASE_COLUMNS)
+            self.paths_out = writer(ReferralPath, PATH_COLUMNS)
+            self.withdraws_out = writer(WithdrawRequest, WITHDRAW_COLUMNS)
+            self.ledger = LedgerWriter(using=self.using)
+            self.upline = WalletDeltas()
+
+            for i in range(lo, hi):
+                self._user(i)
+
+            outputs = (self.users_out, self.wallets_out, self.purchases_out, self.paths_out,
+                       self.withdraws_out, self.ledger)
+            for out in outputs:
+                out.flush()
+            # bonuses and profits owed to inviters, whose wallets exist by now
+            self.upline.apply()
+
+        self.counts["users"] += self.users_out.written
+        self.counts["purchases"] += self.purchases_out.written
+        self.counts["paths"] += self.paths_out.written
+        self.counts["withdraws"] += self.withdraws_out.written
+        self.counts["ledgers"] += self.ledger.written
+
+    # -- one user -------------------------------------------------------------
+
+    def _user(self, i: int) -> None:
+        spec, rng = self.spec, self.rng
+        uid = self.user_id(i)
+        address = f"gen-{spec.seed}-{uid}"
+        parent = self.forest.parent(i)
+        inviter_id = self.user_id(parent) if parent is not None else None
+
+        # deeper levels joined later
+        level = self.forest.level(i)
+        age = spec.history_days * (1 - (level + rng.random()) / (spec.depth + 1))
+        created = self.now - timedelta(days=age)
+        self.wallet = dict.fromkeys(BALANCE_FIELDS, Decimal("0"))
+
+        if inviter_id is not None:
+            self.upline.add(inviter_id, "referral_bonus", REFERRAL_TOKEN_REWARD)
+            self.ledger.add(inviter_id, "REF_BONUS", REFERRAL_TOKEN_REWARD,
+                            meta={"invitee": address}, created_at=created)
+        for ancestor, depth in self.forest.ancestors(i):
+            self.paths_out.add_row((self.user_id(ancestor), uid, depth))
+
+        for _ in range(int(rng.expovariate(1 / spec.purchases)) if spec.purchases else 0):
+            self._purchase(uid, address, inviter_id, created)
+        next_claim = self._claims(uid, created)
+        self._daily(uid, created)
+        if spec.withdraw_ratio and rng.random() < spec.withdraw_ratio:
+            self._withdraw(uid, created)
+
+        self.users_out.add_row((uid, address, f"g{uid:x}", inviter_id, created, next_claim,
+                                self.forest.child_count(i)))
+        self.wallets_out.add_row((self.wallet_base + i, uid, *self.wallet.values(),
+                                  self._rewards_count, self.now))
+
+    def _at(self, start: datetime, end: datetime = None) -> datetime:
+        end = end or self.now
+        return start + (end - start) * self.rng.random()
+
+    def _purchase(self, uid, address, inviter_id, created) -> None:
+        rng = self.rng
+        pid = self.next_purchase
+        self.next_purchase += 1
+
+        at = self._at(created)
+        ton = Decimal(rng.randint(100, 5000)) / 100
+        rate = Decimal(rng.randint(150, 700)) / 100
+        usd = ton * rate
+        ecg = usd * ECG_PER_USD
+        self_bonus = ecg * SELF_BONUS_RATE
+        invoice = f"G{self.spec.seed:x}{pid:x}".upper()
+        tx = f"gen-{self.spec.seed}-{pid}"
+        self_profit_at = at + timedelta(days=SELF_PROFIT_DAYS)
+        principal_at = at + timedelta(days=PRINCIPAL_DAYS)
+        self_profit_released = self_profit_at <= self.release_before
+        principal_released = principal_at <= self.release_before
+
+        self.purchases_out.add_row((pid, uid, invoice, ton, tx, rate, "generated", at, usd, ecg, self_bonus,
+                                    principal_at, self_profit_at, principal_released,
+                                    self_profit_released, "VERIFIED", 0, "", at, at))
+        meta = {"invoice": invoice, "tx": tx, "is_test": False}
+        self.ledger.add(uid, "BUY_PRINCIPAL", ecg, invoice=invoice, meta=meta, created_at=at)
+        self.ledger.add(uid, "BUY_SELF_PROFIT", self_bonus, invoice=invoice, meta=meta, created_at=at)
+
+        if self_profit_released:
+            self.wallet["self_profit_unlocked"] += self_bonus
+            self.ledger.add(uid, "SELF_PROFIT_UNLOCK", self_bonus, invoice=invoice,
+                            meta={"invoice": invoice}, created_at=self_profit_at)
+        else:
+            self.wallet["self_profit_locked"] += self_bonus
+        if principal_released:
+            self.wallet["principal_unlocked"] += ecg
+            self.ledger.add(uid, "PRINCIPAL_UNLOCK", ecg, invoice=invoice,
+                            meta={"invoice": invoice}, created_at=principal_at)
+        else:
+            self.wallet["principal_locked"] += ecg
+
+        if inviter_id is not None:
+            upline_bonus = ecg * UPLINE_RATE
+            self.upline.add(inviter_id, "downline_profit_instant", upline_bonus)
+            self.ledger.add(inviter_id, "DOWNLINE_PROFIT", upline_bonus, invoice=invoice,
+                            meta={"from": f"gen-{self.spec.seed}-{uid}", "invoice": invoice, "tx": tx,
+                                  "is_test": False},
+                            created_at=at)
+
+    def _claims(self, uid, created):
+        days_alive = int((self.now - created).total_seconds() // 86400)
+        n = min(int(self.rng.expovariate(1 / self.spec.claims)) if self.spec.claims else 0, days_alive)
+        self._rewards_count = n
+        if not n:
+            return None
+        claims = sorted(self._at(created) for _ in range(n))
+        for at in claims:
+            self.ledger.add(uid, "DAILY_UNLOCK", DAILY_REWARD, meta={"source": "timer"}, created_at=at)
+        self.wallet["daily_reward_unlocked"] += DAILY_REWARD * n
+        return claims[-1] + timedelta(hours=24)
+
+    def _daily(self, uid, created) -> None:
+        # what daily_reward_add / end_of_month_unlock_daily would have written
+        day = max(self.daily_start, _midnight(created) + timedelta(days=1))
+        while day <= self.now:
+            locked = self.wallet["daily_reward_locked"]
+            if day.day == 1 and locked:
+                self.ledger.add(uid, "DAILY_RELEASE", locked, created_at=day)
+                self.wallet["daily_reward_unlocked"] += locked
+                self.wallet["daily_reward_locked"] = Decimal("0")
+            self.ledger.add(uid, "DAILY_ADD", DAILY_REWARD, created_at=day)
+            self.wallet["daily_reward_locked"] += DAILY_REWARD
+            day += timedelta(days=1)
+
+    def _withdraw(self, uid, created) -> None:
+        # only from the user's own unlocked buckets: inviter credits are applied per chunk
+        buckets = [f for f in WITHDRAW_WATERFALL if f not in ("downline_profit_instant", "referral_bonus")]
+        pool = sum(self.wallet[f] for f in buckets)
+        if pool < MIN_WITHDRAW:
+            return
+        rng = self.rng
+        share = Decimal(rng.randint(0, 100)) / 100
+        amount = (MIN_WITHDRAW + (pool - MIN_WITHDRAW) * share).quantize(Decimal("0.01"), ROUND_DOWN)
+        remaining = amount
+        debited = {}
+        for field in buckets:
+            take = min(self.wallet[field], remaining)
+            if take > 0:
+                debited[field] = str(take)
+            self.wallet[field] -= take
+            remaining -= take
+
+        wid = self.next_withdraw
+        self.next_withdraw += 1
+        status = rng.choices([s for s, _ in WITHDRAW_STATUSES], [w for _, w in WITHDRAW_STATUSES])[0]
+        at = self._at(max(created, self.now - timedelta(days=30)))
+        processed = None if status == "PENDING" else self._at(at)
+        destination = f"gen-dest-{uid}"
+
+        self.withdraws_out.add_row((wid, uid, "ALL_WITHDRAWABLE", amount, destination, status, debited,
+                                    at, processed))
+        for field, taken in debited.items():
+            self.ledger.add(uid, WITHDRAW_LEDGER_TYPES[field][0], Decimal(taken),
+                            meta={"withdraw_request": wid, "destination": destination}, created_at=at)
+        if status == "REJECTED":
+            for field, taken in debited.items():
+                self.wallet[field] += Decimal(taken)
+                self.ledger.add(uid, WITHDRAW_LEDGER_TYPES[field][1], Decimal(taken),
+                                meta={"withdraw_request": wid}, created_at=processed)
+
+    def _reset_sequences(self) -> None:
+        # rows were written with explicit ids; move the sequences past them
+        connection = connections[self.using]
+        statements = connection.ops.sequence_reset_sql(no_style(), [AppUser, Wallet, Purchase, WithdrawRequest])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -0,0 +1,313 @@
+"""
+Bulk import of on-chain purchases (``manage.py import_purchases``).
+
+Replays a file of ``(wallet_address, ton_amount, ton_tx_hash, timestamp)``
+records, CSV with a header row or JSON lines, in batches instead of one
+``register_purchase`` call per record:
+
+- the file is streamed; only one batch is in memory at a time;
+- hashes are stored in one encoding (``core.chain.normalize_tx_hash``) and
+  duplicates are dropped with one ``ton_tx_hash IN (...)`` lookup per batch
+  (and within the batch itself);
+- prices come from a supplied rate table (``timestamp,rate`` rows): each
+  record uses the latest rate at or before its timestamp, and nothing calls
+  CoinGecko;
+- unknown wallets get users and wallets in one ``bulk_create``;
+- purchases go through ``RowWriter`` with the on-chain time as ``created_at``,
+  and unlock dates follow from that time. Purchases that are already due are
+  left to the unlock task;
+- the buyers' locked credits and the upline payouts of a batch are applied with
+  grouped UPDATEs (``WalletDeltas``), and the ledger rows go through
+  ``LedgerWriter``.
+
+Every batch is one transaction. If a live request registers one of its
+transactions concurrently, the unique constraint rejects the batch and it is
+retried once with a fresh duplicate check. Records that cannot be imported
+are passed to ``on_reject`` with a reason.
+"""
+from bisect import bisect_right
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+import csv
+import json
+import logging
+import uuid
+
+from django.db import IntegrityError, transaction
+
+from .bulk import LedgerWriter, RowWriter, WalletDeltas
+from .cache import invalidate_all_wallets
+from .chain import normalize_tx_hash
+from .models import AppUser, Purchase, Wallet
+from .services import ECG_PER_USD, SELF_BONUS_RATE, UPLINE_RATE
+
+logger = logging.getLogger(__name__)
+
+SELF_PROFIT_DAYS = 30
+PRINCIPAL_DAYS = 365
+RATE_SAMPLE = "import"  # Purchase.ton_usd_rate_sample of imported rows
+
+PURCHASE_COLUMNS = ("user_id", "invoice_no", "ton_amount", "ton_tx_hash", "ton_usd_rate", "ton_usd_rate_sample",
+                    "ton_usd_rate_at", "usd_value", "ecg_value", "self_profit_5", "principal_unlock_at",
+                    "self_profit_unlock_at", "principal_released", "self_profit_released",
+                    "verification_status", "verification_attempts", "verification_error", "verified_at",
+                    "created_at")
+
+
+class RecordError(ValueError):
+    """A record that cannot be imported; the message is the reject reason."""
+
+
+def _from_epoch(seconds) -> datetime:
+    try:
+        return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise RecordError(f"bad timestamp {seconds!r}")
+
+
+def parse_timestamp(value) -> datetime:
+    """ISO 8601 (naive means UTC) or unix seconds."""
+    if isinstance(value, (int, float)):
+        return _from_epoch(value)
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        return _from_epoch(seconds)
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise RecordError(f"bad timestamp {value!r}")
+    return ts if ts.tzinfo else ts.replace(tzinfo=dt_timezone.utc)
+
+
+class RateTable:
+    """Historical TON/USD rates; ``rate_at(ts)`` is the latest rate at or before ``ts``."""
+
+    def __init__(self, points):
+        points = sorted(points)
+        self.times = [t for t, _ in points]
+        self.rates = [r for _, r in points]
+
+    @classmethod
+    def from_csv(cls, path: str) -> "RateTable":
+        with open(path, newline="") as f:
+            points = [(parse_timestamp(row["timestamp"]), Decimal(row["rate"])) for row in csv.DictReader(f)]
+        if not points:
+            raise ValueError(f"rate table {path} is empty")
+        return cls(points)
+
+    def rate_at(self, ts: datetime):
+        i = bisect_right(self.times, ts)
+        if i == 0:
+            raise RecordError("no rate before timestamp")
+        return self.rates[i - 1], self.times[i - 1]
+
+
+@dataclass
+class Record:
+    line: int
+    wallet_address: str
+    ton_amount: Decimal
+    ton_tx_hash: str
+    timestamp: datetime
+
+
+def _required(raw: dict, name: str):
+    # csv.DictReader fills the columns of a short row with None
+    value = raw.get(name)
+    if value is None:
+        raise RecordError(f"missing {name}")
+    return value
+
+
+def parse_record(line: int, raw: dict) -> Record:
+    wallet_address = str(_required(raw, "wallet_address")).strip()
+    ton_tx_hash = normalize_tx_hash(str(_required(raw, "ton_tx_hash")))
+    timestamp = parse_timestamp(_required(raw, "timestamp"))
+    try:
+        ton_amount = Decimal(str(_required(raw, "ton_amount")))
+    except InvalidOperation:
+        raise RecordError(f"bad ton_amount {raw.get('ton_amount')!r}")
+    if not ton_amount.is_finite():
+        raise RecordError(f"bad ton_amount {raw.get('ton_amount')!r}")
+    if not wallet_address or not ton_tx_hash:
+        raise RecordError("empty wallet_address or ton_tx_hash")
+    if ton_amount <= 0:
+        raise RecordError("ton_amount must be positive")
+    return Record(line, wallet_address, ton_amount, ton_tx_hash, timestamp)
+
+
+def read_records(path: str, fmt: str = None):
+    """Yield ``(line, raw dict)`` from a CSV (header row) or JSON-lines file."""
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv")
+    with open(path, newline="") as f:
+        if fmt == "csv":
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                yield line, row
+        else:
+            for line, text in enumerate(f, start=1):
+                if text.strip():
+                    try:
+                        yield line, json.loads(text)
+                    except json.JSONDecodeError:
+                        yield line, {"_error": "bad json"}
+
+
+@dataclass
+class ImportReport:
+    read: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    users_created: int = 0
+    upline_payouts: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class PurchaseImporter:
+    def __init__(self, rates: RateTable, batch_size: int = 2000, dry_run: bool = False, on_reject=None):
+        self.rates = rates
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.on_reject = on_reject
+        self.report = ImportReport()
+        # a dry run rolls every batch back, so remember what earlier batches would have written
+        self._dry_txs = set()
+        self._dry_users = set()
+
+    def run(self, raw_records) -> ImportReport:
+        batch = []
+        for line, raw in raw_records:
+            self.report.read += 1
+            if not isinstance(raw, dict):
+                self._reject(line, "", "not an object")
+                continue
+            try:
+                if "_error" in raw:
+                    raise RecordError(raw["_error"])
+                batch.append(parse_record(line, raw))
+            except RecordError as exc:
+                self._reject(line, str(raw.get("ton_tx_hash") or ""), str(exc))
+            if len(batch) >= self.batch_size:
+                self._batch(batch)
+                batch = []
+        if batch:
+            self._batch(batch)
+
+        if self.report.imported and not self.dry_run:
+            invalidate_all_wallets()
+        logger.info("[IMPORT] %s", self.report.as_dict())
+        return self.report
+
+    def _reject(self, line, tx, reason) -> None:
+        self.report.rejected += 1
+        if self.on_reject:
+            self.on_reject(line, tx, reason)
+
+    def _batch(self, records) -> None:
+        priced = []
+        for r in records:
+            try:
+                rate, rate_at = self.rates.rate_at(r.timestamp)
+            except RecordError as exc:
+                self._reject(r.line, r.ton_tx_hash, str(exc))
+                continue
+            priced.append((r, rate, rate_at))
+
+        for attempt in (1, 2):
+            try:
+                with transaction.atomic():
+                    counts = self._write(priced)
+                    if self.dry_run:
+                        transaction.set_rollback(True)
+                break
+            except IntegrityError:
+                # a live request took one of these tx hashes (or addresses); dedupe again
+                if attempt == 2:
+                    raise
+                logger.warning("[IMPORT] batch hit a concurrent insert, retrying")
+        for key, value in counts.items():
+            setattr(self.report, key, getattr(self.report, key) + value)
+
+    def _write(self, priced) -> dict:
+        counts = {"imported": 0, "duplicates": 0, "users_created": 0, "upline_payouts": 0}
+
+        # 1) set-based dedupe: inside the batch, then against Purchase.ton_tx_hash
+        unique = {}
+        for item in priced:
+            tx = item[0].ton_tx_hash
+            if tx in unique:
+                counts["duplicates"] += 1
+            else:
+                unique[tx] = item
+        existing = set(Purchase.objects.filter(ton_tx_hash__in=list(unique))
+                       .values_list("ton_tx_hash", flat=True))
+        if self.dry_run:
+            existing |= self._dry_txs & unique.keys()
+            self._dry_txs.update(unique)
+        counts["duplicates"] += len(existing)
+        fresh = [item for tx, item in unique.items() if tx not in existing]
+        if not fresh:
+            return counts
+
+        # 2) users (and wallets) for every address, created in bulk when missing
+        addresses = {r.wallet_address for r, _, _ in fresh}
+        users, inviters = {}, {}
+        for address, user_id, inviter_id in (AppUser.objects.filter(wallet_address__in=addresses)
+                                             .values_list("wallet_address", "id", "inviter_id")):
+            users[address] = user_id
+            inviters[user_id] = inviter_id
+        missing = sorted(addresses - users.keys())
+        if missing:
+            created = AppUser.objects.bulk_create([
+                AppUser(wallet_address=a, referral_code=uuid.uuid4().hex[:10]) for a in missing
+            ])
+            if created and created[0].pk is None:  # backends without RETURNING
+                created = AppUser.objects.filter(wallet_address__in=missing)
+            Wallet.objects.bulk_create([Wallet(user_id=u.pk) for u in created])
+            for u in created:
+                users[u.wallet_address] = u.pk
+                inviters[u.pk] = None
+            counts["users_created"] = len(set(missing) - self._dry_users)
+            if self.dry_run:
+                self._dry_users.update(missing)
+
+        # 3) purchases, credits, upline payouts and ledger rows
+        deltas = WalletDeltas()
+        with RowWriter(Purchase, PURCHASE_COLUMNS) as purchases, LedgerWriter() as ledger:
+            for r, rate, rate_at in fresh:
+                user_id = users[r.wallet_address]
+                usd_value = r.ton_amount * rate
+                ecg_value = usd_value * ECG_PER_USD
+                self_bonus = ecg_value * SELF_BONUS_RATE
+                invoice_no = uuid.uuid4().hex[:12].upper()
+
+                purchases.add_row((
+                    user_id, invoice_no, r.ton_amount, r.ton_tx_hash, rate, RATE_SAMPLE, rate_at,
+                    usd_value, ecg_value, self_bonus,
+                    r.timestamp + timedelta(days=PRINCIPAL_DAYS), r.timestamp + timedelta(days=SELF_PROFIT_DAYS),
+                    False, False, "VERIFIED", 0, "", r.timestamp, r.timestamp,
+                ))
+                deltas.add(user_id, "principal_locked", ecg_value)
+                deltas.add(user_id, "self_profit_locked", self_bonus)
+                meta = {"invoice": invoice_no, "tx": r.ton_tx_hash, "is_test": False, "source": "import"}
+                ledger.add(user_id, "BUY_PRINCIPAL", ecg_value, invoice=invoice_no, meta=meta, created_at=r.timestamp)
+                ledger.add(user_id, "BUY_SELF_PROFIT", self_bonus, invoice=invoice_no, meta=meta,
+                           created_at=r.timestamp)
+
+                inviter_id = inviters.get(user_id)
+                if inviter_id:
+                    upline_bonus = ecg_value * UPLINE_RATE
+                    deltas.add(inviter_id, "downline_profit_instant", upline_bonus)
+                    ledger.add(inviter_id, "DOWNLINE_PROFIT", upline_bonus, invoice=invoice_no,
+                               meta={"from": r.wallet_address, **meta}, created_at=r.timestamp)
+                    counts["upline_payouts"] += 1
+                counts["imported"] += 1
+        deltas.apply()
+        return counts
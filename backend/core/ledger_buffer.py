@@ -0,0 +1,151 @@
+"""
+Buffered ``Ledger`` writes for hot endpoints (the daily tick claim).
+
+``push`` appends the row to a Redis list (one ``RPUSH``) instead of inserting
+it, so a request pays for its balance UPDATE and nothing else. The
+``flush_ledger_buffer`` task (beat, every ``LEDGER_BUFFER_FLUSH_EVERY``
+seconds, and queued early once ``LEDGER_BUFFER_FLUSH_SIZE`` rows are waiting)
+moves the rows into the table with ``LedgerWriter``:
+
+- under a Redis lock, the buffer is renamed to an in-flight key together with
+  a fresh batch id (one ``MULTI``), so new pushes go to a new buffer;
+- the in-flight rows are written in one database transaction, each tagged with
+  ``meta["buffer"] = batch id``, together with a ``LedgerBufferBatch`` row for
+  the batch id; the in-flight key is deleted afterwards;
+- if a flusher died before that delete, the next run finds the in-flight key
+  again and writes it only when its batch id is not in ``LedgerBufferBatch``
+  (a primary-key lookup). Batch ids older than ``BATCH_RETENTION`` are pruned.
+
+Without ``LEDGER_BUFFER_REDIS_URL`` (or when Redis is unreachable) ``push``
+inserts the row directly. Callers push from ``transaction.on_commit`` so a row
+is only queued for a committed balance change. Readers that need every row
+(reconciliation) call ``flush()`` first.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .bulk import LedgerWriter
+from .models import Ledger, LedgerBufferBatch
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = "ledger:buffer"
+INFLIGHT_KEY = "ledger:buffer:inflight"
+INFLIGHT_ID_KEY = "ledger:buffer:inflight_id"
+LOCK_KEY = "ledger:buffer:lock"
+KICK_KEY = "ledger:buffer:kick"
+LOCK_TTL = 300
+BATCH_RETENTION = timedelta(days=7)  # how long flushed batch ids are kept for recovery
+
+_redis = None
+
+
+def _redis_client():
+    global _redis
+    url = settings.LEDGER_BUFFER_REDIS_URL
+    if not url:
+        return None
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=1)
+    return _redis
+
+
+def _encode(user_id, typ, amount, meta, created_at) -> str:
+    return json.dumps({"u": user_id, "t": typ, "a": str(amount), "m": meta, "c": created_at.isoformat()},
+                      separators=(",", ":"))
+
+
+def push(user_id: int, typ: str, amount: Decimal, meta: dict = None, created_at=None) -> None:
+    """Queue one ledger row (written directly when there is no buffer)."""
+    meta = meta or {}
+    created_at = created_at or timezone.now()
+    client = _redis_client()
+    if client is not None:
+        try:
+            waiting = client.rpush(BUFFER_KEY, _encode(user_id, typ, amount, meta, created_at))
+        except Exception as exc:
+            logger.warning("[LEDGER] buffer push failed, writing directly: %s", exc)
+        else:
+            if waiting >= settings.LEDGER_BUFFER_FLUSH_SIZE:
+                _schedule_flush(client)
+            return
+    Ledger.objects.create(user_id=user_id, typ=typ, amount=amount, meta=meta, created_at=created_at)
+
+
+def _schedule_flush(client) -> None:
+    if not client.set(KICK_KEY, 1, nx=True, ex=2):
+        return
+    try:
+        from .tasks import flush_ledger_buffer
+        flush_ledger_buffer.delay()
+    except Exception:
+        logger.exception("[LEDGER] could not queue buffer flush")
+
+
+def pending() -> int:
+    """Rows waiting in the buffer (including an unfinished flush)."""
+    client = _redis_client()
+    if client is None:
+        return 0
+    return client.llen(BUFFER_KEY) + client.llen(INFLIGHT_KEY)
+
+
+def flush() -> int:
+    """Move buffered rows into ``Ledger``. Returns rows written (0 if another flush is running)."""
+    client = _redis_client()
+    if client is None:
+        return 0
+    token = uuid.uuid4().hex
+    if not client.set(LOCK_KEY, token, nx=True, ex=LOCK_TTL):
+        return 0
+    try:
+        written = 0
+        if client.exists(INFLIGHT_KEY):
+            written += _write_inflight(client, recovering=True)
+        if client.exists(BUFFER_KEY):
+            pipe = client.pipeline(transaction=True)
+            pipe.rename(BUFFER_KEY, INFLIGHT_KEY)
+            pipe.set(INFLIGHT_ID_KEY, uuid.uuid4().hex[:16])
+            pipe.execute()
+            written += _write_inflight(client, recovering=False)
+        if written:
+            logger.info("[LEDGER] flushed %s buffered rows", written)
+        return written
+    finally:
+        if client.get(LOCK_KEY) == token.encode():
+            client.delete(LOCK_KEY)
+
+
+def _write_inflight(client, recovering: bool) -> int:
+    batch_id = (client.get(INFLIGHT_ID_KEY) or b"").decode() or uuid.uuid4().hex[:16]
+    if recovering and LedgerBufferBatch.objects.filter(pk=batch_id).exists():
+        # the previous flusher committed this batch but died before clearing it
+        client.delete(INFLIGHT_KEY, INFLIGHT_ID_KEY)
+        return 0
+
+    written = 0
+    chunk = settings.LEDGER_BATCH_SIZE
+    with transaction.atomic(), LedgerWriter() as ledger:
+        start = 0
+        while True:
+            rows = client.lrange(INFLIGHT_KEY, start, start + chunk - 1)
+            for raw in rows:
+                row = json.loads(raw)
+                ledger.add(row["u"], row["t"], Decimal(row["a"]), meta={**row["m"], "buffer": batch_id},
+                           created_at=datetime.fromisoformat(row["c"]))
+            written += len(rows)
+            if len(rows) < chunk:
+                break
+            start += chunk
+        LedgerBufferBatch.objects.create(batch_id=batch_id, rows=written)
+    client.delete(INFLIGHT_KEY, INFLIGHT_ID_KEY)
+    LedgerBufferBatch.objects.filter(flushed_at__lt=timezone.now() - BATCH_RETENTION).delete()
+    return written
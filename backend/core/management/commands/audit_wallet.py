@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import audit, ledger_buffer
+from core.models import AppUser, LedgerCheckpoint
+
+
+class Command(BaseCommand):
+    help = "Compare wallets with their ledger (checkpoint + rows after it); prints mismatching buckets."
+
+    def add_arguments(self, parser):
+        parser.add_argument("wallet_address", nargs="+")
+
+    def handle(self, *args, wallet_address, **options):
+        ledger_buffer.flush()
+        users = dict(AppUser.objects.filter(wallet_address__in=wallet_address).values_list("wallet_address", "id"))
+        unknown = sorted(set(wallet_address) - users.keys())
+        if unknown:
+            raise CommandError(f"unknown wallet(s): {', '.join(unknown)}")
+
+        bad = 0
+        for address in wallet_address:
+            user_id = users[address]
+            since = LedgerCheckpoint.objects.filter(user_id=user_id).values_list("next_ledger_id", flat=True).first()
+            mismatches = audit.audit_wallet(user_id)
+            self.stdout.write(f"{address} (ledger rows from id {since or 0}): "
+                              f"{'ok' if not mismatches else f'{len(mismatches)} mismatch(es)'}")
+            for field, actual, expected in mismatches:
+                self.stdout.write(f"  {field}: wallet={actual} ledger={expected}")
+            bad += bool(mismatches)
+        if bad:
+            raise CommandError(f"{bad} of {len(wallet_address)} wallets disagree with the ledger")
+        self.stdout.write(self.style.SUCCESS(f"{len(wallet_address)} wallets match the ledger"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core import audit, ledger_buffer
+
+
+class Command(BaseCommand):
+    help = ("Write OPENING_* ledger rows for the part of every wallet the ledger does not explain "
+            "(wallets from before the ledger). Run once before reconcile_wallets.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="wallets per transaction")
+
+    def handle(self, *args, chunk_size, **options):
+        ledger_buffer.flush()
+        report = audit.backfill_opening_balances(chunk_size)
+        self.stdout.write(self.style.SUCCESS(
+            "{rows} opening rows written for {users} users in {duration_ms} ms".format(**report)))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.models import AppUser, ReferralPath
+from core.referrals import backfill_paths
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ReferralPath closure table from AppUser.inviter."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-depth", type=int, default=1000)
+
+    def handle(self, *args, max_depth, **options):
+        levels = backfill_paths(AppUser, ReferralPath, max_depth=max_depth)
+        for depth, count in levels.items():
+            self.stdout.write(f"depth {depth}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"{sum(levels.values())} referral paths written"))
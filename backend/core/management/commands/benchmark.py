@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+import uuid
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core import benchmarks, rates
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the core API endpoints and service paths against a throwaway database, "
+        "a local server and a local stand-in for the CoinGecko rate endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", default="1,8", help="comma-separated client thread counts")
+        parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+        parser.add_argument("--endpoints", default=",".join(benchmarks.ENDPOINTS))
+        parser.add_argument("--micro-iterations", type=int, default=50)
+        parser.add_argument("--skip-micro", action="store_true")
+        parser.add_argument("--output", help="write results as JSON to this path")
+        parser.add_argument("--compare", help="previous results JSON to compare against")
+
+    def handle(self, *args, **opts):
+        levels = [int(c) for c in opts["concurrency"].split(",") if c]
+        endpoints = [e for e in opts["endpoints"].split(",") if e]
+        unknown = set(endpoints) - set(benchmarks.ENDPOINTS)
+        if unknown:
+            raise CommandError("unknown endpoints: " + ", ".join(sorted(unknown)))
+
+        old_name = connection.settings_dict["NAME"]
+        if connection.vendor == "sqlite":
+            # a file, not shared-cache memory, so server threads can write concurrently
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(
+                tempfile.gettempdir(), f"bench-{uuid.uuid4().hex[:8]}.sqlite3"
+            )
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        from config.celery import app as celery_app
+        was_eager = celery_app.conf.task_always_eager
+        api = stub = None
+        try:
+            stub = benchmarks.start_rate_stub()
+            rates.set_source(rates.CoinGeckoSource(url=benchmarks.server_url(stub) + "/simple/price"))
+            cache.clear()
+            celery_app.conf.task_always_eager = True
+            api = benchmarks.start_api_server()
+
+            results = {
+                "commit": benchmarks.git_commit(),
+                "timestamp": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "config": {"concurrency": levels, "requests": opts["requests"], "endpoints": endpoints},
+                "endpoints": self.run_endpoints(benchmarks.server_url(api), endpoints, levels, opts["requests"]),
+            }
+            if not opts["skip_micro"]:
+                self.stdout.write("micro-benchmarks ...")
+                results["micro"] = benchmarks.run_micro(uuid.uuid4().hex[:6], opts["micro_iterations"])
+        finally:
+            for server in (api, stub):
+                if server is not None:
+                    server.shutdown()
+            rates.set_source(None)
+            celery_app.conf.task_always_eager = was_eager
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+        if opts["output"]:
+            with open(opts["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"results written to {opts['output']}"))
+        if opts["compare"]:
+            with open(opts["compare"]) as f:
+                old = json.load(f)
+            self.stdout.write(f"\ncompared with {old.get('commit') or opts['compare']}:")
+            for label, metric, a, b, change in benchmarks.compare(old, results):
+                pct = f"{change:+.1f}%" if change is not None else "n/a"
+                self.stdout.write(f"  {label:<55} {metric:<20} {a:>10} -> {b:<10} {pct}")
+
+    def run_endpoints(self, base_url, endpoints, levels, requests_n):
+        run_id = uuid.uuid4().hex[:6]
+        benchmarks.seed_users(run_id, len(endpoints) * len(levels) * requests_n)
+        load = benchmarks.EndpointLoad(run_id)
+
+        results, offset = {}, 0
+        for name in endpoints:
+            results[name] = {}
+            for concurrency in levels:
+                self.stdout.write(f"{name} x{concurrency} ...")
+                results[name][str(concurrency)] = benchmarks.run_endpoint(
+                    base_url, name, load, requests_n, concurrency, offset
+                )
+                offset += requests_n
+        return results
+
+    def report(self, results):
+        self.stdout.write("")
+        header = f"{'endpoint':<18}{'conc':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'q/req':>7}{'err':>6}"
+        self.stdout.write(header)
+        for name, by_level in results["endpoints"].items():
+            for level, r in by_level.items():
+                self.stdout.write(
+                    f"{name:<18}{level:>5}{r['rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+                    f"{r['queries_per_request'] or '-':>7}{r['errors']:>6}"
+                )
+        for name, r in results.get("micro", {}).items():
+            self.stdout.write(f"{name:<34} p50={r['p50_ms']}ms max={r['max_ms']}ms queries={r['queries']}")
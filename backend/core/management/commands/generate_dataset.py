@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.datasets import DatasetGenerator, DatasetSpec
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic, reproducible dataset for scale testing: referral trees of users with "
+        "wallets, purchases, ledger history, withdrawal requests and referral paths. "
+        "Rows are appended next to existing data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, required=True)
+        parser.add_argument("--depth", type=int, default=4, help="referral levels below each root user")
+        parser.add_argument("--fanout", type=int, default=5, help="invitees per user")
+        parser.add_argument("--purchases", type=float, default=1.5, help="mean purchases per user")
+        parser.add_argument("--claims", type=float, default=20, help="mean tick claims per user")
+        parser.add_argument("--daily-days", type=int, default=45, help="days of DAILY_ADD history")
+        parser.add_argument("--withdraw-ratio", type=float, default=0.1)
+        parser.add_argument("--history-days", type=int, default=400, help="how far back users were created")
+        parser.add_argument("--backlog-days", type=int, default=2,
+                            help="purchases that fell due within this many days stay unreleased")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--chunk-size", type=int, help="users per transaction")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **opts):
+        if opts["users"] <= 0 or opts["depth"] < 0 or opts["fanout"] <= 0:
+            raise CommandError("--users and --fanout must be positive and --depth not negative.")
+
+        spec = DatasetSpec(
+            users=opts["users"], depth=opts["depth"], fanout=opts["fanout"], purchases=opts["purchases"],
+            claims=opts["claims"], daily_days=opts["daily_days"], withdraw_ratio=opts["withdraw_ratio"],
+            history_days=opts["history_days"], backlog_days=opts["backlog_days"], seed=opts["seed"],
+        )
+        generator = DatasetGenerator(spec, chunk_size=opts["chunk_size"], using=opts["database"])
+
+        def progress(done, counts):
+            self.stdout.write(f"{done}/{spec.users} users, {counts['ledgers']} ledgers, "
+                              f"{counts['purchases']} purchases")
+
+        report = generator.run(on_chunk=progress)
+        self.stdout.write(self.style.SUCCESS(
+            "{users} users, {paths} referral paths, {purchases} purchases, {ledgers} ledgers, "
+            "{withdraws} withdraw requests in {duration_ms} ms".format(**report)
+        ))
@@ -0,0 +1,49 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.imports import PurchaseImporter, RateTable, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-import on-chain purchases from a CSV (header: wallet_address,ton_amount,ton_tx_hash,timestamp) "
+        "or JSON-lines file, priced from a historical rate table (CSV: timestamp,rate). "
+        "Already registered transactions are skipped, so the same file can be replayed safely."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--rates", required=True, help="CSV of timestamp,rate rows")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--rejects", help="write rejected records (line, ton_tx_hash, reason) to this CSV")
+        parser.add_argument("--dry-run", action="store_true", help="run every batch and roll it back")
+
+    def handle(self, *args, path, rates, format, batch_size, rejects, dry_run, **options):
+        try:
+            table = RateTable.from_csv(rates)
+        except (OSError, KeyError, ValueError) as exc:
+            raise CommandError(f"cannot load rate table: {exc}")
+
+        reject_file = open(rejects, "w", newline="") if rejects else None
+        writer = csv.writer(reject_file) if reject_file else None
+        if writer:
+            writer.writerow(["line", "ton_tx_hash", "reason"])
+
+        def on_reject(line, tx, reason):
+            if writer:
+                writer.writerow([line, tx, reason])
+
+        try:
+            report = PurchaseImporter(table, batch_size=batch_size, dry_run=dry_run, on_reject=on_reject).run(
+                read_records(path, format)
+            )
+        except OSError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if reject_file:
+                reject_file.close()
+
+        summary = ", ".join(f"{k}={v}" for k, v in report.as_dict().items())
+        self.stdout.write(self.style.SUCCESS(("[dry run] " if dry_run else "") + summary))
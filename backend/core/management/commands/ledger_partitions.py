@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import partitions
+from core.models import Ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the monthly Ledger partitions for the coming months on PostgreSQL "
+        "(also done daily by the extend_ledger_partitions task). --convert first rebuilds "
+        "an unpartitioned ledger; it locks the table for the whole copy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months", type=int, default=settings.LEDGER_PARTITION_MONTHS_AHEAD,
+                            help="months ahead to create partitions for")
+        parser.add_argument("--convert", action="store_true",
+                            help="partition the ledger table if it is not partitioned yet")
+
+    def handle(self, *args, months, convert, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Ledger partitioning is only supported on PostgreSQL.")
+
+        if convert and partitions.convert_ledger(connection, months):
+            with connection.schema_editor() as editor:
+                for index in Ledger._meta.indexes:
+                    editor.add_index(Ledger, index)
+            self.stdout.write(f"converted {Ledger._meta.db_table}")
+
+        with connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                raise CommandError(f"{Ledger._meta.db_table} is not partitioned; run with --convert first.")
+        created = partitions.ensure_partitions(months)
+
+        for name, moved in created:
+            self.stdout.write(f"created {name} ({moved} rows moved out of DEFAULT)")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions created"))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.bulk import pk_ranges
+from core.models import AppUser, Ledger, Wallet
+
+
+def _count_subquery(qs, key):
+    return Coalesce(
+        Subquery(qs.order_by().values(key).annotate(c=Count("id")).values("c")[:1], output_field=IntegerField()),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Rebuild Wallet.rewards_count and AppUser.invitee_count from Ledger and AppUser.inviter."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, chunk_size, **options):
+        rewards = _count_subquery(Ledger.objects.filter(user_id=OuterRef("user_id"), typ="DAILY_UNLOCK"), "user_id")
+        wallets = 0
+        for lo, hi in pk_ranges(Wallet, chunk_size):
+            with transaction.atomic():
+                wallets += Wallet.objects.filter(pk__gte=lo, pk__lt=hi).update(rewards_count=rewards)
+
+        invitees = _count_subquery(AppUser.objects.filter(inviter_id=OuterRef("pk")), "inviter_id")
+        users = 0
+        for lo, hi in pk_ranges(AppUser, chunk_size):
+            with transaction.atomic():
+                users += AppUser.objects.filter(pk__gte=lo, pk__lt=hi).update(invitee_count=invitees)
+
+        self.stdout.write(self.style.SUCCESS(f"rebuilt rewards_count for {wallets} wallets, invitee_count for {users} users"))
@@ -0,0 +1,355 @@
+"""
+Request, SQL and Celery task metrics with a Prometheus text exposition.
+
+- ``MetricsMiddleware`` records per-route latency histograms, status codes and
+  the SQL query count / time of every request (sync and async views).
+- SQL is measured by an execute wrapper installed on every new database
+  connection; it adds to whatever collector is active in the current context
+  (a request or a Celery task), so queries run from ``sync_to_async`` threads
+  are counted against the request that awaited them.
+- Celery ``task_prerun``/``task_postrun`` hooks time every task (including
+  ``daily_reward_add``, ``unlock_self_profit_and_principal`` and
+  ``end_of_month_unlock_daily``) and count their queries.
+
+Samples accumulate in a per-process ``Registry`` and are flushed at most every
+``METRICS_FLUSH_INTERVAL`` seconds into one Redis hash with ``HINCRBYFLOAT``,
+so ``/metrics`` (``metrics_view``) shows the sum over all web and worker
+processes. Without Redis it shows this process only. The async middleware path
+runs the flush in a worker thread, never on the event loop.
+
+``/metrics`` answers requests that carry ``METRICS_TOKEN`` as a bearer token
+or come from an address in ``METRICS_ALLOWED_IPS``; ``METRICS_PUBLIC=1``
+opens it to everyone.
+"""
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+import hmac
+import ipaddress
+import json
+import logging
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY = "metrics:v1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+
+
+@dataclass(frozen=True)
+class Metric:
+    name: str
+    kind: str  # "counter" | "histogram"
+    help: str
+    buckets: tuple = ()
+
+
+METRICS = {m.name: m for m in (
+    Metric("http_requests_total", "counter", "HTTP responses by route, method and status."),
+    Metric("http_request_duration_seconds", "histogram", "HTTP request latency by route.", LATENCY_BUCKETS),
+    Metric("http_request_db_queries", "histogram", "SQL queries per HTTP request by route.", QUERY_BUCKETS),
+    Metric("http_request_db_seconds_total", "counter", "Time spent in SQL by route."),
+    Metric("celery_tasks_total", "counter", "Finished Celery tasks by name and state."),
+    Metric("celery_task_duration_seconds", "histogram", "Celery task run time by name.", TASK_BUCKETS),
+    Metric("celery_task_db_queries_total", "counter", "SQL queries run by Celery tasks."),
+)}
+
+
+# ---------------------------------------------------------------------------
+# per-process registry
+
+def _series(family: str, sample: str, labels: dict) -> str:
+    return json.dumps([family, sample, sorted(labels.items())], separators=(",", ":"))
+
+
+class Registry:
+    """Counter/histogram samples since the last flush, keyed like the Redis hash fields."""
+
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: dict, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[_series(name, name, labels)] += amount
+
+    def observe(self, name: str, labels: dict, value: float) -> None:
+        metric = METRICS[name]
+        with self._lock:
+            for bound in metric.buckets:
+                if value <= bound:
+                    self._values[_series(name, name + "_bucket", dict(labels, le=_fmt(bound)))] += 1
+            self._values[_series(name, name + "_bucket", dict(labels, le="+Inf"))] += 1
+            self._values[_series(name, name + "_sum", labels)] += value
+            self._values[_series(name, name + "_count", labels)] += 1
+
+    def drain(self) -> dict:
+        with self._lock:
+            values, self._values = self._values, defaultdict(float)
+        return values
+
+    def merge(self, values: dict) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+registry = Registry()
+_local_totals = Registry()  # everything this process recorded (exposition without Redis)
+
+_redis = None
+_last_flush = time.monotonic()
+_flush_lock = threading.Lock()
+
+
+def _redis_client():
+    global _redis
+    url = getattr(settings, "METRICS_REDIS_URL", "")
+    if not url:
+        return None
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+    return _redis
+
+
+def flush_due() -> bool:
+    return time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL
+
+
+def flush(force: bool = False) -> None:
+    """Push this process's samples into the shared Redis hash (at most every flush interval)."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and not flush_due():
+        return
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        _last_flush = now
+        values = registry.drain()
+        if not values:
+            return
+        _local_totals.merge(values)
+        client = _redis_client()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, value in values.items():
+                pipe.hincrbyfloat(REDIS_KEY, key, value)
+            pipe.execute()
+        except Exception as exc:
+            logger.warning("[METRICS] flush to redis failed: %s", exc)
+    finally:
+        _flush_lock.release()
+
+
+def collect() -> dict:
+    """All samples: the shared Redis hash when configured, this process otherwise."""
+    flush(force=True)
+    client = _redis_client()
+    if client is None:
+        return _local_totals.snapshot()
+    return {k.decode(): float(v) for k, v in client.hgetall(REDIS_KEY).items()}
+
+
+# ---------------------------------------------------------------------------
+# exposition
+
+def _fmt(value: float) -> str:
+    value = float(value)
+    if math.isinf(value):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(values: dict) -> str:
+    families = defaultdict(list)
+    for key, value in values.items():
+        family, sample, labels = json.loads(key)
+        families[family].append((sample, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        metric = METRICS.get(family)
+        if metric is not None:
+            lines.append(f"# HELP {family} {metric.help}")
+            lines.append(f"# TYPE {family} {metric.kind}")
+        for sample, labels, value in sorted(families[family], key=_sample_order):
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{sample}{{{label_text}}} {_fmt(value)}" if labels else f"{sample} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _sample_order(item):
+    sample, labels, _ = item
+    plain = [(k, v) for k, v in labels if k != "le"]
+    le = next((v for k, v in labels if k == "le"), None)
+    return plain, sample, math.inf if le == "+Inf" else float(le) if le is not None else 0
+
+
+@lru_cache(maxsize=1)
+def _allowed_networks(spec: str) -> tuple:
+    return tuple(ipaddress.ip_network(n.strip(), strict=False) for n in spec.split(",") if n.strip())
+
+
+def scrape_allowed(request) -> bool:
+    if settings.METRICS_PUBLIC:
+        return True
+    token = settings.METRICS_TOKEN
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    try:
+        addr = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(addr in net for net in _allowed_networks(settings.METRICS_ALLOWED_IPS))
+
+
+def metrics_view(request):
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()), content_type=CONTENT_TYPE)
+
+
+# ---------------------------------------------------------------------------
+# SQL accounting
+
+class _QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+_current = ContextVar("metrics_query_stats", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - started
+
+
+def install_query_wrapper(sender, connection, **kwargs) -> None:
+    """``connection_created`` receiver: count queries on every new connection."""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self._start()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self._finish(request, response, stats, token, started)
+            flush()
+
+    async def __acall__(self, request):
+        stats, token, started = self._start()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self._finish(request, response, stats, token, started)
+            if flush_due():
+                # the Redis pipeline blocks; keep it off the event loop
+                await sync_to_async(flush, thread_sensitive=False)()
+
+    @staticmethod
+    def _start():
+        stats = _QueryStats()
+        return stats, _current.set(stats), time.perf_counter()
+
+    @staticmethod
+    def _finish(request, response, stats, token, started):
+        elapsed = time.perf_counter() - started
+        _current.reset(token)
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None else "unmatched"
+        labels = {"route": route, "method": request.method}
+        registry.inc("http_requests_total", dict(labels, status=response.status_code if response else 500))
+        registry.observe("http_request_duration_seconds", labels, elapsed)
+        registry.observe("http_request_db_queries", labels, stats.count)
+        registry.inc("http_request_db_seconds_total", labels, stats.seconds)
+
+
+# ---------------------------------------------------------------------------
+# Celery
+
+_tasks = {}  # task_id -> (started, stats, context token)
+
+
+def task_started(task_id=None, task=None, **kwargs) -> None:
+    stats = _QueryStats()
+    _tasks[task_id] = (time.perf_counter(), stats, _current.set(stats))
+
+
+def task_finished(task_id=None, task=None, state=None, **kwargs) -> None:
+    entry = _tasks.pop(task_id, None)
+    if entry is None:
+        return
+    started, stats, token = entry
+    try:
+        _current.reset(token)
+    except ValueError:  # finished in another context
+        pass
+    labels = {"task": task.name if task else "unknown"}
+    registry.inc("celery_tasks_total", dict(labels, state=state or "UNKNOWN"))
+    registry.observe("celery_task_duration_seconds", labels, time.perf_counter() - started)
+    registry.inc("celery_task_db_queries_total", labels, stats.count)
+    # workers may sit idle for a long time after a scheduled run
+    flush(force=True)
+
+
+def connect_signals() -> None:
+    from celery.signals import task_postrun, task_prerun
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(install_query_wrapper, dispatch_uid="core.metrics.sql")
+    task_prerun.connect(task_started, dispatch_uid="core.metrics.task_prerun")
+    task_postrun.connect(task_finished, dispatch_uid="core.metrics.task_postrun")
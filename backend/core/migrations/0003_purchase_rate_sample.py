@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_appuser_next_daily_claim_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='ton_usd_rate_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='ton_usd_rate_sample',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_purchase_rate_sample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseIntake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ton_tx_hash', models.CharField(max_length=256, unique=True)),
+                ('ton_amount', models.DecimalField(decimal_places=6, max_digits=24)),
+                ('is_test', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('CREDITED', 'Credited'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('purchase', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='intake', to='core.purchase')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchase_intakes', to='core.appuser')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='core_purcha_status_16f31f_idx')],
+            },
+        ),
+    ]
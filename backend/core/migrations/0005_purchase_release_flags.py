@@ -0,0 +1,48 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+def mark_already_released(apps, schema_editor):
+    # purchases unlocked by the old per-row task have a ledger row keyed by invoice
+    Ledger = apps.get_model("core", "Ledger")
+    Purchase = apps.get_model("core", "Purchase")
+    for typ, flag in (("SELF_PROFIT_UNLOCK", "self_profit_released"), ("PRINCIPAL_UNLOCK", "principal_released")):
+        invoices = Ledger.objects.filter(typ=typ).values_list("meta__invoice", flat=True).iterator()
+        batch = []
+        for invoice in invoices:
+            batch.append(invoice)
+            if len(batch) >= 1000:
+                Purchase.objects.filter(invoice_no__in=batch).update(**{flag: True})
+                batch = []
+        if batch:
+            Purchase.objects.filter(invoice_no__in=batch).update(**{flag: True})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_purchaseintake'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='principal_released',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='self_profit_released',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(condition=models.Q(('self_profit_released', False)), fields=['self_profit_unlock_at'], name='purchase_self_profit_due'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(condition=models.Q(('principal_released', False)), fields=['principal_unlock_at'], name='purchase_principal_due'),
+        ),
+        migrations.RunPython(mark_already_released, migrations.RunPython.noop),
+    ]
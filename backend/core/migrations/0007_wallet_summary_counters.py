@@ -0,0 +1,43 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:21
+
+import django.db.models.expressions
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    AppUser = apps.get_model("core", "AppUser")
+    Ledger = apps.get_model("core", "Ledger")
+    Wallet = apps.get_model("core", "Wallet")
+    for user_id, n in (Ledger.objects.filter(typ="DAILY_UNLOCK").order_by()
+                       .values_list("user_id").annotate(n=Count("id"))):
+        Wallet.objects.filter(user_id=user_id).update(rewards_count=n)
+    for inviter_id, n in (AppUser.objects.filter(inviter__isnull=False).order_by()
+                          .values_list("inviter_id").annotate(n=Count("id"))):
+        AppUser.objects.filter(pk=inviter_id).update(invitee_count=n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_ledger_daily_release'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='invitee_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='rewards_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='withdrawable_total',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('referral_bonus'), '+', models.F('daily_reward_unlocked')), '+', models.F('downline_profit_instant')), '+', models.F('self_profit_unlocked')), '+', models.F('principal_unlocked')), '+', models.F('self_profit_locked')), output_field=models.DecimalField(decimal_places=6, max_digits=24)),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
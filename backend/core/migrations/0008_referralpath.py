@@ -0,0 +1,34 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    from core.referrals import backfill_paths
+    backfill_paths(apps.get_model("core", "AppUser"), apps.get_model("core", "ReferralPath"),
+                   using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_wallet_summary_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='downline_paths', to='core.appuser')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upline_paths', to='core.appuser')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='referral_path_downline'), models.Index(fields=['descendant', 'depth'], name='referral_path_upline')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='referral_path_unique')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
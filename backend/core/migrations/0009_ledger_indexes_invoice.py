@@ -0,0 +1,49 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:24
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Max, Min, Value
+from django.db.models.fields.json import KT
+from django.db.models.functions import Coalesce
+
+
+def copy_invoice_from_meta(apps, schema_editor):
+    Ledger = apps.get_model("core", "Ledger")
+    bounds = Ledger.objects.aggregate(lo=Min("pk"), hi=Max("pk"))
+    if bounds["lo"] is None:
+        return
+    lo = bounds["lo"]
+    while lo <= bounds["hi"]:
+        Ledger.objects.filter(pk__gte=lo, pk__lt=lo + 10000, meta__has_key="invoice").update(
+            invoice=Coalesce(KT("meta__invoice"), Value(""))
+        )
+        lo += 10000
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_referralpath'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledger',
+            name='invoice',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(copy_invoice_from_meta, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ledger',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['user', 'typ', 'created_at'], name='ledger_user_typ_created'),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(condition=models.Q(('invoice', ''), _negated=True), fields=['invoice'], name='ledger_invoice'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_ledger_indexes_invoice'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='ledger_user_history'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='purchase_user_history'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledger',
+            name='typ',
+            field=models.CharField(choices=[('REF_BONUS', 'Referral bonus'), ('DAILY_ADD', 'Daily add locked'), ('DAILY_UNLOCK', 'Daily unlock'), ('DAILY_RELEASE', 'Daily locked release'), ('BUY_PRINCIPAL', 'Buy principal locked'), ('BUY_SELF_PROFIT', 'Buy self profit locked'), ('SELF_PROFIT_UNLOCK', 'Self profit unlock'), ('PRINCIPAL_UNLOCK', 'Principal unlock'), ('DOWNLINE_PROFIT', 'Downline instant profit'), ('WITHDRAW', 'Withdraw'), ('WITHDRAW_ALL', 'Withdraw (all withdrawable)')], max_length=32),
+        ),
+    ]
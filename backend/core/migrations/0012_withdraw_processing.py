@@ -0,0 +1,27 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_ledger_withdraw_all'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawrequest',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ledger',
+            name='typ',
+            field=models.CharField(choices=[('REF_BONUS', 'Referral bonus'), ('DAILY_ADD', 'Daily add locked'), ('DAILY_UNLOCK', 'Daily unlock'), ('DAILY_RELEASE', 'Daily locked release'), ('BUY_PRINCIPAL', 'Buy principal locked'), ('BUY_SELF_PROFIT', 'Buy self profit locked'), ('SELF_PROFIT_UNLOCK', 'Self profit unlock'), ('PRINCIPAL_UNLOCK', 'Principal unlock'), ('DOWNLINE_PROFIT', 'Downline instant profit'), ('WITHDRAW', 'Withdraw'), ('WITHDRAW_ALL', 'Withdraw (all withdrawable)'), ('WITHDRAW_REFUND', 'Rejected withdraw refund')], max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawrequest',
+            index=models.Index(fields=['status', 'created_at'], name='withdraw_status_created'),
+        ),
+    ]
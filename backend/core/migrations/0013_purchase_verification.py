@@ -0,0 +1,48 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_withdraw_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='verification_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='verification_error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='verification_next_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # purchases registered before verification existed were credited already
+        migrations.AddField(
+            model_name='purchase',
+            name='verification_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('VERIFIED', 'Verified'), ('REJECTED', 'Rejected')], default='VERIFIED', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='purchase',
+            name='verification_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('VERIFIED', 'Verified'), ('REJECTED', 'Rejected')], default='PENDING', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(condition=models.Q(('verification_status', 'PENDING')), fields=['id'], name='purchase_verification_pending'),
+        ),
+    ]
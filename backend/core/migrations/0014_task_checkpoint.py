@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_purchase_verification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_key', models.CharField(max_length=128, unique=True)),
+                ('task', models.CharField(blank=True, default='', max_length=128)),
+                ('status', models.CharField(choices=[('RUNNING', 'Running'), ('DONE', 'Done')], default='RUNNING', max_length=16)),
+                ('next_pk', models.BigIntegerField(default=0)),
+                ('end_pk', models.BigIntegerField(default=0)),
+                ('wallets', models.PositiveIntegerField(default=0)),
+                ('ledgers', models.PositiveIntegerField(default=0)),
+                ('chunks', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='task_checkpoint_status')],
+            },
+        ),
+    ]
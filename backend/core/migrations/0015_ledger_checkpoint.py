@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-18 17:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_task_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger_checkpoint', serialize=False, to='core.appuser')),
+                ('next_ledger_id', models.BigIntegerField(default=0)),
+                ('referral_bonus', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('daily_reward_locked', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('daily_reward_unlocked', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('downline_profit_instant', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('self_profit_locked', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('self_profit_unlocked', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('principal_locked', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('principal_unlocked', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('withdrawn_all', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('rewards_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        # build the (user, id) index before dropping the plain user_id one
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['user', 'id'], name='ledger_user_id'),
+        ),
+        migrations.AlterField(
+            model_name='ledger',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ledgers', to='core.appuser'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db import migrations
+
+from core import partitions
+
+
+def partition_ledger(apps, schema_editor):
+    """
+    Opt-in (LEDGER_PARTITIONING, PostgreSQL only): rebuild core_ledger as a
+    table range-partitioned by month. The copy holds an exclusive lock on the
+    ledger, so by default this migration does nothing; an existing deploy
+    converts in a maintenance window with `manage.py ledger_partitions --convert`.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql" or not settings.LEDGER_PARTITIONING:
+        return
+    Ledger = apps.get_model("core", "Ledger")
+    if partitions.convert_ledger(connection, settings.LEDGER_PARTITION_MONTHS_AHEAD):
+        for index in Ledger._meta.indexes:
+            schema_editor.add_index(Ledger, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_ledger_checkpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_ledger_partitioning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawrequest',
+            name='debited',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='ledger',
+            name='typ',
+            field=models.CharField(choices=[('REF_BONUS', 'Referral bonus'), ('DAILY_ADD', 'Daily add locked'), ('DAILY_UNLOCK', 'Daily unlock'), ('DAILY_RELEASE', 'Daily locked release'), ('BUY_PRINCIPAL', 'Buy principal locked'), ('BUY_SELF_PROFIT', 'Buy self profit locked'), ('SELF_PROFIT_UNLOCK', 'Self profit unlock'), ('PRINCIPAL_UNLOCK', 'Principal unlock'), ('DOWNLINE_PROFIT', 'Downline instant profit'), ('WITHDRAW', 'Withdraw'), ('WITHDRAW_ALL', 'Withdraw (all withdrawable)'), ('WITHDRAW_REFUND', 'Rejected withdraw refund'), ('WITHDRAW_ALL_REFUND', 'Rejected withdraw (all withdrawable) refund')], max_length=32),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_withdraw_debited_split'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerBufferBatch',
+            fields=[
+                ('batch_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('flushed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
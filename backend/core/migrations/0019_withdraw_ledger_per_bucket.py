@@ -0,0 +1,71 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:31
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# frozen copy of services.WITHDRAW_LEDGER_TYPES as of this migration
+WITHDRAW_LEDGER_TYPES = {
+    "downline_profit_instant": ("WITHDRAW", "WITHDRAW_REFUND"),
+    "referral_bonus": ("WITHDRAW_REF_BONUS", "WITHDRAW_REF_BONUS_REFUND"),
+    "daily_reward_unlocked": ("WITHDRAW_DAILY", "WITHDRAW_DAILY_REFUND"),
+    "self_profit_unlocked": ("WITHDRAW_SELF_PROFIT", "WITHDRAW_SELF_PROFIT_REFUND"),
+    "principal_unlocked": ("WITHDRAW_PRINCIPAL", "WITHDRAW_PRINCIPAL_REFUND"),
+}
+BATCH = 1000
+
+
+def split_pooled_rows(apps, schema_editor):
+    """
+    Replace every pooled WITHDRAW_ALL / WITHDRAW_ALL_REFUND row with one row per
+    bucket from its recorded split (rows without one count against
+    downline_profit_instant, where their refund goes). The ledger changes
+    below the compaction watermark, so checkpoints are rebuilt from scratch.
+    """
+    Ledger = apps.get_model("core", "Ledger")
+    LedgerCheckpoint = apps.get_model("core", "LedgerCheckpoint")
+    TaskCheckpoint = apps.get_model("core", "TaskCheckpoint")
+    pooled = Ledger.objects.filter(typ__in=["WITHDRAW_ALL", "WITHDRAW_ALL_REFUND"]).order_by("id")
+    if not pooled.exists():
+        return
+
+    last_id = 0
+    while True:
+        rows = list(pooled.filter(id__gt=last_id)[:BATCH])
+        if not rows:
+            break
+        last_id = rows[-1].id
+        split_rows = []
+        for row in rows:
+            meta = dict(row.meta or {})
+            buckets = meta.pop("buckets", None) or {"downline_profit_instant": str(row.amount)}
+            side = 1 if row.typ == "WITHDRAW_ALL_REFUND" else 0
+            for field, taken in buckets.items():
+                split_rows.append(Ledger(user_id=row.user_id, typ=WITHDRAW_LEDGER_TYPES[field][side],
+                                         amount=Decimal(taken), invoice=row.invoice, meta=meta,
+                                         created_at=row.created_at))
+        Ledger.objects.bulk_create(split_rows)
+        Ledger.objects.filter(id__in=[row.id for row in rows]).delete()
+
+    LedgerCheckpoint.objects.all().delete()
+    TaskCheckpoint.objects.filter(run_key="LEDGER_COMPACTION").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_ledger_buffer_batch'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_pooled_rows, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='ledgercheckpoint',
+            name='withdrawn_all',
+        ),
+        migrations.AlterField(
+            model_name='ledger',
+            name='typ',
+            field=models.CharField(choices=[('REF_BONUS', 'Referral bonus'), ('DAILY_ADD', 'Daily add locked'), ('DAILY_UNLOCK', 'Daily unlock'), ('DAILY_RELEASE', 'Daily locked release'), ('BUY_PRINCIPAL', 'Buy principal locked'), ('BUY_SELF_PROFIT', 'Buy self profit locked'), ('SELF_PROFIT_UNLOCK', 'Self profit unlock'), ('PRINCIPAL_UNLOCK', 'Principal unlock'), ('DOWNLINE_PROFIT', 'Downline instant profit'), ('WITHDRAW', 'Withdraw'), ('WITHDRAW_REFUND', 'Rejected withdraw refund'), ('WITHDRAW_REF_BONUS', 'Withdraw from referral bonus'), ('WITHDRAW_REF_BONUS_REFUND', 'Rejected withdraw refund to referral bonus'), ('WITHDRAW_DAILY', 'Withdraw from daily reward'), ('WITHDRAW_DAILY_REFUND', 'Rejected withdraw refund to daily reward'), ('WITHDRAW_SELF_PROFIT', 'Withdraw from self profit'), ('WITHDRAW_SELF_PROFIT_REFUND', 'Rejected withdraw refund to self profit'), ('WITHDRAW_PRINCIPAL', 'Withdraw from principal'), ('WITHDRAW_PRINCIPAL_REFUND', 'Rejected withdraw refund to principal')], max_length=32),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+from core.chain import normalize_tx_hash
+
+BATCH = 1000
+
+
+def backfill_chain_hashes(apps, schema_editor):
+    """
+    Record the canonical hash of already verified purchases whose stored hash
+    is a hex/base64 transaction hash, so a resubmission under another encoding
+    is rejected by verification. The oldest purchase keeps a hash that more
+    than one purchase normalizes to.
+    """
+    Purchase = apps.get_model("core", "Purchase")
+    taken = set()
+    verified = Purchase.objects.filter(verification_status="VERIFIED").order_by("id")
+    last_id = 0
+    while True:
+        rows = list(verified.filter(id__gt=last_id).only("id", "ton_tx_hash")[:BATCH])
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updated = []
+        for p in rows:
+            canonical = normalize_tx_hash(p.ton_tx_hash)
+            if len(canonical) == 64 and canonical not in taken:
+                taken.add(canonical)
+                p.chain_tx_hash = canonical
+                updated.append(p)
+        Purchase.objects.bulk_update(updated, ["chain_tx_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_withdraw_ledger_per_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='chain_tx_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_chain_hashes, migrations.RunPython.noop),
+    ]
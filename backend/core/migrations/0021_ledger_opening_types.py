@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_purchase_chain_tx_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledger',
+            name='typ',
+            field=models.CharField(choices=[('REF_BONUS', 'Referral bonus'), ('DAILY_ADD', 'Daily add locked'), ('DAILY_UNLOCK', 'Daily unlock'), ('DAILY_RELEASE', 'Daily locked release'), ('BUY_PRINCIPAL', 'Buy principal locked'), ('BUY_SELF_PROFIT', 'Buy self profit locked'), ('SELF_PROFIT_UNLOCK', 'Self profit unlock'), ('PRINCIPAL_UNLOCK', 'Principal unlock'), ('DOWNLINE_PROFIT', 'Downline instant profit'), ('WITHDRAW', 'Withdraw'), ('WITHDRAW_REFUND', 'Rejected withdraw refund'), ('WITHDRAW_REF_BONUS', 'Withdraw from referral bonus'), ('WITHDRAW_REF_BONUS_REFUND', 'Rejected withdraw refund to referral bonus'), ('WITHDRAW_DAILY', 'Withdraw from daily reward'), ('WITHDRAW_DAILY_REFUND', 'Rejected withdraw refund to daily reward'), ('WITHDRAW_SELF_PROFIT', 'Withdraw from self profit'), ('WITHDRAW_SELF_PROFIT_REFUND', 'Rejected withdraw refund to self profit'), ('WITHDRAW_PRINCIPAL', 'Withdraw from principal'), ('WITHDRAW_PRINCIPAL_REFUND', 'Rejected withdraw refund to principal'), ('OPENING_REFERRAL_BONUS', 'Opening referral bonus'), ('OPENING_DAILY_REWARD_LOCKED', 'Opening daily reward locked'), ('OPENING_DAILY_REWARD_UNLOCKED', 'Opening daily reward unlocked'), ('OPENING_DOWNLINE_PROFIT_INSTANT', 'Opening downline instant profit'), ('OPENING_SELF_PROFIT_LOCKED', 'Opening self profit locked'), ('OPENING_SELF_PROFIT_UNLOCKED', 'Opening self profit unlocked'), ('OPENING_PRINCIPAL_LOCKED', 'Opening principal locked'), ('OPENING_PRINCIPAL_UNLOCKED', 'Opening principal unlocked'), ('OPENING_REWARDS_COUNT', 'Opening claim count')], max_length=32),
+        ),
+    ]
@@ -11,6 +11,7 @@ class AppUser(models.Model):
     referral_code = models.CharField(max_length=32, unique=True, blank=True)
     inviter = models.ForeignKey("self", null=True, blank=True, on_delete=models.SET_NULL, related_name="invitees")
     next_daily_claim_at = models.DateTimeField(null=True, blank=True)
+    invitee_count = models.PositiveIntegerField(default=0)  # maintained by apply_referral
 
     def save(self, *args, **kwargs):
         if not self.referral_code:
@@ -21,6 +22,26 @@ class AppUser(models.Model):
         return self.wallet_address
 
 
+class ReferralPath(models.Model):
+    """
+    Closure table over AppUser.inviter: one row per (ancestor, descendant) pair
+    at any depth (1 = direct invitee). Filled in by services.apply_referral,
+    rebuilt with `manage.py backfill_referral_paths`.
+    """
+    ancestor = models.ForeignKey(AppUser, on_delete=models.CASCADE, related_name="downline_paths")
+    descendant = models.ForeignKey(AppUser, on_delete=models.CASCADE, related_name="upline_paths")
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["ancestor", "descendant"], name="referral_path_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["ancestor", "depth"], name="referral_path_downline"),
+            models.Index(fields=["descendant", "depth"], name="referral_path_upline"),
+        ]
+
+
 class Wallet(models.Model):
     user = models.OneToOneField(AppUser, on_delete=models.CASCADE, related_name="wallet")
 
@@ -42,17 +63,23 @@ class Wallet(models.Model):
     principal_locked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
     principal_unlocked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
 
-    updated_at = models.DateTimeField(auto_now=True)
+    # summary counters, maintained in the same UPDATE that changes balances
+    # (rebuild with `manage.py rebuild_wallet_counters`)
+    rewards_count = models.PositiveIntegerField(default=0)  # DAILY_UNLOCK claims
+    withdrawable_total = models.GeneratedField(
+        expression=(
+            F("referral_bonus")
+            + F("daily_reward_unlocked")
+            + F("downline_profit_instant")
+            + F("self_profit_unlocked")
+            + F("principal_unlocked")
+            + F("self_profit_locked")
+        ),
+        output_field=models.DecimalField(max_digits=24, decimal_places=6),
+        db_persist=True,
+    )
 
-    def withdrawable_total(self):
-        return (
-            self.referral_bonus
-            + self.daily_reward_unlocked
-            + self.downline_profit_instant
-            + self.self_profit_unlocked
-            + self.principal_unlocked
-            + self.self_profit_locked
-        )
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class Ledger(models.Model):
@@ -60,18 +87,50 @@ class Ledger(models.Model):
         ("REF_BONUS", "Referral bonus"),
         ("DAILY_ADD", "Daily add locked"),
         ("DAILY_UNLOCK", "Daily unlock"),
+        ("DAILY_RELEASE", "Daily locked release"),
         ("BUY_PRINCIPAL", "Buy principal locked"),
         ("BUY_SELF_PROFIT", "Buy self profit locked"),
         ("SELF_PROFIT_UNLOCK", "Self profit unlock"),
         ("PRINCIPAL_UNLOCK", "Principal unlock"),
         ("DOWNLINE_PROFIT", "Downline instant profit"),
         ("WITHDRAW", "Withdraw"),
+        ("WITHDRAW_REFUND", "Rejected withdraw refund"),
+        ("WITHDRAW_REF_BONUS", "Withdraw from referral bonus"),
+        ("WITHDRAW_REF_BONUS_REFUND", "Rejected withdraw refund to referral bonus"),
+        ("WITHDRAW_DAILY", "Withdraw from daily reward"),
+        ("WITHDRAW_DAILY_REFUND", "Rejected withdraw refund to daily reward"),
+        ("WITHDRAW_SELF_PROFIT", "Withdraw from self profit"),
+        ("WITHDRAW_SELF_PROFIT_REFUND", "Rejected withdraw refund to self profit"),
+        ("WITHDRAW_PRINCIPAL", "Withdraw from principal"),
+        ("WITHDRAW_PRINCIPAL_REFUND", "Rejected withdraw refund to principal"),
+        # pre-ledger wallet state (core.audit.backfill_opening_balances)
+        ("OPENING_REFERRAL_BONUS", "Opening referral bonus"),
+        ("OPENING_DAILY_REWARD_LOCKED", "Opening daily reward locked"),
+        ("OPENING_DAILY_REWARD_UNLOCKED", "Opening daily reward unlocked"),
+        ("OPENING_DOWNLINE_PROFIT_INSTANT", "Opening downline instant profit"),
+        ("OPENING_SELF_PROFIT_LOCKED", "Opening self profit locked"),
+        ("OPENING_SELF_PROFIT_UNLOCKED", "Opening self profit unlocked"),
+        ("OPENING_PRINCIPAL_LOCKED", "Opening principal locked"),
+        ("OPENING_PRINCIPAL_UNLOCKED", "Opening principal unlocked"),
+        ("OPENING_REWARDS_COUNT", "Opening claim count"),
     ]
-    user = models.ForeignKey(AppUser, on_delete=models.CASCADE, related_name="ledgers")
+    # indexed by ledger_user_id below (a plain user_id index would be redundant)
+    user = models.ForeignKey(AppUser, on_delete=models.CASCADE, related_name="ledgers", db_index=False)
     typ = models.CharField(max_length=32, choices=TYPE_CHOICES)
     amount = models.DecimalField(max_digits=24, decimal_places=6)
+    invoice = models.CharField(max_length=32, blank=True, default="")  # Purchase.invoice_no, if any
     meta = models.JSONField(default=dict, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # partition key on PostgreSQL when partitioned (core.partitions); bulk writers may set it
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "typ", "created_at"], name="ledger_user_typ_created"),
+            models.Index(fields=["user", "-created_at", "-id"], name="ledger_user_history"),
+            models.Index(fields=["invoice"], condition=~models.Q(invoice=""), name="ledger_invoice"),
+            # rows after a user's LedgerCheckpoint
+            models.Index(fields=["user", "id"], name="ledger_user_id"),
+        ]
 
 
 class Purchase(models.Model):
@@ -82,6 +141,9 @@ class Purchase(models.Model):
     ton_tx_hash = models.CharField(max_length=256, unique=True)
 
     ton_usd_rate = models.DecimalField(max_digits=24, decimal_places=6)
+    # which cached rate sample was used (core.rates)
+    ton_usd_rate_sample = models.CharField(max_length=32, blank=True, default="")
+    ton_usd_rate_at = models.DateTimeField(null=True, blank=True)
     usd_value = models.DecimalField(max_digits=24, decimal_places=6)
 
     ecg_value = models.DecimalField(max_digits=24, decimal_places=6)  # usd*200
@@ -90,8 +152,58 @@ class Purchase(models.Model):
     principal_unlock_at = models.DateTimeField()
     self_profit_unlock_at = models.DateTimeField()
 
+    # set once the unlock engine has moved the amount (core.unlocks)
+    principal_released = models.BooleanField(default=False)
+    self_profit_released = models.BooleanField(default=False)
+
+    # on-chain verification (core.verification); credits apply only once VERIFIED
+    VERIFICATION_STATUS = [("PENDING", "Pending"), ("VERIFIED", "Verified"), ("REJECTED", "Rejected")]
+    verification_status = models.CharField(max_length=16, choices=VERIFICATION_STATUS, default="PENDING")
+    verification_attempts = models.PositiveIntegerField(default=0)
+    verification_next_at = models.DateTimeField(null=True, blank=True)  # retry backoff
+    verification_error = models.CharField(max_length=255, blank=True, default="")
+    verified_at = models.DateTimeField(null=True, blank=True)
+    # canonical (hex) hash the chain returned; one verified purchase per on-chain transaction
+    chain_tx_hash = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"], name="purchase_user_history"),
+            models.Index(fields=["self_profit_unlock_at"], condition=models.Q(self_profit_released=False),
+                         name="purchase_self_profit_due"),
+            models.Index(fields=["principal_unlock_at"], condition=models.Q(principal_released=False),
+                         name="purchase_principal_due"),
+            models.Index(fields=["id"], condition=models.Q(verification_status="PENDING"),
+                         name="purchase_verification_pending"),
+        ]
+
+
+class PurchaseIntake(models.Model):
+    """Pending purchase recorded by the async ingestion mode, keyed by ton_tx_hash."""
+    STATUS = [
+        ("PENDING", "Pending"),
+        ("CREDITED", "Credited"),
+        ("DONE", "Done"),
+        ("FAILED", "Failed"),
+    ]
+    user = models.ForeignKey(AppUser, on_delete=models.CASCADE, related_name="purchase_intakes")
+    ton_tx_hash = models.CharField(max_length=256, unique=True)
+    ton_amount = models.DecimalField(max_digits=24, decimal_places=6)
+    is_test = models.BooleanField(default=False)
+
+    status = models.CharField(max_length=16, choices=STATUS, default="PENDING")
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    purchase = models.OneToOneField(Purchase, null=True, blank=True, on_delete=models.SET_NULL, related_name="intake")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "updated_at"])]
+
 
 class WithdrawRequest(models.Model):
     STATUS = [("PENDING", "Pending"), ("APPROVED", "Approved"), ("REJECTED", "Rejected")]
@@ -104,4 +216,72 @@ class WithdrawRequest(models.Model):
     amount = models.DecimalField(max_digits=24, decimal_places=6)
     destination_wallet = models.CharField(max_length=128)
     status = models.CharField(max_length=16, choices=STATUS, default="PENDING")
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    # {bucket: amount} taken (the waterfall split for ALL_WITHDRAWABLE), refunded bucket by bucket on rejection
+    debited = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"], name="withdraw_status_created")]
+
+class TaskCheckpoint(models.Model):
+    """
+    Progress of one run of a chunked wallet task (core.bulk.run_wallet_chunks),
+    advanced in the same transaction as each chunk so a crashed run resumes
+    after the last committed chunk instead of crediting it again.
+    """
+    STATUS = [("RUNNING", "Running"), ("DONE", "Done")]
+    run_key = models.CharField(max_length=128, unique=True)  # e.g. "DAILY_ADD:2026-10-18"
+    task = models.CharField(max_length=128, blank=True, default="")  # Celery task that resumes the run
+    status = models.CharField(max_length=16, choices=STATUS, default="RUNNING")
+    next_pk = models.BigIntegerField(default=0)  # first wallet pk not processed yet
+    end_pk = models.BigIntegerField(default=0)  # exclusive upper bound fixed when the run started
+    wallets = models.PositiveIntegerField(default=0)
+    ledgers = models.PositiveIntegerField(default=0)
+    chunks = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "updated_at"], name="task_checkpoint_status")]
+
+    def __str__(self):
+        return self.run_key
+
+
+class LedgerCheckpoint(models.Model):
+    """
+    Per-user totals of every Ledger row with ``id < next_ledger_id``, one
+    column per Wallet bucket (core.audit.LEDGER_EFFECTS). Expected balances are
+    the checkpoint plus the rows after it; kept current by the
+    ``compact_ledger_checkpoints`` task.
+    """
+    user = models.OneToOneField(AppUser, on_delete=models.CASCADE, primary_key=True, related_name="ledger_checkpoint")
+    next_ledger_id = models.BigIntegerField(default=0)
+
+    referral_bonus = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    daily_reward_locked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    daily_reward_unlocked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    downline_profit_instant = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    self_profit_locked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    self_profit_unlocked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    principal_locked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    principal_unlocked = models.DecimalField(max_digits=24, decimal_places=6, default=0)
+    rewards_count = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class LedgerBufferBatch(models.Model):
+    """
+    A ``core.ledger_buffer`` batch whose rows are in the Ledger table, recorded
+    in the same transaction. Recovery of an unfinished flush checks this table
+    instead of scanning Ledger.meta.
+    """
+    batch_id = models.CharField(max_length=32, primary_key=True)
+    rows = models.PositiveIntegerField(default=0)
+    flushed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.batch_id
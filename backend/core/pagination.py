@@ -0,0 +1,73 @@
+"""
+Keyset (cursor) pagination on ``(created_at, id)`` for per-user history lists.
+
+Pages are ordered newest first; the cursor is the position of the last row
+served, so every page is one index range scan no matter how deep the client
+has paged. The response body stays a plain list; the next cursor is sent in
+the ``X-Next-Cursor`` header (and a ``Link: rel="next"`` header).
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.http import urlencode
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(created_at: datetime, pk: int) -> str:
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor")
+
+
+def parse_limit(value) -> int:
+    if value in (None, ""):
+        return DEFAULT_LIMIT
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError("invalid limit")
+    return min(limit, MAX_LIMIT)
+
+
+def parse_fields(value, allowed):
+    """``?fields=a,b`` -> ``["a", "b"]`` (``None`` when absent); unknown names raise ValueError."""
+    if not value:
+        return None
+    fields = [f.strip() for f in value.split(",") if f.strip()]
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise ValueError("unknown fields: " + ", ".join(sorted(unknown)))
+    return fields
+
+
+def keyset_page(qs, cursor: str = None, limit: int = DEFAULT_LIMIT):
+    """Return ``(rows, next_cursor)`` for ``qs``, newest first."""
+    qs = qs.order_by("-created_at", "-id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    rows = list(qs[: limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk)
+    return rows, next_cursor
+
+
+def set_next_headers(response, request, next_cursor):
+    if next_cursor:
+        params = request.query_params.copy()
+        params["cursor"] = next_cursor
+        response["X-Next-Cursor"] = next_cursor
+        response["Link"] = f'<{request.build_absolute_uri(request.path)}?{urlencode(params, doseq=True)}>; rel="next"'
+    return response
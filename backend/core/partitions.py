@@ -0,0 +1,158 @@
+"""
+Monthly range partitioning of the ``Ledger`` table (PostgreSQL only, opt-in).
+
+``convert_ledger`` rebuilds ``core_ledger`` as a table partitioned by month on
+``created_at``: it takes an exclusive lock and copies every row, so it only
+runs when asked for (``LEDGER_PARTITIONING`` during ``migrate``, or
+``manage.py ledger_partitions --convert`` in a maintenance window).
+
+Once the table is partitioned, ``ensure_partitions`` (task
+``extend_ledger_partitions``, daily) keeps ``LEDGER_PARTITION_MONTHS_AHEAD``
+months of partitions ready. A month is added by creating a plain table,
+moving that month's rows out of the DEFAULT partition into it and attaching
+it, so a month that already spilled into DEFAULT can still get its own
+partition.
+"""
+from datetime import datetime, timezone as dt_timezone
+import logging
+
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TABLE = "core_ledger"
+USERS_TABLE = "core_appuser"
+
+
+def month_start(d: datetime) -> datetime:
+    return datetime(d.year, d.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(d: datetime) -> datetime:
+    return datetime(d.year + d.month // 12, d.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def months_ahead(now: datetime, months: int) -> datetime:
+    """Start of the month ``months`` after the current one (exclusive horizon)."""
+    horizon = month_start(now)
+    for _ in range(months + 1):
+        horizon = next_month(horizon)
+    return horizon
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(cursor, table: str = TABLE) -> bool:
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [table])
+    return cursor.fetchone() is not None
+
+
+def _exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    return cursor.fetchone()[0] is not None
+
+
+def add_month_partition(cursor, table: str, lo: datetime) -> int:
+    """
+    Attach the partition for the month starting at ``lo``, moving its rows out
+    of DEFAULT first. Returns the number of rows moved. Run inside a transaction.
+    """
+    hi = next_month(lo)
+    name = partition_name(table, lo)
+    default = f"{table}_default"
+    cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    moved = 0
+    if _exists(cursor, default):
+        # writers block on DEFAULT until the commit, so no new row can slip in before the ATTACH check
+        cursor.execute(f"LOCK TABLE {default} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default} WHERE created_at >= %s AND created_at < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            [lo.isoformat(), hi.isoformat()],
+        )
+        moved = cursor.rowcount
+    cursor.execute(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+        [lo.isoformat(), hi.isoformat()],
+    )
+    return moved
+
+
+def create_month_partitions(cursor, table: str, start: datetime, stop: datetime) -> list:
+    """Add the missing ``<table>_pYYYY_MM`` partitions covering [start, stop). Returns ``[(name, rows moved)]``."""
+    created = []
+    lo = month_start(start)
+    while lo < stop:
+        if not _exists(cursor, partition_name(table, lo)):
+            created.append((partition_name(table, lo), add_month_partition(cursor, table, lo)))
+        lo = next_month(lo)
+    return created
+
+
+def ensure_partitions(months: int = None, connection=None) -> list:
+    """Create the partitions for the next ``months`` months; a no-op unless the table is partitioned."""
+    connection = connection or default_connection
+    if connection.vendor != "postgresql":
+        return []
+    months = settings.LEDGER_PARTITION_MONTHS_AHEAD if months is None else months
+    now = timezone.now()
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+        created = create_month_partitions(cursor, TABLE, now, months_ahead(now, months))
+    for name, moved in created:
+        logger.info("[PARTITION] created %s (moved %s rows out of DEFAULT)", name, moved)
+    return created
+
+
+def convert_ledger(connection, months: int) -> bool:
+    """
+    Rebuild the ledger as a partitioned table. Month partitions covering every
+    existing row are created before the copy, so historical rows land in their
+    own month. The caller re-creates the model's indexes (they are dropped with
+    the old table). Returns False if the table was already partitioned. The
+    table is locked for the whole copy.
+    """
+    table, legacy = TABLE, f"{TABLE}_legacy"
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return False
+
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"SELECT min(created_at) FROM {table}")
+        oldest = cursor.fetchone()[0] or timezone.now()
+
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+            f"PARTITION BY RANGE (created_at)"
+        )
+        # the partition key has to be part of the primary key
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+
+        lo = month_start(oldest)
+        horizon = months_ahead(timezone.now(), months)
+        while lo < horizon:
+            cursor.execute(
+                f"CREATE TABLE {partition_name(table, lo)} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                [lo.isoformat(), next_month(lo).isoformat()],
+            )
+            lo = next_month(lo)
+        cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT max(id) FROM {table}), 1))",
+            [table],
+        )
+        cursor.execute(f"DROP TABLE {legacy}")
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_user_id_fk FOREIGN KEY (user_id) "
+            f"REFERENCES {USERS_TABLE} (id) DEFERRABLE INITIALLY DEFERRED"
+        )
+    logger.info("[PARTITION] %s converted to monthly partitions", table)
+    return True
@@ -0,0 +1,116 @@
+"""
+Batch withdrawal processing for payout runs.
+
+Status transitions are set-based: one guarded ``UPDATE ... WHERE status =
+'PENDING'`` per chunk of ids, so a request is approved or rejected exactly
+once even if two operators click at the same time; requests another run
+changed in the meantime are skipped. Rejections refund each request to the
+buckets it was taken from (the split recorded in ``WithdrawRequest.debited``)
+with one grouped wallet UPDATE per chunk and one refund ledger row per bucket
+(``services.WITHDRAW_LEDGER_TYPES``). Older requests without a recorded split
+go back to ``downline_profit_instant``.
+
+The payout export streams approved requests through a server-side cursor
+(``QuerySet.iterator``) as CSV or JSON lines.
+"""
+import csv
+from decimal import Decimal
+import io
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .bulk import LedgerWriter, WalletDeltas
+from .cache import invalidate_wallet
+from .models import WithdrawRequest
+from .services import WITHDRAW_LEDGER_TYPES
+
+logger = logging.getLogger(__name__)
+
+PAYOUT_COLUMNS = ("id", "wallet_address", "destination_wallet", "amount", "scope", "created_at", "processed_at")
+
+
+def _id_chunks(queryset, chunk_size):
+    chunk = []
+    for pk in queryset.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=chunk_size):
+        chunk.append(pk)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def approve_withdrawals(queryset, chunk_size: int = None) -> int:
+    chunk_size = chunk_size or settings.PAYOUT_CHUNK_SIZE
+    now = timezone.now()
+    approved = 0
+    for ids in _id_chunks(queryset.filter(status="PENDING"), chunk_size):
+        approved += WithdrawRequest.objects.filter(pk__in=ids, status="PENDING").update(
+            status="APPROVED", processed_at=now
+        )
+    return approved
+
+
+def reject_withdrawals(queryset, chunk_size: int = None) -> int:
+    chunk_size = chunk_size or settings.PAYOUT_CHUNK_SIZE
+    now = timezone.now()
+    rejected = 0
+    for ids in _id_chunks(queryset.filter(status="PENDING"), chunk_size):
+        with transaction.atomic():
+            rows = list(
+                WithdrawRequest.objects.select_for_update().filter(pk__in=ids, status="PENDING")
+                .values_list("pk", "user_id", "user__wallet_address", "amount", "debited")
+            )
+            ids = [r[0] for r in rows]
+            if WithdrawRequest.objects.filter(pk__in=ids, status="PENDING").update(
+                status="REJECTED", processed_at=now
+            ) != len(rows):
+                # another run moved some of them first: refund only the ones this UPDATE rejected
+                mine = set(WithdrawRequest.objects.filter(pk__in=ids, status="REJECTED", processed_at=now)
+                           .values_list("pk", flat=True))
+                logger.warning("[PAYOUT] %s requests changed during rejection, skipped", len(rows) - len(mine))
+                rows = [r for r in rows if r[0] in mine]
+
+            deltas = WalletDeltas()
+            with LedgerWriter() as ledger:
+                for pk, user_id, _, amount, debited in rows:
+                    for field, taken in (debited or {"downline_profit_instant": amount}).items():
+                        deltas.add(user_id, field, Decimal(taken))
+                        ledger.add(user_id, WITHDRAW_LEDGER_TYPES[field][1], Decimal(taken),
+                                   meta={"withdraw_request": pk})
+            deltas.apply()
+            invalidate_wallet(*{r[2] for r in rows})
+        rejected += len(rows)
+    return rejected
+
+
+def payout_rows(queryset):
+    """Approved requests as tuples of ``PAYOUT_COLUMNS``, streamed from the database."""
+    return (
+        queryset.filter(status="APPROVED").order_by("pk")
+        .values_list("pk", "user__wallet_address", "destination_wallet", "amount", "scope",
+                     "created_at", "processed_at")
+        .iterator(chunk_size=settings.PAYOUT_CHUNK_SIZE)
+    )
+
+
+def stream_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(PAYOUT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def stream_jsonl(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(PAYOUT_COLUMNS, row)), default=str) + "\n"
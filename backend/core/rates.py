@@ -0,0 +1,229 @@
+"""
+TON/USD rate provider.
+
+Rates are read from the shared Django cache (Redis in production, in-process
+locmem otherwise) instead of calling CoinGecko on every purchase:
+
+- a sample younger than ``TON_RATE_TTL`` is served as-is;
+- a sample older than that but within ``TON_RATE_STALE_TTL`` is still served,
+  and a background refresh is queued (stale-while-revalidate);
+- only when there is no usable sample do we fetch synchronously.
+
+Every fetch goes through ``refresh``, which holds ``REFRESH_LOCK_KEY`` while it
+talks to the upstream, so a cold cache costs one upstream call: the other
+requests wait for that sample (taking over if the fetch fails) and fall back
+to the last known rate when it does not arrive in time.
+
+The ``refresh_ton_rate`` Celery task keeps the sample warm ahead of expiry, so
+in steady state the request path never talks to the network.
+
+The upstream is pluggable through ``TON_RATE_SOURCE`` (a dotted path to a
+``RateSource`` subclass); ``StaticRateSource`` is the local stand-in for tests
+and benchmarks.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+import logging
+import time
+import uuid
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=usd"
+
+CACHE_KEY = "rates:ton_usd"
+LAST_KNOWN_KEY = "rates:ton_usd:last"
+REFRESH_LOCK_KEY = "rates:ton_usd:refresh"
+QUEUED_KEY = "rates:ton_usd:queued"
+# how often a request waiting for another process's fetch looks for the new sample
+WAIT_POLL_SECONDS = 0.05
+
+
+@dataclass(frozen=True)
+class RateSample:
+    rate: Decimal
+    fetched_at: datetime
+    sample_id: str
+    source: str
+
+    def age(self, now=None) -> float:
+        now = now or timezone.now()
+        return (now - self.fetched_at).total_seconds()
+
+    def to_cache(self) -> dict:
+        return {
+            "rate": str(self.rate),
+            "fetched_at": self.fetched_at.isoformat(),
+            "sample_id": self.sample_id,
+            "source": self.source,
+        }
+
+    @classmethod
+    def from_cache(cls, data: dict) -> "RateSample":
+        return cls(
+            rate=Decimal(data["rate"]),
+            fetched_at=datetime.fromisoformat(data["fetched_at"]),
+            sample_id=data["sample_id"],
+            source=data["source"],
+        )
+
+
+class RateSource:
+    """Upstream for the TON/USD rate. Subclasses implement ``fetch``."""
+
+    name = "base"
+
+    def fetch(self) -> Decimal:
+        raise NotImplementedError
+
+
+class CoinGeckoSource(RateSource):
+    name = "coingecko"
+
+    def __init__(self, url: str = None, timeout: float = None):
+        self.url = url or getattr(settings, "TON_RATE_URL", COINGECKO_URL)
+        self.timeout = timeout or getattr(settings, "TON_RATE_HTTP_TIMEOUT", 10)
+
+    def fetch(self) -> Decimal:
+        r = requests.get(self.url, timeout=self.timeout)
+        r.raise_for_status()
+        data = r.json()
+        return Decimal(str(data["the-open-network"]["usd"]))
+
+
+class StaticRateSource(RateSource):
+    """Fixed rate, for tests and local benchmarks."""
+
+    name = "static"
+
+    def __init__(self, rate=None):
+        self.rate = Decimal(str(rate if rate is not None else getattr(settings, "TON_RATE_STATIC", "5")))
+
+    def fetch(self) -> Decimal:
+        return self.rate
+
+
+_source = None
+
+
+def get_source() -> RateSource:
+    global _source
+    if _source is None:
+        _source = import_string(settings.TON_RATE_SOURCE)()
+    return _source
+
+
+def set_source(source) -> None:
+    """Swap the upstream at runtime (tests); ``None`` reloads it from settings."""
+    global _source
+    _source = source
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "TON_RATE_TTL", 60))
+
+
+def _stale_ttl() -> int:
+    return int(getattr(settings, "TON_RATE_STALE_TTL", 600))
+
+
+def _lock_ttl() -> float:
+    # a fetch never outlives the upstream timeout, so neither does its lock
+    return float(getattr(settings, "TON_RATE_HTTP_TIMEOUT", 10)) + 5
+
+
+def cached_sample(key: str = CACHE_KEY):
+    data = cache.get(key)
+    if not data:
+        return None
+    try:
+        return RateSample.from_cache(data)
+    except (KeyError, TypeError, ValueError):
+        logger.warning("[RATE] dropping malformed cache entry %r", data)
+        return None
+
+
+def refresh_rate() -> RateSample:
+    """Fetch from the upstream and store a new sample in the shared cache."""
+    source = get_source()
+    rate = source.fetch()
+    sample = RateSample(
+        rate=rate,
+        fetched_at=timezone.now(),
+        sample_id=uuid.uuid4().hex[:12],
+        source=source.name,
+    )
+    cache.set(CACHE_KEY, sample.to_cache(), timeout=_ttl() + _stale_ttl())
+    cache.set(LAST_KNOWN_KEY, sample.to_cache(), timeout=None)
+    logger.info("[RATE] refreshed rate=%s sample=%s source=%s", rate, sample.sample_id, source.name)
+    return sample
+
+
+def _usable(sample):
+    if sample is not None and sample.age() < _ttl() + _stale_ttl():
+        return sample
+    return None
+
+
+def refresh(force: bool = True):
+    """
+    Fetch and store a new sample under ``REFRESH_LOCK_KEY``. Returns ``None``
+    without calling the upstream when another process is already fetching;
+    without ``force`` a usable sample stored meanwhile is returned instead.
+    """
+    if not cache.add(REFRESH_LOCK_KEY, 1, timeout=_lock_ttl()):
+        return None
+    try:
+        return (not force and _usable(cached_sample())) or refresh_rate()
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+
+
+def _schedule_refresh() -> None:
+    # only one process queues the refresh per TTL window
+    if not cache.add(QUEUED_KEY, 1, timeout=_ttl()):
+        return
+    try:
+        from .tasks import refresh_ton_rate
+        refresh_ton_rate.delay()
+    except Exception:
+        logger.exception("[RATE] could not queue background refresh")
+        cache.delete(QUEUED_KEY)
+
+
+def _fetch_or_wait() -> RateSample:
+    # one process fetches; the others wait for its sample and take over if its fetch fails
+    deadline = time.monotonic() + _lock_ttl()
+    while time.monotonic() < deadline:
+        sample = _usable(cached_sample()) or refresh(force=False)
+        if sample is not None:
+            return sample
+        time.sleep(WAIT_POLL_SECONDS)
+    sample = cached_sample(LAST_KNOWN_KEY)
+    if sample is None:
+        raise RuntimeError("no TON/USD rate available")
+    logger.warning("[RATE] upstream unavailable, serving last known sample=%s", sample.sample_id)
+    return sample
+
+
+def get_ton_usd_rate() -> RateSample:
+    """
+    Current TON/USD sample: fresh from cache, stale-while-revalidate, or a
+    synchronous (single-flight) fetch when nothing usable is cached.
+    """
+    sample = cached_sample()
+    if sample is not None:
+        age = sample.age()
+        if age < _ttl():
+            return sample
+        if age < _ttl() + _stale_ttl():
+            _schedule_refresh()
+            return sample
+    return _fetch_or_wait()
@@ -0,0 +1,43 @@
+"""
+Referral closure table maintenance.
+
+``ReferralPath`` holds one row per (ancestor, descendant) pair of the
+``AppUser.inviter`` tree. New edges are linked by
+``services.link_referral_paths``; ``backfill_paths`` rebuilds the whole table
+level by level with one ``INSERT ... SELECT`` per depth, so it runs in as many
+statements as the tree is deep, not one per user.
+"""
+from django.db import connections, transaction
+
+
+def backfill_paths(AppUser, ReferralPath, using: str = "default", max_depth: int = 1000) -> dict:
+    """
+    Recreate every closure row from ``AppUser.inviter``. Takes the model
+    classes so data migrations can pass their historical models.
+    """
+    users = AppUser._meta.db_table
+    paths = ReferralPath._meta.db_table
+    levels = {}
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {paths}")
+        cursor.execute(
+            f"INSERT INTO {paths} (ancestor_id, descendant_id, depth) "
+            f"SELECT inviter_id, id, 1 FROM {users} WHERE inviter_id IS NOT NULL AND inviter_id <> id"
+        )
+        levels[1] = cursor.rowcount
+
+        depth = 1
+        while levels[depth] > 0 and depth < max_depth:
+            cursor.execute(
+                f"INSERT INTO {paths} (ancestor_id, descendant_id, depth) "
+                f"SELECT p.ancestor_id, u.id, p.depth + 1 FROM {paths} p "
+                f"JOIN {users} u ON u.inviter_id = p.descendant_id "
+                f"WHERE p.depth = %s AND u.id <> p.ancestor_id AND NOT EXISTS ("
+                f"SELECT 1 FROM {paths} x WHERE x.ancestor_id = p.ancestor_id AND x.descendant_id = u.id)",
+                [depth],
+            )
+            depth += 1
+            levels[depth] = cursor.rowcount
+
+    return {d: n for d, n in levels.items() if n}
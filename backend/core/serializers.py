@@ -1,5 +1,13 @@
 from rest_framework import serializers
-from .models import AppUser, Wallet, Purchase, WithdrawRequest
+from .models import AppUser, Wallet, Ledger, Purchase, PurchaseIntake, WithdrawRequest
+
+class DynamicFieldsMixin:
+    """Accepts ``fields=[...]`` to serialize only a subset of ``Meta.fields``."""
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,13 +27,23 @@ class WalletSerializer(serializers.ModelSerializer):
             "withdrawable_total",
         ]
     def get_withdrawable_total(self, obj):
-        return obj.withdrawable_total()
+        return obj.withdrawable_total
 
-class PurchaseSerializer(serializers.ModelSerializer):
+class PurchaseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Purchase
         fields = "__all__"
 
+class LedgerSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Ledger
+        fields = ["id", "typ", "amount", "invoice", "meta", "created_at"]
+
+class PurchaseIntakeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PurchaseIntake
+        fields = ["id", "ton_tx_hash", "ton_amount", "status", "attempts", "error", "created_at", "updated_at"]
+
 class WithdrawSerializer(serializers.ModelSerializer):
     class Meta:
         model = WithdrawRequest
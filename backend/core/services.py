@@ -1,21 +1,30 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from decimal import Decimal
+from functools import partial
+from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import F
-import requests
+from django.db import connection, transaction
+from django.db.models import F, Q
 import uuid
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
-from .models import AppUser, Wallet, Ledger, Purchase
+from . import ledger_buffer, tracing
+from .cache import invalidate_wallet
+from .chain import normalize_tx_hash
+from .models import AppUser, Wallet, Ledger, Purchase, PurchaseIntake, ReferralPath, WithdrawRequest
+from .rates import RateSample, get_ton_usd_rate
 
 # ثابت‌ها
 ECG_PER_USD = Decimal("312")  # مقدار هر 1 دلار به ECG
 SELF_BONUS_RATE = Decimal("0.05")
 UPLINE_RATE = Decimal("0.05")
-COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price?ids=the-open-network&vs_currencies=usd"
 REFERRAL_TOKEN_REWARD = Decimal("3")  # پاداش هر دعوت
+DAILY_REWARD = Decimal("1.0")  # پاداش هر claim تایمر
+DAILY_CLAIM_COOLDOWN = timezone.timedelta(hours=24)
 
 
 def get_or_create_user(wallet_address: str) -> AppUser:
@@ -25,6 +34,74 @@ def get_or_create_user(wallet_address: str) -> AppUser:
     user, created = AppUser.objects.get_or_create(wallet_address=wallet_address)
     if created:
         Wallet.objects.create(user=user)
+        # ممکن است نمای خالیِ این آدرس قبلا کش شده باشد
+        invalidate_wallet(wallet_address)
+    return user
+
+
+class _UserIdLRU:
+    """LRU محدود wallet_address -> user id (داخل همین پروسه)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def discard(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_user_ids = _UserIdLRU(settings.USER_LOOKUP_CACHE_SIZE)
+
+
+def find_user(wallet_address: str):
+    """
+    خواندن کاربر بدون ساختن (برای endpoint های GET)؛ برای آدرس ناشناخته None
+    """
+    qs = AppUser.objects.select_related("wallet")
+    user_id = _user_ids.get(wallet_address)
+    if user_id is not None:
+        user = qs.filter(pk=user_id).first()
+        if user is not None:
+            return user
+        _user_ids.discard(wallet_address)
+
+    user = qs.filter(wallet_address=wallet_address).first()
+    if user is not None:
+        _user_ids.put(wallet_address, user.id)
+    return user
+
+
+async def afind_user(wallet_address: str):
+    """
+    نسخه‌ی async از find_user (برای view های ASGI) با همان LRU
+    """
+    qs = AppUser.objects.select_related("wallet")
+    user_id = _user_ids.get(wallet_address)
+    if user_id is not None:
+        user = await qs.filter(pk=user_id).afirst()
+        if user is not None:
+            return user
+        _user_ids.discard(wallet_address)
+
+    user = await qs.filter(wallet_address=wallet_address).afirst()
+    if user is not None:
+        _user_ids.put(wallet_address, user.id)
     return user
 
 
@@ -33,15 +110,17 @@ def apply_referral(inviter_code: str, user: AppUser):
     اعمال کد دعوت (referral) به کاربر
     + دادن 3 توکن به inviter در referral_bonus
     """
-    logger.info("[REF] apply inviter_code=%s to user=%s (inviter_id=%s)",
-                inviter_code, user.wallet_address, user.inviter_id)
+    with tracing.span("apply_referral", user_id=user.id, inviter_code=inviter_code) as sp:
+        _apply_referral(inviter_code, user, sp)
 
+
+def _apply_referral(inviter_code: str, user: AppUser, sp):
     if user.inviter_id:
-        logger.info("[REF] skipped: inviter already set")
+        sp.set(skipped="inviter already set")
         return
 
-    inviter = AppUser.objects.filter(referral_code=inviter_code).first()
-    logger.info("[REF] inviter found? %s", bool(inviter))
+    with tracing.span("inviter_lookup"):
+        inviter = AppUser.objects.filter(referral_code=inviter_code).first()
 
     if not inviter:
         logger.warning("[REF] invalid inviter_code=%s", inviter_code)
@@ -51,23 +130,29 @@ def apply_referral(inviter_code: str, user: AppUser):
         logger.warning("[REF] self referral blocked user_id=%s", user.id)
         return
 
-    # ست کردن inviter
+    # ست کردن inviter (+ شمارنده‌ی invitee_count و جدول closure در همان تراکنش)
+    with tracing.span("link_inviter", inviter_id=inviter.id) as link_sp, transaction.atomic():
+        if ReferralPath.objects.filter(ancestor_id=user.id, descendant_id=inviter.id).exists():
+            logger.warning("[REF] cycle blocked user_id=%s inviter_id=%s", user.id, inviter.id)
+            return
+        if not AppUser.objects.filter(pk=user.pk, inviter__isnull=True).update(inviter=inviter):
+            sp.set(skipped="inviter already set")
+            return
+        AppUser.objects.filter(pk=inviter.pk).update(invitee_count=F("invitee_count") + 1)
+        link_sp.set(paths=link_referral_paths(inviter.id, user.id))
     user.inviter = inviter
-    user.save(update_fields=["inviter"])
     logger.info("[REF] success user=%s inviter=%s", user.id, inviter.id)
 
     # 👇 دادن پاداش 3 توکن به inviter
     try:
-        with transaction.atomic():
+        with tracing.span("referral_bonus", amount=REFERRAL_TOKEN_REWARD) as bonus_sp, transaction.atomic():
             # مطمئن شدن که wallet وجود دارد
             w, created = Wallet.objects.get_or_create(user=inviter)
             if created:
-                logger.info("[REF] inviter wallet created inviter_id=%s", inviter.id)
+                bonus_sp.set(inviter_wallet_created=True)
 
             # اضافه کردن referral_bonus
-            Wallet.objects.filter(user=inviter).update(
-                referral_bonus=F("referral_bonus") + REFERRAL_TOKEN_REWARD
-            )
+            credit_wallet(inviter.id, referral_bonus=REFERRAL_TOKEN_REWARD)
 
             # ثبت Ledger برای ردگیری
             Ledger.objects.create(
@@ -76,115 +161,440 @@ def apply_referral(inviter_code: str, user: AppUser):
                 amount=REFERRAL_TOKEN_REWARD,
                 meta={"invitee": user.wallet_address}
             )
-            logger.info("[REF] inviter rewarded %s tokens for invitee=%s",
-                        REFERRAL_TOKEN_REWARD, user.wallet_address)
+            invalidate_wallet(inviter.wallet_address)
     except Exception as e:
         logger.exception("[REF] failed to reward inviter: %s", e)
 
 
-def fetch_ton_usd_rate() -> Decimal:
+def link_referral_paths(inviter_id: int, user_id: int) -> int:
+    """
+    افزودن مسیرهای closure برای یال inviter -> user:
+    هر بالاسریِ inviter (و خودش) به user و همه‌ی زیرمجموعه‌های user وصل می‌شود
+    """
+    uplines = [(inviter_id, 0)] + list(
+        ReferralPath.objects.filter(descendant_id=inviter_id).values_list("ancestor_id", "depth")
+    )
+    downlines = [(user_id, 0)] + list(
+        ReferralPath.objects.filter(ancestor_id=user_id).values_list("descendant_id", "depth")
+    )
+    paths = [
+        ReferralPath(ancestor_id=a, descendant_id=d, depth=da + dd + 1)
+        for a, da in uplines
+        for d, dd in downlines
+    ]
+    ReferralPath.objects.bulk_create(paths, ignore_conflicts=True)
+    return len(paths)
+
+
+# =======================
+# Balance mutations
+# =======================
+# همه‌ی تغییرات موجودی با UPDATE شرطی تک‌دستوری انجام می‌شوند (بدون
+# select_for_update و بدون save کامل ردیف)، تا با F() های تسک‌های Celery
+# تداخل نکنند و درخواست‌های همزمان موجودی را منفی نکنند.
+
+WITHDRAW_SCOPES = ("DOWNLINE_ONLY", "ALL_WITHDRAWABLE")
+# ترتیب برداشت در ALL_WITHDRAWABLE
+WITHDRAW_WATERFALL = (
+    "downline_profit_instant",
+    "referral_bonus",
+    "daily_reward_unlocked",
+    "self_profit_unlocked",
+    "principal_unlocked",
+)
+# typ ردیف‌های Ledger برداشت از هر bucket و برگشت آن (یک ردیف برای هر bucket)
+WITHDRAW_LEDGER_TYPES = {
+    "downline_profit_instant": ("WITHDRAW", "WITHDRAW_REFUND"),
+    "referral_bonus": ("WITHDRAW_REF_BONUS", "WITHDRAW_REF_BONUS_REFUND"),
+    "daily_reward_unlocked": ("WITHDRAW_DAILY", "WITHDRAW_DAILY_REFUND"),
+    "self_profit_unlocked": ("WITHDRAW_SELF_PROFIT", "WITHDRAW_SELF_PROFIT_REFUND"),
+    "principal_unlocked": ("WITHDRAW_PRINCIPAL", "WITHDRAW_PRINCIPAL_REFUND"),
+}
+
+
+class InsufficientBalance(ValueError):
+    pass
+
+
+def credit_wallet(user_id: int, **amounts) -> bool:
     """
-    گرفتن نرخ TON به USD از CoinGecko
+    افزودن به فیلدهای کیف پول در یک UPDATE: credit_wallet(uid, referral_bonus=x, ...)
     """
-    r = requests.get(COINGECKO_URL, timeout=10)
-    r.raise_for_status()
-    data = r.json()
-    rate = data["the-open-network"]["usd"]
-    return Decimal(str(rate))
+    updates = {field: F(field) + amount for field, amount in amounts.items()}
+    return Wallet.objects.filter(user_id=user_id).update(**updates) == 1
 
 
-@transaction.atomic
-def register_purchase(user: AppUser, ton_amount: Decimal, ton_tx_hash: str, is_test: bool = False) -> Purchase:
+def debit_wallet(user_id: int, field: str, amount: Decimal) -> bool:
     """
-    ثبت خرید کاربر:
-    - ایجاد Purchase
-    - اضافه کردن Locked ها به Wallet کاربر
-    - افزودن Ledger
-    - پرداخت 5٪ به بالاسری در downline_profit_instant
+    کسر از یک فیلد فقط اگر موجودی کافی باشد (UPDATE ... WHERE field >= amount)
     """
-    logger.info("[BUY] start user=%s user_id=%s inviter_id=%s ton_amount=%s tx=%s",
-                user.wallet_address, user.id, user.inviter_id, ton_amount, ton_tx_hash)
+    return Wallet.objects.filter(user_id=user_id, **{f"{field}__gte": amount}).update(
+        **{field: F(field) - amount}
+    ) == 1
 
-    # جلوگیری از تراکنش تکراری
-    if Purchase.objects.filter(ton_tx_hash=ton_tx_hash).exists():
-        logger.warning("[BUY] duplicate tx=%s", ton_tx_hash)
-        raise ValueError("TX already registered")
 
-    # fetch rate
-    from .services import fetch_ton_usd_rate
-    rate = fetch_ton_usd_rate()
-    usd_value = ton_amount * rate
+def debit_waterfall(user_id: int, amount: Decimal, fields=WITHDRAW_WATERFALL, attempts: int = 3):
+    """
+    کسر amount به ترتیب fields. سهم هر فیلد از موجودیِ خوانده‌شده حساب می‌شود
+    (هر فیلد min(موجودی، باقی‌مانده)) و با یک UPDATE شرطی کسر می‌شود که برای
+    هر فیلد موجودی >= سهم آن را شرط می‌کند؛ اگر در این فاصله موجودی کم شده
+    باشد دوباره خوانده می‌شود.
+    خروجی: {فیلد: مقدار کسرشده} (برای برگشت دقیق در صورت رد درخواست) یا None
+    """
+    for _ in range(attempts):
+        balances = Wallet.objects.filter(user_id=user_id).values(*fields).first()
+        if balances is None or sum(balances.values()) < amount:
+            return None
+        split, remaining = {}, amount
+        for field in fields:
+            take = min(balances[field], remaining)
+            if take > 0:
+                split[field] = take
+                remaining -= take
+        guard = {f"{field}__gte": take for field, take in split.items()}
+        if Wallet.objects.filter(user_id=user_id, **guard).update(
+                **{field: F(field) - take for field, take in split.items()}) == 1:
+            return split
+    return None
+
+
+@dataclass(frozen=True)
+class DailyClaim:
+    rewarded: bool
+    next_claim_at: object  # datetime
+    withdrawable_total: Decimal = None
+    referral_bonus: Decimal = None
+    rewards_count: int = None
+
+
+# ستون‌هایی که پاسخ tick از کیف پول لازم دارد
+_CLAIM_RETURNING = ("withdrawable_total", "referral_bonus", "rewards_count")
+
+
+def _credit_daily_returning(user_id: int):
+    """
+    UPDATE کیف پول برای claim و برگرداندن ستون‌های پاسخ در همان دستور
+    (RETURNING روی PostgreSQL و SQLite >= 3.35، در غیر این صورت یک SELECT)
+    """
+    if connection.vendor == "postgresql" or (
+            connection.vendor == "sqlite" and connection.Database.sqlite_version_info >= (3, 35)):
+        qn = connection.ops.quote_name
+        fields = [Wallet._meta.get_field(name) for name in _CLAIM_RETURNING]
+        sql = (
+            f"UPDATE {qn(Wallet._meta.db_table)} SET "
+            f"{qn('daily_reward_unlocked')} = {qn('daily_reward_unlocked')} + %s, "
+            f"{qn('rewards_count')} = {qn('rewards_count')} + 1 "
+            f"WHERE {qn('user_id')} = %s RETURNING {', '.join(qn(f.column) for f in fields)}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [DAILY_REWARD, user_id])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        values = []
+        for field, value in zip(fields, row):
+            col = field.get_col(Wallet._meta.db_table)
+            for converter in connection.ops.get_db_converters(col) + field.get_db_converters(connection):
+                value = converter(value, col, connection)
+            values.append(value)
+        return values
+
+    if not credit_wallet(user_id, daily_reward_unlocked=DAILY_REWARD, rewards_count=1):
+        return None
+    return list(Wallet.objects.filter(user_id=user_id).values_list(*_CLAIM_RETURNING).get())
+
+
+def claim_daily(wallet_address: str, now=None) -> DailyClaim:
+    """
+    claim پاداش روزانه‌ی تایمر در یک تراکنش کوتاه:
+    - بررسی cooldown و جلو بردن next_daily_claim_at با یک UPDATE شرطی
+      (دو tap همزمان فقط یک بار پاداش می‌گیرند)
+    - اضافه کردن پاداش و شمارنده به کیف پول با همان UPDATE ای که موجودی را برمی‌گرداند
+    ردیف Ledger بعد از commit از طریق ledger_buffer (بافر Redis) نوشته می‌شود
+    """
+    now = now or timezone.now()
+    for _ in range(2):
+        user_id = _user_ids.get(wallet_address)
+        if user_id is None:
+            user_id = get_or_create_user(wallet_address).id
+            _user_ids.put(wallet_address, user_id)
+
+        with transaction.atomic():
+            claimed = AppUser.objects.filter(
+                Q(next_daily_claim_at__isnull=True) | Q(next_daily_claim_at__lte=now), pk=user_id,
+            ).update(next_daily_claim_at=now + DAILY_CLAIM_COOLDOWN)
+            if claimed:
+                balances = _credit_daily_returning(user_id)
+                if balances is None:
+                    raise Wallet.DoesNotExist(f"no wallet for user {user_id}")
+                # فقط بعد از commit اعتبار؛ اگر push به Redis شکست بخورد مستقیم درج می‌شود
+                transaction.on_commit(partial(
+                    ledger_buffer.push, user_id, "DAILY_UNLOCK", DAILY_REWARD,
+                    meta={"source": "timer"}, created_at=now,
+                ))
+
+        if claimed:
+            invalidate_wallet(wallet_address)
+            return DailyClaim(True, now + DAILY_CLAIM_COOLDOWN, *balances)
+
+        next_at = AppUser.objects.filter(pk=user_id).values_list("next_daily_claim_at", flat=True).first()
+        if next_at is not None:
+            return DailyClaim(False, next_at)
+        # کاربرِ LRU دیگر وجود ندارد؛ یک بار دیگر با get_or_create
+        _user_ids.discard(wallet_address)
+    raise AppUser.DoesNotExist(wallet_address)
+
+
+def request_withdrawal(user: AppUser, scope: str, amount: Decimal, destination_wallet: str) -> WithdrawRequest:
+    """
+    کسر موجودی و ثبت WithdrawRequest + Ledger در یک تراکنش کوتاه
+    برای هر bucket کسرشده یک ردیف Ledger (WITHDRAW_LEDGER_TYPES) با شناسه‌ی همان درخواست
+    """
+    with transaction.atomic():
+        if scope == "DOWNLINE_ONLY":
+            if not debit_wallet(user.id, "downline_profit_instant", amount):
+                raise InsufficientBalance("insufficient downline instant balance")
+            split = {"downline_profit_instant": amount}
+        else:
+            split = debit_waterfall(user.id, amount)
+            if split is None:
+                raise InsufficientBalance("insufficient withdrawable total")
+
+        # سهم هر bucket؛ رد درخواست هر سهم را به bucket خودش برمی‌گرداند (core.payouts)
+        req = WithdrawRequest.objects.create(
+            user=user,
+            scope=scope,
+            amount=amount,
+            destination_wallet=destination_wallet,
+            status="PENDING",
+            debited={field: str(taken) for field, taken in split.items()},
+        )
+        meta = {"withdraw_request": req.id, "destination": destination_wallet}
+        Ledger.objects.bulk_create([
+            Ledger(user=user, typ=WITHDRAW_LEDGER_TYPES[field][0], amount=taken, meta=meta)
+            for field, taken in split.items()
+        ])
+        invalidate_wallet(user.wallet_address)
+
+    logger.info("[WITHDRAW] user_id=%s scope=%s amount=%s request=%s", user.id, scope, amount, req.id)
+    return req
+
+
+def fetch_ton_usd_rate() -> Decimal:
+    """
+    گرفتن نرخ TON به USD (از کش مشترک؛ جزئیات در core.rates)
+    """
+    return get_ton_usd_rate().rate
+
+
+@dataclass(frozen=True)
+class PurchaseQuote:
+    sample: RateSample
+    usd_value: Decimal
+    ecg_value: Decimal
+    self_bonus: Decimal
+
+    @property
+    def rate(self) -> Decimal:
+        return self.sample.rate
+
+
+def quote_purchase(ton_amount: Decimal) -> PurchaseQuote:
+    """
+    قیمت‌گذاری خرید (بیرون از تراکنش دیتابیس)
+    """
+    # نرخ از کش (core.rates)؛ نمونه‌ی استفاده‌شده روی Purchase ثبت می‌شود
+    sample = get_ton_usd_rate()
+    usd_value = ton_amount * sample.rate
     ecg_value = usd_value * ECG_PER_USD
-    self_bonus = ecg_value * SELF_BONUS_RATE
-    upline_bonus = ecg_value * UPLINE_RATE
+    return PurchaseQuote(sample=sample, usd_value=usd_value, ecg_value=ecg_value,
+                         self_bonus=ecg_value * SELF_BONUS_RATE)
 
+
+def record_purchase(user: AppUser, ton_amount: Decimal, ton_tx_hash: str,
+                    quote: PurchaseQuote, is_test: bool = False) -> Purchase:
+    """
+    ایجاد Purchase + اضافه کردن Locked ها به Wallet کاربر + Ledger
+    (باید داخل transaction.atomic صدا زده شود)
+    با PURCHASE_VERIFICATION خرید PENDING ثبت می‌شود و اعتبارها را
+    worker تایید تراکنش (core.verification) بعدا اعمال می‌کند
+    """
     now = timezone.now()
     invoice_no = uuid.uuid4().hex[:12].upper()
-    principal_unlock_at = now + timezone.timedelta(days=365)
-    self_profit_unlock_at = now + timezone.timedelta(days=30)
-
-    logger.info("[BUY] computed ecg_value=%s self_bonus=%s upline_bonus=%s invoice=%s",
-                ecg_value, self_bonus, upline_bonus, invoice_no)
+    verification_status = "PENDING" if settings.PURCHASE_VERIFICATION else "VERIFIED"
 
     # 1) ایجاد Purchase
-    p = Purchase.objects.create(
-        user=user,
-        invoice_no=invoice_no,
-        ton_amount=ton_amount,
-        ton_tx_hash=ton_tx_hash,
-        ton_usd_rate=rate,
-        usd_value=usd_value,
-        ecg_value=ecg_value,
-        self_profit_5=self_bonus,
-        principal_unlock_at=principal_unlock_at,
-        self_profit_unlock_at=self_profit_unlock_at,
-    )
-    logger.info("[BUY] purchase created id=%s", p.id)
+    with tracing.span("purchase_insert", invoice=invoice_no, ecg_value=quote.ecg_value,
+                      rate=quote.rate, sample=quote.sample.sample_id) as sp:
+        p = Purchase.objects.create(
+            user=user,
+            invoice_no=invoice_no,
+            ton_amount=ton_amount,
+            ton_tx_hash=ton_tx_hash,
+            ton_usd_rate=quote.rate,
+            ton_usd_rate_sample=quote.sample.sample_id,
+            ton_usd_rate_at=quote.sample.fetched_at,
+            usd_value=quote.usd_value,
+            ecg_value=quote.ecg_value,
+            self_profit_5=quote.self_bonus,
+            principal_unlock_at=now + timezone.timedelta(days=365),
+            self_profit_unlock_at=now + timezone.timedelta(days=30),
+            verification_status=verification_status,
+        )
+        sp.set(purchase_id=p.id, verification=verification_status)
+
+    if verification_status == "PENDING":
+        # بدون I/O زنجیره در مسیر درخواست؛ فقط worker تایید را زودتر بیدار می‌کنیم
+        from .verification import schedule_verification
+        transaction.on_commit(schedule_verification)
+        return p
 
     # 2) آپدیت کیف پول خود کاربر
-    Wallet.objects.select_for_update().filter(user=user).update(
-        principal_locked=F("principal_locked") + ecg_value,
-        self_profit_locked=F("self_profit_locked") + self_bonus
-    )
+    with tracing.span("wallet_credit", principal_locked=quote.ecg_value, self_profit_locked=quote.self_bonus):
+        credit_wallet(user.id, principal_locked=quote.ecg_value, self_profit_locked=quote.self_bonus)
 
-    Ledger.objects.create(user=user, typ="BUY_PRINCIPAL", amount=ecg_value,
-                          meta={"invoice": invoice_no, "tx": ton_tx_hash, "is_test": is_test})
-    Ledger.objects.create(user=user, typ="BUY_SELF_PROFIT", amount=self_bonus,
-                          meta={"invoice": invoice_no, "tx": ton_tx_hash, "is_test": is_test})
+    with tracing.span("ledger_insert", rows=2):
+        Ledger.objects.create(user=user, typ="BUY_PRINCIPAL", amount=quote.ecg_value, invoice=invoice_no,
+                              meta={"invoice": invoice_no, "tx": ton_tx_hash, "is_test": is_test})
+        Ledger.objects.create(user=user, typ="BUY_SELF_PROFIT", amount=quote.self_bonus, invoice=invoice_no,
+                              meta={"invoice": invoice_no, "tx": ton_tx_hash, "is_test": is_test})
 
-    logger.info("[BUY] user wallet updated: +principal_locked=%s +self_profit_locked=%s",
-                ecg_value, self_bonus)
+    invalidate_wallet(user.wallet_address)
+    return p
 
-    # 3) پرداخت سود به بالاسری (downline_profit_instant)
-    if user.inviter_id:
-        inv_wallet, created = Wallet.objects.get_or_create(user=user.inviter)
+
+def pay_upline(user: AppUser, purchase: Purchase, is_test: bool = False) -> Decimal:
+    """
+    پرداخت 5٪ به بالاسری در downline_profit_instant
+    (باید داخل transaction.atomic صدا زده شود)
+    """
+    if not user.inviter_id:
+        tracing.current().set(upline="none")
+        return Decimal("0")
+    if purchase.verification_status != "VERIFIED":
+        # سود بالاسری بعد از تایید تراکنش پرداخت می‌شود (core.verification)
+        tracing.current().set(upline="after verification")
+        return Decimal("0")
+
+    upline_bonus = purchase.ecg_value * UPLINE_RATE
+    with tracing.span("pay_upline", inviter_id=user.inviter_id, downline_profit_instant=upline_bonus) as sp:
+        inv_wallet, created = Wallet.objects.get_or_create(user_id=user.inviter_id)
         if created:
-            logger.info("[BUY] inviter wallet created user_id=%s", user.inviter_id)
+            sp.set(inviter_wallet_created=True)
 
-        Wallet.objects.filter(user=user.inviter).update(
-            downline_profit_instant=F("downline_profit_instant") + upline_bonus
-        )
+        credit_wallet(user.inviter_id, downline_profit_instant=upline_bonus)
         Ledger.objects.create(
-            user=user.inviter,
+            user_id=user.inviter_id,
             typ="DOWNLINE_PROFIT",
             amount=upline_bonus,
-            meta={"from": user.wallet_address, "invoice": invoice_no, "tx": ton_tx_hash, "is_test": is_test}
+            invoice=purchase.invoice_no,
+            meta={"from": user.wallet_address, "invoice": purchase.invoice_no,
+                  "tx": purchase.ton_tx_hash, "is_test": is_test}
         )
-        logger.info("[BUY] upline wallet updated inviter_id=%s +downline_profit_instant=%s",
-                    user.inviter_id, upline_bonus)
-    else:
-        logger.info("[BUY] no inviter -> skip downline profit")
+        invalidate_wallet(user.inviter.wallet_address)
+    return upline_bonus
 
-    # 4) refresh از دیتابیس برای لاگ دقیق
-    user.wallet.refresh_from_db()
-    logger.info("[BUY] AFTER user_wallet principal_locked=%s self_profit_locked=%s downline_profit_instant=%s",
-                user.wallet.principal_locked, user.wallet.self_profit_locked, user.wallet.downline_profit_instant)
 
-    if user.inviter_id:
-        user.inviter.wallet.refresh_from_db()
-        logger.info("[BUY] AFTER upline_wallet principal_locked=%s self_profit_locked=%s downline_profit_instant=%s",
-                    user.inviter.wallet.principal_locked,
-                    user.inviter.wallet.self_profit_locked,
-                    user.inviter.wallet.downline_profit_instant)
+def register_purchase(user: AppUser, ton_amount: Decimal, ton_tx_hash: str, is_test: bool = False) -> Purchase:
+    """
+    ثبت خرید کاربر (همزمان):
+    - قیمت‌گذاری بیرون از تراکنش
+    - ایجاد Purchase + Locked ها + Ledger و پرداخت 5٪ به بالاسری در یک تراکنش کوتاه
+    hash تراکنش به یک شکل (hex) ذخیره می‌شود تا hex و base64 یک تراکنش دو خرید نشوند
+    """
+    ton_tx_hash = normalize_tx_hash(ton_tx_hash)
+    with tracing.span("register_purchase", user_id=user.id, inviter_id=user.inviter_id,
+                      ton_amount=ton_amount, tx=ton_tx_hash) as sp:
+        # جلوگیری از تراکنش تکراری (unique روی ton_tx_hash هم محافظ نهایی است)
+        with tracing.span("duplicate_check"):
+            duplicate = Purchase.objects.filter(ton_tx_hash=ton_tx_hash).exists()
+        if duplicate:
+            logger.warning("[BUY] duplicate tx=%s", ton_tx_hash)
+            raise ValueError("TX already registered")
+
+        with tracing.span("rate_fetch"):
+            quote = quote_purchase(ton_amount)
+
+        with transaction.atomic():
+            p = record_purchase(user, ton_amount, ton_tx_hash, quote, is_test=is_test)
+            pay_upline(user, p, is_test=is_test)
+
+        logger.info("[BUY] registered invoice=%s user_id=%s ecg_value=%s tx=%s",
+                    p.invoice_no, user.id, p.ecg_value, ton_tx_hash)
+
+        # موجودی‌های بعد از خرید فقط برای درخواست‌های نمونه‌برداری‌شده (دو query اضافه)
+        if tracing.sampled():
+            user.wallet.refresh_from_db(fields=["principal_locked", "self_profit_locked", "downline_profit_instant"])
+            sp.set(user_principal_locked=user.wallet.principal_locked,
+                   user_self_profit_locked=user.wallet.self_profit_locked)
+            if user.inviter_id:
+                user.inviter.wallet.refresh_from_db(fields=["downline_profit_instant"])
+                sp.set(upline_downline_profit_instant=user.inviter.wallet.downline_profit_instant)
 
     return p
+
+
+def submit_purchase(user: AppUser, ton_amount: Decimal, ton_tx_hash: str, is_test: bool = False) -> PurchaseIntake:
+    """
+    ثبت خرید در حالت ingestion ناهمزمان:
+    فقط یک PurchaseIntake (کلید: ton_tx_hash) ثبت و برای worker صف می‌شود.
+    ارسال دوباره‌ی همان tx (با هر encoding از hash) همان intake را برمی‌گرداند.
+    """
+    ton_tx_hash = normalize_tx_hash(ton_tx_hash)
+    already_intaken = PurchaseIntake.objects.filter(ton_tx_hash=ton_tx_hash).exists()
+    if not already_intaken and Purchase.objects.filter(ton_tx_hash=ton_tx_hash).exists():
+        logger.warning("[BUY] duplicate tx=%s", ton_tx_hash)
+        raise ValueError("TX already registered")
+
+    intake, created = PurchaseIntake.objects.get_or_create(
+        ton_tx_hash=ton_tx_hash,
+        defaults={"user": user, "ton_amount": ton_amount, "is_test": is_test},
+    )
+    if intake.user_id != user.id or intake.ton_amount != ton_amount:
+        logger.warning("[BUY] tx=%s already submitted with different data", ton_tx_hash)
+        raise ValueError("TX already registered")
+
+    if created:
+        from .tasks import process_purchase_intake
+        transaction.on_commit(lambda: process_purchase_intake.delay(intake.id))
+        logger.info("[BUY] intake queued id=%s tx=%s", intake.id, ton_tx_hash)
+    return intake
+
+
+@tracing.traced()
+def process_intake(intake_id: int) -> PurchaseIntake:
+    """
+    Pipeline worker برای PurchaseIntake. هر مرحله تراکنش کوتاه خودش را دارد
+    و با update شرطی روی status، اجرای دوباره (retry) آن را تکرار نمی‌کند:
+    PENDING -> CREDITED (Purchase + کیف پول کاربر) -> DONE (سود بالاسری)
+    """
+    intake = PurchaseIntake.objects.select_related("user").get(pk=intake_id)
+    user = intake.user
+
+    if intake.status == "PENDING":
+        if Purchase.objects.filter(ton_tx_hash=intake.ton_tx_hash).exists():
+            PurchaseIntake.objects.filter(pk=intake.pk, status="PENDING").update(
+                status="FAILED", error="TX already registered", updated_at=timezone.now())
+            intake.refresh_from_db()
+            return intake
+
+        with tracing.span("rate_fetch"):
+            quote = quote_purchase(intake.ton_amount)
+        with transaction.atomic():
+            claimed = PurchaseIntake.objects.filter(pk=intake.pk, status="PENDING").update(
+                status="CREDITED", updated_at=timezone.now())
+            if claimed:
+                p = record_purchase(user, intake.ton_amount, intake.ton_tx_hash, quote, is_test=intake.is_test)
+                PurchaseIntake.objects.filter(pk=intake.pk).update(purchase=p)
+        intake.refresh_from_db()
+
+    if intake.status == "CREDITED":
+        with transaction.atomic():
+            claimed = PurchaseIntake.objects.filter(pk=intake.pk, status="CREDITED").update(
+                status="DONE", updated_at=timezone.now())
+            if claimed:
+                pay_upline(user, intake.purchase, is_test=intake.is_test)
+        intake.refresh_from_db()
+
+    logger.info("[BUY] intake id=%s tx=%s status=%s", intake.id, intake.ton_tx_hash, intake.status)
+    return intake
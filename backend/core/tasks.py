@@ -1,46 +1,236 @@
-from celery import shared_task
+from celery import chord, current_app, shared_task
+from collections import defaultdict
+from datetime import datetime
+from django.conf import settings
 from django.utils import timezone
 from django.db.models import F
 from decimal import Decimal
+import logging
+import time
+
+from .models import Purchase, PurchaseIntake, TaskCheckpoint, Wallet
+from . import audit, ledger_buffer, partitions, rates, services, verification
+from .bulk import run_wallet_chunks, shard_ranges
+from .cache import invalidate_all_wallets
+from .unlocks import run_unlocks
+
+logger = logging.getLogger(__name__)
+
+DAILY_LOCKED_REWARD = Decimal("1")
+
+# shard run keys are "<run key>#<lo>-<hi>", so they stay the same whatever the shard count
+SHARD_SEP = "#"
+
+
+def _daily_add_chunk(wallets, ledger):
+    user_ids = list(wallets.select_for_update().values_list("user_id", flat=True))
+    wallets.update(daily_reward_locked=F("daily_reward_locked") + DAILY_LOCKED_REWARD)
+    for user_id in user_ids:
+        ledger.add(user_id, "DAILY_ADD", DAILY_LOCKED_REWARD)
+    return len(user_ids)
+
+
+def _shard_key(run_key, lo, hi):
+    return f"{run_key}{SHARD_SEP}{lo}-{hi}"
+
+
+def _planned_ranges(run_key):
+    # the id ranges persisted by the first attempt of a sharded run (empty for a new run)
+    keys = TaskCheckpoint.objects.filter(run_key__startswith=run_key + SHARD_SEP).values_list("run_key", flat=True)
+    return sorted(tuple(int(pk) for pk in key.rpartition(SHARD_SEP)[2].split("-")) for key in keys)
+
+
+def _fan_out(name, shard_task, run_key, ranges, **kwargs):
+    # one subtask per id range; summarize_shards reports once all of them have finished
+    header = [shard_task.s(_shard_key(run_key, lo, hi), lo, hi, **kwargs) for lo, hi in ranges]
+    summary = chord(header)(summarize_shards.s(name, run_key, time.time()))
+    logger.info("[%s] run=%s fanned out to %s shards", name, run_key, len(ranges))
+    return {"run_key": run_key, "shards": len(ranges), "summary_task_id": summary.id}
 
-from .models import Wallet, Purchase, Ledger
 
 @shared_task
-def daily_reward_add():
-    # every day +1 token to locked daily pool
-    Wallet.objects.update(daily_reward_locked=F("daily_reward_locked") + Decimal("1"))
-    # ledger bulk is heavy; skip for MVP
+def summarize_shards(results, name, run_key, started):
+    # chord callback: totals over the shard reports plus shard-level timings
+    totals = defaultdict(int)
+    timings = []
+    for report in results:
+        for key, value in report.items():
+            if key != "duration_ms" and isinstance(value, int) and not isinstance(value, bool):
+                totals[key] += value
+        timings.append({"shard": report.get("run_key"), "duration_ms": report["duration_ms"]})
+    durations = [t["duration_ms"] for t in timings] or [0]
+    summary = {
+        "run_key": run_key,
+        "shards": len(timings),
+        **totals,
+        "wall_ms": int((time.time() - started) * 1000),
+        "shard_ms": {"min": min(durations), "max": max(durations), "sum": sum(durations)},
+        "shard_timings": timings,
+    }
+    logger.info("[%s] run=%s shards=%s totals=%s wall_ms=%s shard_ms=%s", name, run_key, summary["shards"],
+                dict(totals), summary["wall_ms"], summary["shard_ms"])
+    return summary
+
+
+def _wallet_run(name, apply_chunk, run_key, shards, task, shard_task):
+    # a re-run (resume, redelivery) keeps the split of its first attempt, even if the shard count changed
+    sharded = not TaskCheckpoint.objects.filter(run_key=run_key).exists()
+    ranges = (_planned_ranges(run_key) or shard_ranges(Wallet, shards or settings.PERIODIC_TASK_SHARDS)
+              if sharded else [])
+    if len(ranges) > 1:
+        TaskCheckpoint.objects.bulk_create(
+            [TaskCheckpoint(run_key=_shard_key(run_key, lo, hi), task=task.name, next_pk=lo, end_pk=hi)
+             for lo, hi in ranges],
+            ignore_conflicts=True,
+        )
+        return _fan_out(name, shard_task, run_key, ranges)
+    report = run_wallet_chunks(name, apply_chunk, key=run_key, task=task.name)
+    invalidate_all_wallets()
+    return report
+
+
+def _wallet_shard(name, apply_chunk, run_key, lo, hi, task):
+    report = run_wallet_chunks(name, apply_chunk, key=run_key, task=task.name, start=lo, end=hi)
+    invalidate_all_wallets()
+    return report
+
+
+@shared_task(acks_late=True)
+def daily_reward_add(run_key=None, shards=None):
+    # every day +1 token to locked daily pool, with one DAILY_ADD ledger row per wallet;
+    # checkpointed per day, so a redelivered or resumed run never credits a chunk twice
+    run_key = run_key or f"DAILY_ADD:{timezone.localdate().isoformat()}"
+    return _wallet_run("DAILY_ADD", _daily_add_chunk, run_key, shards, daily_reward_add, daily_reward_add_shard)
+
+
+@shared_task(acks_late=True)
+def daily_reward_add_shard(run_key, lo=None, hi=None):
+    return _wallet_shard("DAILY_ADD", _daily_add_chunk, run_key, lo, hi, daily_reward_add)
+
 
 @shared_task
-def unlock_self_profit_and_principal():
+def unlock_self_profit_and_principal(shards=None):
+    # self profit unlocks after 30 days, principal after 365 (see core.unlocks)
     now = timezone.now()
+    ranges = shard_ranges(Purchase, shards or settings.PERIODIC_TASK_SHARDS, field="user_id")
+    if len(ranges) > 1:
+        return _fan_out("UNLOCK", unlock_shard, f"UNLOCK:{now.isoformat()}", ranges, now=now.isoformat())
+    report = run_unlocks(now)
+    if report["self_profit"] or report["principal"]:
+        invalidate_all_wallets()
+    return report
+
+
+@shared_task
+def unlock_shard(run_key, lo, hi, now):
+    # unlocks are idempotent per purchase (release flags), so shards need no checkpoint
+    report = run_unlocks(datetime.fromisoformat(now), users=(lo, hi))
+    if report["self_profit"] or report["principal"]:
+        invalidate_all_wallets()
+    return dict(report, run_key=run_key)
+
 
-    # unlock self profit after 30 days
-    for p in Purchase.objects.filter(self_profit_unlock_at__lte=now):
-        w = p.user.wallet
-        if p.self_profit_5 > 0:
-            # move only once: mark by setting value to 0 after move? safer add flag, but MVP:
-            # We'll use a meta ledger check to prevent duplicates.
-            if not Ledger.objects.filter(user=p.user, typ="SELF_PROFIT_UNLOCK", meta__invoice=p.invoice_no).exists():
-                w.self_profit_locked = F("self_profit_locked") - p.self_profit_5
-                w.self_profit_unlocked = F("self_profit_unlocked") + p.self_profit_5
-                w.save(update_fields=["self_profit_locked", "self_profit_unlocked"])
-                Ledger.objects.create(user=p.user, typ="SELF_PROFIT_UNLOCK", amount=p.self_profit_5, meta={"invoice": p.invoice_no})
-
-    # unlock principal after 365 days
-    for p in Purchase.objects.filter(principal_unlock_at__lte=now):
-        w = p.user.wallet
-        if p.ecg_value > 0:
-            if not Ledger.objects.filter(user=p.user, typ="PRINCIPAL_UNLOCK", meta__invoice=p.invoice_no).exists():
-                w.principal_locked = F("principal_locked") - p.ecg_value
-                w.principal_unlocked = F("principal_unlocked") + p.ecg_value
-                w.save(update_fields=["principal_locked", "principal_unlocked"])
-                Ledger.objects.create(user=p.user, typ="PRINCIPAL_UNLOCK", amount=p.ecg_value, meta={"invoice": p.invoice_no})
-
-@shared_task
-def end_of_month_unlock_daily():
-    # at month end: move locked daily -> unlocked
-    Wallet.objects.update(
+def _month_unlock_chunk(wallets, ledger):
+    locked = list(
+        wallets.select_for_update().filter(daily_reward_locked__gt=0)
+        .values_list("user_id", "daily_reward_locked")
+    )
+    wallets.filter(daily_reward_locked__gt=0).update(
         daily_reward_unlocked=F("daily_reward_unlocked") + F("daily_reward_locked"),
         daily_reward_locked=Decimal("0"),
-    )
\ No newline at end of file
+    )
+    for user_id, amount in locked:
+        ledger.add(user_id, "DAILY_RELEASE", amount)
+    return len(locked)
+
+
+@shared_task(acks_late=True)
+def end_of_month_unlock_daily(run_key=None, shards=None):
+    # at month end: move locked daily -> unlocked (one checkpointed run per month)
+    run_key = run_key or f"DAILY_RELEASE:{timezone.localdate():%Y-%m}"
+    return _wallet_run("DAILY_RELEASE", _month_unlock_chunk, run_key, shards, end_of_month_unlock_daily,
+                       end_of_month_unlock_daily_shard)
+
+
+@shared_task(acks_late=True)
+def end_of_month_unlock_daily_shard(run_key, lo=None, hi=None):
+    return _wallet_shard("DAILY_RELEASE", _month_unlock_chunk, run_key, lo, hi, end_of_month_unlock_daily)
+
+
+@shared_task
+def resume_wallet_tasks():
+    # re-queue checkpointed wallet runs that stopped making progress (worker crash, lost message); a stalled
+    # shard re-sends its whole run, which fans out again (finished shards are skipped) under a new chord
+    cutoff = timezone.now() - timezone.timedelta(seconds=settings.WALLET_TASK_RESUME_AFTER)
+    runs = {}
+    for task_name, run_key in (
+        TaskCheckpoint.objects.filter(status="RUNNING", updated_at__lt=cutoff).exclude(task="")
+        .values_list("task", "run_key")
+    ):
+        runs.setdefault(run_key.partition(SHARD_SEP)[0], task_name)
+    for run_key, task_name in runs.items():
+        current_app.send_task(task_name, kwargs={"run_key": run_key})
+    return len(runs)
+
+
+@shared_task
+def compact_ledger_checkpoints():
+    # fold new ledger rows into the per-user LedgerCheckpoint totals (see core.audit)
+    return audit.compact_checkpoints()
+
+
+@shared_task
+def extend_ledger_partitions():
+    # keep LEDGER_PARTITION_MONTHS_AHEAD monthly ledger partitions ready (no-op unless partitioned)
+    return [name for name, _ in partitions.ensure_partitions()]
+
+
+@shared_task
+def refresh_ton_rate():
+    # keep the cached TON/USD sample warm ahead of its TTL (see core.rates)
+    sample = rates.refresh()
+    if sample is None:
+        return None
+    return {"rate": str(sample.rate), "sample_id": sample.sample_id}
+
+
+@shared_task(bind=True, acks_late=True, max_retries=8)
+def process_purchase_intake(self, intake_id):
+    # async ingestion pipeline (see services.process_intake); every stage is idempotent
+    PurchaseIntake.objects.filter(pk=intake_id).update(attempts=F("attempts") + 1)
+    try:
+        intake = services.process_intake(intake_id)
+    except PurchaseIntake.DoesNotExist:
+        return None
+    except Exception as exc:
+        PurchaseIntake.objects.filter(pk=intake_id).update(error=str(exc)[:1000])
+        if self.request.retries >= self.max_retries:
+            PurchaseIntake.objects.filter(pk=intake_id, status="PENDING").update(status="FAILED")
+            raise
+        raise self.retry(exc=exc, countdown=min(2 ** self.request.retries, 300))
+    return intake.status
+
+
+@shared_task
+def resume_purchase_intakes():
+    # re-queue intakes whose worker message was lost (broker restart, crash after ack)
+    cutoff = timezone.now() - timezone.timedelta(seconds=settings.PURCHASE_INTAKE_RESUME_AFTER)
+    ids = list(
+        PurchaseIntake.objects.filter(status__in=["PENDING", "CREDITED"], updated_at__lt=cutoff)
+        .values_list("id", flat=True)[:1000]
+    )
+    for intake_id in ids:
+        process_purchase_intake.delay(intake_id)
+    return len(ids)
+
+
+@shared_task
+def flush_ledger_buffer():
+    # move buffered tick ledger rows into the Ledger table (see core.ledger_buffer)
+    return ledger_buffer.flush()
+
+
+@shared_task
+def verify_purchases():
+    # confirm PENDING purchases on chain in batches and credit them (see core.verification)
+    return verification.run_verification()
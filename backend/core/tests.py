@@ -1,3 +1,1419 @@
-from django.test import TestCase
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+import base64
+import importlib
+import io
+import json
+import os
+import runpy
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin as django_admin
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import (async_views, audit, benchmarks, bulk, cache as wallet_cache, datasets, imports, ledger_buffer,
+               metrics, pagination, partitions, payouts, rates, referrals, services, tasks, tracing, unlocks, verification)
+from .admin import WalletAdmin
+from .chain import FakeChainClient, TonCenterClient, normalize_address, normalize_tx_hash
+from .models import (AppUser, Ledger, LedgerBufferBatch, Purchase, PurchaseIntake, ReferralPath, TaskCheckpoint,
+                     Wallet, WithdrawRequest)
+
+
+# ledger rows that put an amount into a bucket, so funded wallets pass the audit
+FUNDING = {
+    "referral_bonus": ("REF_BONUS",),
+    "downline_profit_instant": ("DOWNLINE_PROFIT",),
+    "daily_reward_unlocked": ("DAILY_ADD", "DAILY_RELEASE"),
+    "self_profit_unlocked": ("BUY_SELF_PROFIT", "SELF_PROFIT_UNLOCK"),
+    "principal_unlocked": ("BUY_PRINCIPAL", "PRINCIPAL_UNLOCK"),
+}
+
+
+def make_user(address: str, **balances):
+    user = services.get_or_create_user(address)
+    for field, amount in balances.items():
+        services.credit_wallet(user.id, **{field: amount})
+        for typ in FUNDING[field]:
+            Ledger.objects.create(user=user, typ=typ, amount=amount)
+    return user
+
+
+def wallet(user) -> Wallet:
+    return Wallet.objects.get(user=user)
+
+
+class DebitTests(TestCase):
+    def setUp(self):
+        self.user = make_user("EQ-debit", downline_profit_instant=Decimal("10"), referral_bonus=Decimal("3"),
+                              daily_reward_unlocked=Decimal("2"), principal_unlocked=Decimal("5"))
+
+    def test_debit_wallet_refuses_overdraw(self):
+        self.assertFalse(services.debit_wallet(self.user.id, "downline_profit_instant", Decimal("10.000001")))
+        self.assertEqual(wallet(self.user).downline_profit_instant, Decimal("10"))
+
+    def test_debit_wallet_exact_balance(self):
+        self.assertTrue(services.debit_wallet(self.user.id, "downline_profit_instant", Decimal("10")))
+        self.assertEqual(wallet(self.user).downline_profit_instant, Decimal("0"))
+        self.assertFalse(services.debit_wallet(self.user.id, "downline_profit_instant", Decimal("0.000001")))
+
+    def test_waterfall_refuses_overdraw(self):
+        self.assertFalse(services.debit_waterfall(self.user.id, Decimal("20.000001")))
+        w = wallet(self.user)
+        self.assertEqual((w.downline_profit_instant, w.referral_bonus, w.daily_reward_unlocked, w.principal_unlocked),
+                         (Decimal("10"), Decimal("3"), Decimal("2"), Decimal("5")))
+
+    def test_waterfall_exact_balance_empties_every_bucket(self):
+        self.assertTrue(services.debit_waterfall(self.user.id, Decimal("20")))
+        w = wallet(self.user)
+        for field in services.WITHDRAW_WATERFALL:
+            self.assertEqual(getattr(w, field), Decimal("0"), field)
+        self.assertEqual(w.withdrawable_total, Decimal("0"))
+
+    def test_waterfall_drains_buckets_in_order(self):
+        # 10 downline + 3 referral + 1 of the 2 daily; principal untouched
+        self.assertTrue(services.debit_waterfall(self.user.id, Decimal("14")))
+        w = wallet(self.user)
+        self.assertEqual(w.downline_profit_instant, Decimal("0"))
+        self.assertEqual(w.referral_bonus, Decimal("0"))
+        self.assertEqual(w.daily_reward_unlocked, Decimal("1"))
+        self.assertEqual(w.principal_unlocked, Decimal("5"))
+
+
+class RejectWithdrawalTests(TestCase):
+    def setUp(self):
+        self.user = make_user("EQ-reject", downline_profit_instant=Decimal("4"), referral_bonus=Decimal("3"),
+                              principal_unlocked=Decimal("5"))
+
+    def test_all_withdrawable_refund_goes_back_to_its_buckets(self):
+        req = services.request_withdrawal(self.user, "ALL_WITHDRAWABLE", Decimal("9"), "EQ-dest")
+        self.assertEqual({f: Decimal(v) for f, v in req.debited.items()},
+                         {"downline_profit_instant": 4, "referral_bonus": 3, "principal_unlocked": 2})
+        self.assertEqual(payouts.reject_withdrawals(WithdrawRequest.objects.all()), 1)
+
+        w = wallet(self.user)
+        self.assertEqual(w.downline_profit_instant, Decimal("4"))
+        self.assertEqual(w.referral_bonus, Decimal("3"))
+        self.assertEqual(w.principal_unlocked, Decimal("5"))
+        refunds = Ledger.objects.filter(meta__withdraw_request=req.pk, typ__endswith="_REFUND")
+        self.assertEqual({row.typ: row.amount for row in refunds},
+                         {"WITHDRAW_REFUND": 4, "WITHDRAW_REF_BONUS_REFUND": 3, "WITHDRAW_PRINCIPAL_REFUND": 2})
+        self.assertEqual(audit.audit_wallet(self.user.id), [])
+
+    def test_downline_only_refund(self):
+        services.request_withdrawal(self.user, "DOWNLINE_ONLY", Decimal("4"), "EQ-dest")
+        self.assertEqual(payouts.reject_withdrawals(WithdrawRequest.objects.all()), 1)
+        self.assertEqual(wallet(self.user).downline_profit_instant, Decimal("4"))
+        self.assertEqual(audit.audit_wallet(self.user.id), [])
+
+    def test_withdraw_all_writes_one_row_per_bucket(self):
+        req = services.request_withdrawal(self.user, "ALL_WITHDRAWABLE", Decimal("9"), "EQ-dest")
+        rows = Ledger.objects.filter(meta__withdraw_request=req.pk)
+        self.assertEqual({row.typ: row.amount for row in rows},
+                         {"WITHDRAW": 4, "WITHDRAW_REF_BONUS": 3, "WITHDRAW_PRINCIPAL": 2})
+
+        # moving value between buckets keeps the total but is still drift
+        Wallet.objects.filter(user=self.user).update(referral_bonus=Decimal("1"), principal_unlocked=Decimal("2"))
+        self.assertEqual(audit.audit_wallet(self.user.id), [
+            ("referral_bonus", Decimal("1"), Decimal("0")),
+            ("principal_unlocked", Decimal("2"), Decimal("3")),
+        ])
+
+    def test_migration_splits_pooled_rows(self):
+        migration = importlib.import_module("core.migrations.0019_withdraw_ledger_per_bucket")
+        pooled = Ledger.objects.create(user=self.user, typ="WITHDRAW", amount=Decimal("7"),
+                                       meta={"withdraw_request": 1, "buckets": {"downline_profit_instant": "4",
+                                                                                "referral_bonus": "3"}})
+        refund = Ledger.objects.create(user=self.user, typ="WITHDRAW", amount=Decimal("2"), meta={})
+        # the old typs are gone from the choices, so the rows are switched back behind the model's back
+        Ledger.objects.filter(pk=pooled.pk).update(typ="WITHDRAW_ALL")
+        Ledger.objects.filter(pk=refund.pk).update(typ="WITHDRAW_ALL_REFUND")
+        TaskCheckpoint.objects.create(run_key="LEDGER_COMPACTION")
+
+        migration.split_pooled_rows(django_apps, None)
+
+        self.assertFalse(Ledger.objects.filter(pk__in=[pooled.pk, refund.pk]).exists())
+        split = Ledger.objects.filter(pk__gt=refund.pk)
+        self.assertEqual(sorted((row.typ, row.amount, row.meta) for row in split), [
+            ("WITHDRAW", Decimal("4"), {"withdraw_request": 1}),
+            ("WITHDRAW_REFUND", Decimal("2"), {}),
+            ("WITHDRAW_REF_BONUS", Decimal("3"), {"withdraw_request": 1}),
+        ])
+        self.assertFalse(TaskCheckpoint.objects.filter(run_key="LEDGER_COMPACTION").exists())
+
+    def test_only_pending_requests_are_rejected(self):
+        first = services.request_withdrawal(self.user, "DOWNLINE_ONLY", Decimal("1"), "EQ-dest")
+        services.request_withdrawal(self.user, "ALL_WITHDRAWABLE", Decimal("2"), "EQ-dest")
+        payouts.approve_withdrawals(WithdrawRequest.objects.filter(pk=first.pk))
+
+        self.assertEqual(payouts.reject_withdrawals(WithdrawRequest.objects.all()), 1)
+        self.assertEqual(payouts.reject_withdrawals(WithdrawRequest.objects.all()), 0)
+        self.assertEqual(wallet(self.user).withdrawable_total, Decimal("11"))
+
+
+class MetricsTests(SimpleTestCase):
+    def scrape(self, remote_addr="10.0.0.5", **headers):
+        request = RequestFactory().get("/metrics", REMOTE_ADDR=remote_addr, headers=headers)
+        return metrics.metrics_view(request).status_code
+
+    @override_settings(METRICS_TOKEN="", METRICS_ALLOWED_IPS="127.0.0.1,::1", METRICS_PUBLIC=False)
+    def test_scrape_refused_by_default(self):
+        self.assertEqual(self.scrape(), 403)
+        self.assertEqual(self.scrape("127.0.0.1"), 200)
+
+    @override_settings(METRICS_TOKEN="s3cret", METRICS_ALLOWED_IPS="172.16.0.0/12", METRICS_PUBLIC=False)
+    def test_scrape_with_token_or_allowed_network(self):
+        self.assertEqual(self.scrape(Authorization="Bearer s3cret"), 200)
+        self.assertEqual(self.scrape(Authorization="Bearer nope"), 403)
+        self.assertEqual(self.scrape("172.18.0.3"), 200)
+
+    def test_async_path_flushes_off_the_event_loop(self):
+        async def view(request):
+            return HttpResponse("ok")
+
+        loop_thread, flushed_in = [], []
+        middleware = metrics.MetricsMiddleware(view)
+
+        async def call():
+            loop_thread.append(threading.get_ident())
+            return await middleware(RequestFactory().get("/api/x"))
+
+        with mock.patch.object(metrics, "flush_due", return_value=True), \
+                mock.patch.object(metrics, "flush", side_effect=lambda: flushed_in.append(threading.get_ident())):
+            async_to_sync(call)()
+        self.assertEqual(len(flushed_in), 1)
+        self.assertNotEqual(flushed_in[0], loop_thread[0])
+
+
+class PurchaseImportTests(TestCase):
+    def setUp(self):
+        self.rates = imports.RateTable([(datetime(2020, 1, 1, tzinfo=dt_timezone.utc), Decimal("5"))])
+        self.rejects = []
+
+    def run_import(self, suffix: str, text: str) -> imports.ImportReport:
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        importer = imports.PurchaseImporter(self.rates, on_reject=lambda *r: self.rejects.append(r))
+        return importer.run(imports.read_records(path))
+
+    def test_huge_epoch_is_a_record_error(self):
+        for value in (10 ** 20, "1e300", float("inf")):
+            with self.assertRaises(imports.RecordError):
+                imports.parse_timestamp(value)
+
+    def test_jsonl_non_objects_are_rejected_rows(self):
+        report = self.run_import(".jsonl", "5\n\"x\"\n[1]\n"
+                                 '{"wallet_address": "EQ-imp", "ton_amount": "2", "ton_tx_hash": "tx-1", '
+                                 '"timestamp": 1700000000}\n'
+                                 '{"wallet_address": "EQ-imp", "ton_amount": "2", "ton_tx_hash": "tx-2", '
+                                 '"timestamp": 1e300}\n')
+        self.assertEqual((report.read, report.imported, report.rejected), (5, 1, 4))
+        self.assertEqual([reason for _, _, reason in self.rejects[:3]], ["not an object"] * 3)
+        self.assertTrue(Purchase.objects.filter(ton_tx_hash="tx-1").exists())
+
+    def test_csv_short_row_reports_missing_column(self):
+        report = self.run_import(".csv", "wallet_address,ton_amount,ton_tx_hash,timestamp\n"
+                                         "EQ-imp,2,tx-3\n")
+        self.assertEqual((report.imported, report.rejected), (0, 1))
+        self.assertEqual(self.rejects[0][2], "missing timestamp")
+
+
+RECEIVER = "0:" + "ab" * 32
+BUYER = "0:" + "cd" * 32
+
+
+def user_friendly(raw: str) -> str:
+    workchain, _, account = raw.partition(":")
+    data = bytes([0x11, int(workchain) & 0xFF]) + bytes.fromhex(account) + b"\0\0"
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def static_rate(test):
+    rates.set_source(rates.StaticRateSource("5"))
+    test.addCleanup(rates.set_source, None)
+    cache.clear()
+
+
+@override_settings(PURCHASE_VERIFICATION=True, TON_RECEIVER_ADDRESS=RECEIVER)
+class PurchaseVerificationTests(TestCase):
+    def setUp(self):
+        static_rate(self)
+        self.inviter = make_user("EQ-inviter")
+        self.buyer = services.get_or_create_user(BUYER)
+        AppUser.objects.filter(pk=self.buyer.pk).update(inviter=self.inviter)
+        self.buyer.refresh_from_db()
+        self.chain = FakeChainClient(accept_unknown=False)
+
+    def buy(self, tx_hash: str, **chain_tx) -> Purchase:
+        purchase = services.register_purchase(self.buyer, Decimal("10"), tx_hash)
+        self.assertEqual(purchase.verification_status, "PENDING")
+        self.chain.add(tx_hash, **{"ton_amount": "10", "source": BUYER, **chain_tx})
+        verification.verify_batch(self.chain)
+        purchase.refresh_from_db()
+        return purchase
+
+    def assert_rejected(self, purchase: Purchase, reason: str):
+        self.assertEqual(purchase.verification_status, "REJECTED")
+        self.assertIn(reason, purchase.verification_error)
+        self.assertEqual(wallet(self.buyer).principal_locked, Decimal("0"))
+        self.assertEqual(wallet(self.inviter).downline_profit_instant, Decimal("0"))
+
+    def assert_credited_once(self, first, second):
+        self.assertEqual(first.verification_status, "VERIFIED")
+        self.assertEqual(second.verification_status, "REJECTED")
+        self.assertIn(f"already credited to invoice {first.invoice_no}", second.verification_error)
+        self.assertIsNone(second.chain_tx_hash)
+        self.assertEqual(wallet(self.buyer).principal_locked, first.ecg_value)
+        self.assertEqual(audit.audit_wallet(self.buyer.id), [])
+
+    def test_verified_purchase_is_credited(self):
+        purchase = self.buy("tx-ok", source=user_friendly(BUYER))
+        self.assertEqual(purchase.verification_status, "VERIFIED")
+        self.assertEqual(wallet(self.buyer).principal_locked, purchase.ecg_value)
+        self.assertEqual(wallet(self.inviter).downline_profit_instant, purchase.ecg_value * services.UPLINE_RATE)
+        self.assertEqual(audit.audit_wallet(self.buyer.id), [])
+        self.assertEqual(audit.audit_wallet(self.inviter.id), [])
+
+    def test_wrong_sender_is_rejected(self):
+        self.assert_rejected(self.buy("tx-sender", source="0:" + "ee" * 32), "sender")
+
+    def test_wrong_destination_is_rejected(self):
+        self.assert_rejected(self.buy("tx-dest", destination="0:" + "ee" * 32), "destination")
+
+    def test_short_amount_is_rejected(self):
+        self.assert_rejected(self.buy("tx-short", ton_amount="9.5"), "chain amount")
+
+    @override_settings(TON_RECEIVER_ADDRESS="")
+    def test_no_receiver_address_verifies_nothing(self):
+        services.register_purchase(self.buyer, Decimal("10"), "tx-noreceiver")
+        with self.assertRaises(ImproperlyConfigured):
+            verification.verify_batch(self.chain)
+        self.assertEqual(Purchase.objects.get(ton_tx_hash="tx-noreceiver").verification_status, "PENDING")
+
+    def test_address_forms_normalize_alike(self):
+        self.assertEqual(normalize_address(user_friendly(BUYER)), BUYER)
+        self.assertEqual(normalize_address(BUYER.upper()), BUYER)
+
+    def test_one_transfer_in_two_encodings_is_credited_once(self):
+        raw = bytes(range(32))
+        first = self.buy(raw.hex().upper())
+        self.assertEqual((first.ton_tx_hash, first.chain_tx_hash), (raw.hex(), raw.hex()))
+        with self.assertRaisesMessage(ValueError, "TX already registered"):
+            services.register_purchase(self.buyer, Decimal("10"), base64.urlsafe_b64encode(raw).decode())
+
+        # a row stored before hashes were normalized only meets the first one on chain
+        second = services.register_purchase(self.buyer, Decimal("10"), "tx-legacy")
+        Purchase.objects.filter(pk=second.pk).update(ton_tx_hash=base64.b64encode(raw).decode())
+        verification.verify_batch(self.chain)
+        second.refresh_from_db()
+        self.assert_credited_once(first, second)
+
+    def test_same_batch_credits_a_transfer_once(self):
+        raw = bytes(range(1, 33))
+        self.chain.add(raw.hex(), ton_amount="10", source=BUYER)
+        first = services.register_purchase(self.buyer, Decimal("10"), raw.hex())
+        second = services.register_purchase(self.buyer, Decimal("10"), "tx-legacy")
+        Purchase.objects.filter(pk=second.pk).update(ton_tx_hash=base64.urlsafe_b64encode(raw).decode())
+        verification.verify_batch(self.chain)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assert_credited_once(first, second)
+
+    def test_toncenter_reports_the_hash_it_returned(self):
+        raw = bytes(range(32))
+        client = TonCenterClient(url="http://toncenter.test/api/v3", api_key="")
+        body = {"transactions": [{"hash": base64.b64encode(raw).decode(), "now": 1700000000,
+                                  "in_msg": {"value": "2500000000", "source": BUYER, "destination": RECEIVER}}]}
+        with mock.patch("requests.Session.get") as get:
+            get.return_value.json.return_value = body
+            tx = client.get_transaction(base64.urlsafe_b64encode(raw).decode())
+        self.assertEqual((tx.tx_hash, tx.ton_amount, tx.success), (raw.hex(), Decimal("2.5"), True))
+
+    def test_intake_matches_any_encoding(self):
+        raw = bytes(range(32))
+        intake = services.submit_purchase(self.buyer, Decimal("10"), raw.hex())
+        again = services.submit_purchase(self.buyer, Decimal("10"), base64.b64encode(raw).decode())
+        self.assertEqual(again.pk, intake.pk)
+        self.assertEqual(normalize_tx_hash(base64.urlsafe_b64encode(raw).decode().rstrip("=")), intake.ton_tx_hash)
+        self.assertEqual(normalize_tx_hash("tx-plain"), "tx-plain")
+
+
+class ReferralVolumeTests(TestCase):
+    def test_only_verified_purchases_count(self):
+        static_rate(self)
+        inviter = make_user("EQ-volume")
+        buyer = make_user("EQ-volume-buyer")
+        services.link_referral_paths(inviter.id, buyer.id)
+        verified = services.register_purchase(buyer, Decimal("10"), "tx-volume-1")
+        with override_settings(PURCHASE_VERIFICATION=True, TON_RECEIVER_ADDRESS=RECEIVER):
+            services.register_purchase(buyer, Decimal("20"), "tx-volume-2")
+            rejected = services.register_purchase(buyer, Decimal("30"), "tx-volume-3")
+        Purchase.objects.filter(pk=rejected.pk).update(verification_status="REJECTED")
+
+        data = APIClient().get("/api/referrals/volume/", {"wallet_address": "EQ-volume"}).json()
+        self.assertEqual(data["levels"][0]["purchases"], 1)
+        self.assertEqual(Decimal(str(data["ecg_value"])), verified.ecg_value)
+
+
+class FakeRedis:
+    """The few list/key commands core.ledger_buffer uses, in memory."""
+
+    def __init__(self):
+        self.data = {}
+
+    def rpush(self, key, value):
+        self.data.setdefault(key, []).append(value.encode())
+        return len(self.data[key])
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def lrange(self, key, start, end):
+        return self.data.get(key, [])[start:end + 1]
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def get(self, key):
+        value = self.data.get(key)
+        return value.encode() if isinstance(value, str) else value
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = str(value)
+        return True
+
+    def rename(self, src, dst):
+        self.data[dst] = self.data.pop(src)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+
+class DailyClaimTests(TestCase):
+    def setUp(self):
+        make_user("EQ-claim")
+        self.redis = FakeRedis()
+
+    def claim(self, redis=None):
+        with mock.patch.object(ledger_buffer, "_redis_client", return_value=redis), \
+                self.captureOnCommitCallbacks(execute=True):
+            return services.claim_daily("EQ-claim")
+
+    def test_claim_queues_the_ledger_row_after_commit(self):
+        with mock.patch.object(ledger_buffer, "_redis_client", return_value=self.redis):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertTrue(services.claim_daily("EQ-claim").rewarded)
+            self.assertEqual(self.redis.llen(ledger_buffer.BUFFER_KEY), 0)
+            for callback in callbacks:
+                callback()
+        self.assertEqual(self.redis.llen(ledger_buffer.BUFFER_KEY), 1)
+
+        again = self.claim(self.redis)
+        self.assertFalse(again.rewarded)
+        self.assertEqual(self.redis.llen(ledger_buffer.BUFFER_KEY), 1)
+
+        with mock.patch.object(ledger_buffer, "_redis_client", return_value=self.redis):
+            self.assertEqual(ledger_buffer.flush(), 1)
+        user = AppUser.objects.get(wallet_address="EQ-claim")
+        self.assertEqual(audit.audit_wallet(user.id), [])
+
+    def test_failed_push_writes_the_row_directly(self):
+        broken = mock.Mock()
+        broken.rpush.side_effect = ConnectionError("redis down")
+        self.claim(broken)
+        user = AppUser.objects.get(wallet_address="EQ-claim")
+        self.assertEqual(Ledger.objects.filter(user=user, typ="DAILY_UNLOCK").count(), 1)
+        self.assertEqual(audit.audit_wallet(user.id), [])
+
+    def test_recovered_batch_is_not_written_twice(self):
+        self.claim(self.redis)
+        with mock.patch.object(ledger_buffer, "_redis_client", return_value=self.redis):
+            ledger_buffer.flush()
+            batch = LedgerBufferBatch.objects.get()
+            # a flusher that committed the batch but died before clearing the in-flight key
+            self.redis.data[ledger_buffer.INFLIGHT_KEY] = [b"{}"]
+            self.redis.data[ledger_buffer.INFLIGHT_ID_KEY] = batch.batch_id
+            self.assertEqual(ledger_buffer.flush(), 0)
+        self.assertFalse(self.redis.exists(ledger_buffer.INFLIGHT_KEY))
+        self.assertEqual(Ledger.objects.filter(typ="DAILY_UNLOCK").count(), 1)
+
+
+@override_settings(WALLET_TASK_DUTY_CYCLE=1)
+class WalletChunkTests(TestCase):
+    def setUp(self):
+        self.users = [make_user(f"EQ-chunk-{i}") for i in range(5)]
+
+    def test_crashed_run_resumes_after_the_last_committed_chunk(self):
+        calls = []
+
+        def crash_on_second_chunk(wallets, ledger):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+            return tasks._daily_add_chunk(wallets, ledger)
+
+        with self.assertRaises(RuntimeError):
+            bulk.run_wallet_chunks("DAILY_ADD", crash_on_second_chunk, chunk_size=2, key="DAILY_ADD:test")
+        checkpoint = TaskCheckpoint.objects.get(run_key="DAILY_ADD:test")
+        self.assertEqual((checkpoint.status, checkpoint.wallets, checkpoint.chunks), ("RUNNING", 2, 1))
+
+        report = bulk.run_wallet_chunks("DAILY_ADD", tasks._daily_add_chunk, chunk_size=2, key="DAILY_ADD:test")
+        self.assertEqual(report["wallets"], 3)
+        checkpoint.refresh_from_db()
+        self.assertEqual((checkpoint.status, checkpoint.wallets), ("DONE", 5))
+        self.assertEqual(list(Wallet.objects.values_list("daily_reward_locked", flat=True).distinct()),
+                         [Decimal("1")])
+        self.assertEqual(Ledger.objects.filter(typ="DAILY_ADD").count(), 5)
+
+        again = bulk.run_wallet_chunks("DAILY_ADD", tasks._daily_add_chunk, chunk_size=2, key="DAILY_ADD:test")
+        self.assertTrue(again["skipped"])
+        self.assertEqual(Ledger.objects.filter(typ="DAILY_ADD").count(), 5)
+
+    def test_run_stops_when_another_runner_claimed_the_range(self):
+        def advance_elsewhere(wallets, ledger):
+            # a concurrent runner of the same key commits the next chunk first
+            TaskCheckpoint.objects.filter(run_key="DAILY_ADD:race").update(next_pk=10 ** 9)
+            return tasks._daily_add_chunk(wallets, ledger)
+
+        report = bulk.run_wallet_chunks("DAILY_ADD", advance_elsewhere, chunk_size=2, key="DAILY_ADD:race")
+        self.assertEqual(report["wallets"], 2)
+        self.assertEqual(TaskCheckpoint.objects.get(run_key="DAILY_ADD:race").status, "RUNNING")
+
+    @override_settings(WALLET_TASK_DUTY_CYCLE=0.25)
+    def test_throttle_keeps_the_duty_cycle(self):
+        with mock.patch.object(bulk.time, "sleep") as sleep:
+            bulk.throttle(0.2)
+        sleep.assert_called_once()
+        self.assertAlmostEqual(sleep.call_args.args[0], 0.6)
+
+    def test_full_duty_cycle_does_not_pause(self):
+        with mock.patch.object(bulk.time, "sleep") as sleep:
+            bulk.run_wallet_chunks("DAILY_ADD", tasks._daily_add_chunk, chunk_size=2)
+        sleep.assert_not_called()
+
+
+@override_settings(WALLET_TASK_DUTY_CYCLE=1, WALLET_TASK_CHUNK_SIZE=2)
+class ShardedWalletRunTests(TestCase):
+    def setUp(self):
+        self.users = [make_user(f"EQ-shard-{i}") for i in range(6)]
+        self.pks = sorted(Wallet.objects.values_list("pk", flat=True))
+
+    def fan_out(self, **kwargs):
+        # the chord is replaced by its header; returns the shard signatures it would have sent
+        with mock.patch.object(tasks, "chord") as chord:
+            tasks.daily_reward_add(run_key="DAILY_ADD:t", **kwargs)
+        return chord.call_args.args[0]
+
+    def test_shard_ranges_cover_the_ids_once(self):
+        lo, hi = self.pks[0], self.pks[-1] + 1
+        ranges = bulk.shard_ranges(Wallet, 4)
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual((ranges[0][0], ranges[-1][1]), (lo, hi))
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(ranges, ranges[1:])))
+        self.assertEqual(len(bulk.shard_ranges(Wallet, 100)), hi - lo)
+        self.assertEqual(bulk.shard_ranges(Wallet, 1), [(lo, hi)])
+        self.assertEqual(bulk.shard_ranges(Purchase, 4, field="user_id"), [])
+
+    def test_shards_are_keyed_by_range_and_keep_their_plan(self):
+        header = self.fan_out(shards=2)
+        keys = [sig.args[0] for sig in header]
+        self.assertEqual(keys, [tasks._shard_key("DAILY_ADD:t", lo, hi) for lo, hi in bulk.shard_ranges(Wallet, 2)])
+        first = header[0]
+        tasks.daily_reward_add_shard(*first.args, **first.kwargs)
+
+        # a re-run with another shard count fans out over the persisted ranges
+        header = self.fan_out(shards=3)
+        self.assertEqual([sig.args[0] for sig in header], keys)
+        reports = [tasks.daily_reward_add_shard(*sig.args, **sig.kwargs) for sig in header]
+        self.assertTrue(reports[0]["skipped"])
+        self.assertEqual(Ledger.objects.filter(typ="DAILY_ADD").count(), 6)
+        self.assertEqual(set(Wallet.objects.values_list("daily_reward_locked", flat=True)), {Decimal("1")})
+        self.assertEqual(set(TaskCheckpoint.objects.values_list("task", "status")),
+                         {(tasks.daily_reward_add.name, "DONE")})
+
+        summary = tasks.summarize_shards(reports, "DAILY_ADD", "DAILY_ADD:t", 0)
+        self.assertEqual((summary["shards"], summary["wallets"]), (2, 3))
+
+    def test_unsharded_run_stays_unsharded(self):
+        tasks.daily_reward_add(run_key="DAILY_ADD:t", shards=1)
+        with mock.patch.object(tasks, "chord") as chord:
+            report = tasks.daily_reward_add(run_key="DAILY_ADD:t", shards=3)
+        chord.assert_not_called()
+        self.assertTrue(report["skipped"])
+
+    def test_resume_re_sends_the_whole_run(self):
+        header = self.fan_out(shards=3)
+        TaskCheckpoint.objects.filter(run_key=header[0].args[0]).update(next_pk=self.pks[1], chunks=1)
+        TaskCheckpoint.objects.filter(run_key=header[2].args[0]).update(status="DONE")
+        TaskCheckpoint.objects.update(updated_at=datetime.now(dt_timezone.utc) - timedelta(days=1))
+        TaskCheckpoint.objects.create(run_key="DAILY_RELEASE:2026-09", task=tasks.end_of_month_unlock_daily.name)
+
+        with mock.patch.object(tasks.current_app, "send_task") as send_task:
+            self.assertEqual(tasks.resume_wallet_tasks(), 1)
+        send_task.assert_called_once_with(tasks.daily_reward_add.name, kwargs={"run_key": "DAILY_ADD:t"})
+
+
+@override_settings(LEDGER_COMPACTION_SAFETY_SECONDS=0)
+class LedgerCompactionTests(TestCase):
+    def setUp(self):
+        self.alice = make_user("EQ-compact-a", downline_profit_instant=Decimal("10"), principal_unlocked=Decimal("4"))
+        self.bob = make_user("EQ-compact-b", referral_bonus=Decimal("3"))
+
+    def compact_all(self, **kwargs):
+        # the first pass only fixes its horizon, the second folds everything below it
+        audit.compact_checkpoints(**kwargs)
+        return audit.compact_checkpoints(**kwargs)
+
+    def test_checkpoint_holds_the_ledger_totals(self):
+        before = audit.expected_balances(self.alice.id)
+        self.assertEqual(self.compact_all(chunk_size=2)["rows"], Ledger.objects.count())
+        checkpoint = audit.LedgerCheckpoint.objects.get(user=self.alice)
+        self.assertGreater(checkpoint.next_ledger_id, Ledger.objects.filter(user=self.alice).order_by("-id").first().id)
+        self.assertEqual((checkpoint.downline_profit_instant, checkpoint.principal_unlocked),
+                         (Decimal("10"), Decimal("4")))
+        after = audit.expected_balances(self.alice.id)
+        self.assertEqual({k: v for k, v in after.items() if v}, {k: v for k, v in before.items() if v})
+        self.assertEqual(audit.audit_wallet(self.alice.id), [])
+
+    def test_passes_never_fold_a_row_twice(self):
+        self.compact_all()
+        self.assertEqual(audit.compact_checkpoints()["rows"], 0)
+        self.assertEqual(audit.LedgerCheckpoint.objects.get(user=self.bob).referral_bonus, Decimal("3"))
+
+    def test_rows_after_the_horizon_wait_for_the_next_pass(self):
+        audit.compact_checkpoints()
+        services.credit_wallet(self.bob.id, referral_bonus=Decimal("2"))
+        Ledger.objects.create(user=self.bob, typ="REF_BONUS", amount=Decimal("2"))
+        audit.compact_checkpoints()
+
+        self.assertEqual(audit.LedgerCheckpoint.objects.get(user=self.bob).referral_bonus, Decimal("3"))
+        self.assertEqual(audit.expected_balances(self.bob.id)["referral_bonus"], Decimal("5"))
+        self.assertEqual(audit.audit_wallet(self.bob.id), [])
+        audit.compact_checkpoints()
+        self.assertEqual(audit.LedgerCheckpoint.objects.get(user=self.bob).referral_bonus, Decimal("5"))
+
+    def test_pass_limited_to_max_chunks_resumes(self):
+        audit.compact_checkpoints()
+        first = audit.compact_checkpoints(chunk_size=1, max_chunks=2)
+        self.assertEqual(first["chunks"], 2)
+        second = audit.compact_checkpoints(chunk_size=1)
+        self.assertEqual(first["rows"] + second["rows"], Ledger.objects.count())
+        self.assertEqual(audit.LedgerCheckpoint.objects.get(user=self.alice).principal_unlocked, Decimal("4"))
+
+    @override_settings(LEDGER_COMPACTION_SAFETY_SECONDS=60)
+    def test_row_committed_late_below_the_newest_id_is_folded(self):
+        now = datetime.now(dt_timezone.utc)
+        Ledger.objects.update(created_at=now - timedelta(hours=1))
+        gap = Ledger.objects.order_by("-id").first().id + 1
+        # a later transaction commits first; the one that took the lower id is still open
+        Ledger.objects.create(id=gap + 1, user=self.bob, typ="REF_BONUS", amount=Decimal("1"),
+                              created_at=now - timedelta(seconds=5))
+        self.compact_all(now=now)
+        self.assertEqual(audit.LedgerCheckpoint.objects.get(user=self.bob).next_ledger_id, gap)
+
+        Ledger.objects.create(id=gap, user=self.bob, typ="REF_BONUS", amount=Decimal("2"),
+                              created_at=now - timedelta(seconds=10))
+        services.credit_wallet(self.bob.id, referral_bonus=Decimal("3"))
+        self.compact_all(now=now + timedelta(minutes=2))
+        checkpoint = audit.LedgerCheckpoint.objects.get(user=self.bob)
+        self.assertEqual((checkpoint.referral_bonus, checkpoint.next_ledger_id), (Decimal("6"), gap + 2))
+        self.assertEqual(audit.audit_wallet(self.bob.id), [])
+
+    def test_withdraw_all_and_its_refund_cancel_out(self):
+        req = services.request_withdrawal(self.alice, "ALL_WITHDRAWABLE", Decimal("12"), "EQ-dest")
+        payouts.reject_withdrawals(WithdrawRequest.objects.filter(pk=req.pk))
+        self.compact_all()
+        checkpoint = audit.LedgerCheckpoint.objects.get(user=self.alice)
+        self.assertEqual((checkpoint.downline_profit_instant, checkpoint.principal_unlocked),
+                         (Decimal("10"), Decimal("4")))
+        self.assertEqual(audit.audit_wallet(self.alice.id), [])
+
+
+@override_settings(LEDGER_COMPACTION_SAFETY_SECONDS=0)
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.users = [make_user(f"EQ-reconcile-{i}", downline_profit_instant=Decimal(i + 1),
+                                daily_reward_unlocked=Decimal("2")) for i in range(4)]
+
+    def tamper(self, user, **values):
+        Wallet.objects.filter(user=user).update(**values)
+
+    def test_consistent_wallets_yield_nothing(self):
+        self.assertEqual(list(audit.reconcile()), [])
+        self.assertEqual(list(audit.reconcile(incremental=True)), [])
+
+    def test_full_reports_only_the_tampered_wallet(self):
+        self.tamper(self.users[2], downline_profit_instant=Decimal("99"))
+        self.assertEqual(list(audit.reconcile(chunk_size=2)), [
+            (self.users[2].id, self.users[2].wallet_address,
+             [("downline_profit_instant", Decimal("99"), Decimal("3"))]),
+        ])
+
+    def test_ledger_rows_without_a_wallet_are_reported(self):
+        orphan = make_user("EQ-reconcile-orphan", referral_bonus=Decimal("1"))
+        # one orphan before the first wallet (skipped by the join), one after the last (left over)
+        Wallet.objects.filter(user__in=[orphan, self.users[0]]).delete()
+        reported = {(user_id, address) for user_id, address, _ in audit.reconcile()}
+        self.assertEqual(reported, {(orphan.id, None), (self.users[0].id, None)})
+
+    def test_incremental_uses_checkpoints_plus_the_delta(self):
+        audit.compact_checkpoints()
+        audit.compact_checkpoints()
+        services.credit_wallet(self.users[1].id, downline_profit_instant=Decimal("5"))
+        Ledger.objects.create(user=self.users[1], typ="DOWNLINE_PROFIT", amount=Decimal("5"))
+        self.assertEqual(list(audit.reconcile(incremental=True)), [])
+
+        self.tamper(self.users[3], daily_reward_unlocked=Decimal("0"))
+        # a checkpoint that disagrees with the ledger is what incremental trusts
+        audit.LedgerCheckpoint.objects.filter(user=self.users[0]).update(downline_profit_instant=Decimal("7"))
+        incremental = {user_id: fields for user_id, _, fields in audit.reconcile(incremental=True, chunk_size=1)}
+        self.assertEqual(incremental, {
+            self.users[0].id: [("downline_profit_instant", Decimal("1"), Decimal("7"))],
+            self.users[3].id: [("daily_reward_unlocked", Decimal("0"), Decimal("2"))],
+        })
+        self.assertEqual([user_id for user_id, _, _ in audit.reconcile()], [self.users[3].id])
+
+    def test_checkpoints_without_a_wallet_are_reported_once(self):
+        audit.compact_checkpoints()
+        audit.compact_checkpoints()
+        Wallet.objects.filter(user__in=[self.users[0], self.users[3]]).delete()
+        Ledger.objects.create(user=self.users[3], typ="REF_BONUS", amount=Decimal("1"))
+        reported = [(user_id, address) for user_id, address, _ in audit.reconcile(incremental=True, chunk_size=1)]
+        self.assertEqual(reported, [(self.users[0].id, None), (self.users[3].id, None)])
+
+    def test_opening_backfill_explains_pre_ledger_wallets(self):
+        legacy = services.get_or_create_user("EQ-reconcile-legacy")
+        self.tamper(legacy, principal_locked=Decimal("50"), referral_bonus=Decimal("3"), rewards_count=4)
+        services.credit_wallet(self.users[1].id, downline_profit_instant=Decimal("5"))
+        self.assertEqual({user_id for user_id, _, _ in audit.reconcile()}, {legacy.id, self.users[1].id})
+
+        out = io.StringIO()
+        call_command("backfill_opening_balances", "--chunk-size", "1", stdout=out)
+        self.assertIn("4 opening rows written for 2 users", out.getvalue())
+        self.assertEqual(list(audit.reconcile()), [])
+        self.assertEqual({(row.typ, row.amount) for row in Ledger.objects.filter(user=legacy)}, {
+            ("OPENING_PRINCIPAL_LOCKED", Decimal("50")), ("OPENING_REFERRAL_BONUS", Decimal("3")),
+            ("OPENING_REWARDS_COUNT", Decimal("4")),
+        })
+        self.assertEqual(Ledger.objects.get(user=self.users[1], typ="OPENING_DOWNLINE_PROFIT_INSTANT").amount,
+                         Decimal("5"))
+
+        # drift after the opening is not absorbed by a second run
+        self.tamper(legacy, principal_locked=Decimal("40"))
+        self.assertEqual(audit.backfill_opening_balances()["rows"], 0)
+        self.assertEqual([user_id for user_id, _, _ in audit.reconcile()], [legacy.id])
+
+        audit.compact_checkpoints()
+        audit.compact_checkpoints()
+        self.assertEqual(audit.expected_balances(legacy.id)["rewards_count"], 4)
+
+    def test_command_writes_mismatches_and_fails(self):
+        self.tamper(self.users[1], referral_bonus=Decimal("1"))
+        with tempfile.NamedTemporaryFile("r", suffix=".jsonl") as out:
+            with self.assertRaisesMessage(CommandError, "1 users disagree with the ledger (referral_bonus=1)"):
+                call_command("reconcile_wallets", "--format", "jsonl", "--output", out.name)
+            line = json.loads(out.read())
+        self.assertEqual(line, {"user": self.users[1].id, "wallet": self.users[1].wallet_address,
+                                "mismatches": {"referral_bonus": ["1.000000", "0"]}})
+
+
+class CountingRateSource(rates.RateSource):
+    name = "counting"
+
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+
+    def fetch(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return Decimal("5")
+
+
+class RateCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.source = CountingRateSource(delay=0.1)
+        rates.set_source(self.source)
+        self.addCleanup(rates.set_source, None)
+
+    def test_cold_cache_fetches_once(self):
+        samples = []
+        threads = [threading.Thread(target=lambda: samples.append(rates.get_ton_usd_rate())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.source.calls, 1)
+        self.assertEqual({s.sample_id for s in samples}, {samples[0].sample_id})
+
+    def test_waiters_serve_the_last_known_rate(self):
+        last = rates.refresh()
+        cache.delete(rates.CACHE_KEY)
+        cache.add(rates.REFRESH_LOCK_KEY, 1)  # another process is stuck fetching
+        with mock.patch.object(rates, "_lock_ttl", return_value=0.2):
+            self.assertEqual(rates.get_ton_usd_rate().sample_id, last.sample_id)
+        self.assertEqual(self.source.calls, 1)
+
+    def test_refresh_task_skips_while_a_fetch_is_running(self):
+        cache.add(rates.REFRESH_LOCK_KEY, 1)
+        self.assertIsNone(tasks.refresh_ton_rate())
+        cache.delete(rates.REFRESH_LOCK_KEY)
+        self.assertEqual(tasks.refresh_ton_rate()["rate"], "5")
+        self.assertIsNone(cache.get(rates.REFRESH_LOCK_KEY))
+
+    def test_static_source_keeps_an_explicit_zero(self):
+        self.assertEqual(rates.StaticRateSource(0).fetch(), Decimal("0"))
+
+
+@override_settings(PURCHASE_INGEST_MODE="async")
+class PurchaseIntakeTests(TestCase):
+    def setUp(self):
+        static_rate(self)
+        self.inviter = make_user("EQ-intake-inviter")
+        self.buyer = services.get_or_create_user("EQ-intake-buyer")
+        AppUser.objects.filter(pk=self.buyer.pk).update(inviter=self.inviter)
+        self.buyer.refresh_from_db()
+        delay = mock.patch.object(tasks.process_purchase_intake, "delay")
+        self.delay = delay.start()
+        self.addCleanup(delay.stop)
+
+    def post(self, tx_hash="tx-intake", amount="10"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return APIClient().post("/api/purchase/create/", {
+                "wallet_address": self.buyer.wallet_address, "ton_amount": amount, "ton_tx_hash": tx_hash,
+            }, format="json")
+
+    def test_repeated_tx_hash_returns_the_same_intake(self):
+        first, second = self.post(), self.post()
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.data["id"], second.data["id"])
+        self.assertIn("tx=tx-intake", first.data["status_url"])
+        self.delay.assert_called_once_with(first.data["id"])
+
+        self.assertEqual(self.post(amount="11").status_code, 400)
+        self.assertEqual(PurchaseIntake.objects.count(), 1)
+
+    def test_redelivered_intake_credits_once(self):
+        intake_id = self.post().data["id"]
+        for _ in range(3):
+            intake = services.process_intake(intake_id)
+        self.assertEqual(intake.status, "DONE")
+        self.assertEqual(Purchase.objects.filter(ton_tx_hash="tx-intake").count(), 1)
+        self.assertEqual(Ledger.objects.filter(user=self.buyer, typ="BUY_PRINCIPAL").count(), 1)
+        self.assertEqual(Ledger.objects.filter(user=self.inviter, typ="DOWNLINE_PROFIT").count(), 1)
+        self.assertEqual(wallet(self.buyer).principal_locked, Decimal("15600"))
+
+        status = APIClient().get("/api/purchase/status/", {"tx": "tx-intake"})
+        self.assertEqual((status.data["status"], status.data["purchase"]["invoice_no"]),
+                         ("DONE", intake.purchase.invoice_no))
+
+    def test_crash_after_credit_resumes_at_the_upline_stage(self):
+        intake_id = self.post().data["id"]
+        with mock.patch.object(services, "pay_upline", side_effect=RuntimeError("worker died")):
+            with self.assertRaises(RuntimeError):
+                services.process_intake(intake_id)
+        self.assertEqual(PurchaseIntake.objects.get(pk=intake_id).status, "CREDITED")
+
+        services.process_intake(intake_id)
+        self.assertEqual(Purchase.objects.count(), 1)
+        self.assertEqual(wallet(self.inviter).downline_profit_instant, Decimal("780"))
+        self.assertEqual(audit.audit_wallet(self.buyer.id), [])
+
+    def test_tx_registered_synchronously_fails_the_intake(self):
+        services.register_purchase(self.buyer, Decimal("10"), "tx-sync")
+        with self.assertRaises(ValueError):
+            services.submit_purchase(self.buyer, Decimal("10"), "tx-sync")
+        intake = PurchaseIntake.objects.create(user=self.buyer, ton_tx_hash="tx-sync", ton_amount=Decimal("10"))
+        self.assertEqual(services.process_intake(intake.id).status, "FAILED")
+        self.assertEqual(Purchase.objects.count(), 1)
+
+
+class UnlockEngineTests(TestCase):
+    def setUp(self):
+        static_rate(self)
+        self.user = services.get_or_create_user("EQ-unlock")
+        self.purchases = [services.register_purchase(self.user, Decimal("1"), f"tx-unlock-{i}") for i in range(3)]
+        self.now = datetime.now(dt_timezone.utc)
+        Purchase.objects.update(self_profit_unlock_at=self.now - timedelta(days=1))
+        Purchase.objects.filter(pk=self.purchases[0].pk).update(principal_unlock_at=self.now - timedelta(days=1))
+
+    def test_releases_what_is_due_once(self):
+        report = unlocks.run_unlocks(self.now, chunk_size=2)
+        self.assertEqual((report["self_profit"], report["principal"]), (3, 1))
+        w = wallet(self.user)
+        self.assertEqual((w.self_profit_locked, w.self_profit_unlocked), (Decimal("0"), Decimal("234")))
+        self.assertEqual((w.principal_locked, w.principal_unlocked), (Decimal("3120"), Decimal("1560")))
+        self.assertEqual(audit.audit_wallet(self.user.id), [])
+
+        again = unlocks.run_unlocks(self.now)
+        self.assertEqual((again["self_profit"], again["principal"]), (0, 0))
+        self.assertEqual(Ledger.objects.filter(typ="SELF_PROFIT_UNLOCK").count(), 3)
+
+    def test_pending_purchases_stay_locked(self):
+        Purchase.objects.filter(pk=self.purchases[1].pk).update(verification_status="PENDING")
+        self.assertEqual(unlocks.run_unlocks(self.now)["self_profit"], 2)
+
+    def test_chunk_that_lost_rows_to_another_run_is_retried(self):
+        Purchase.objects.filter(pk=self.purchases[0].pk).update(self_profit_released=True)
+        due = unlocks.due_purchases
+        calls = []
+
+        def stale_then_real(kind, now, users=None):
+            # the first select still sees the row another run has just released (skip_locked race)
+            calls.append(kind.name)
+            if len(calls) == 1:
+                return Purchase.objects.all()
+            return due(kind, now, users)
+
+        with mock.patch.object(unlocks, "due_purchases", side_effect=stale_then_real):
+            self.assertEqual(unlocks.unlock_chunk(unlocks.UNLOCK_KINDS[0], self.now, 10), -1)
+            self.assertEqual(unlocks.run_unlocks(self.now)["self_profit"], 2)
+        self.assertEqual(Ledger.objects.filter(typ="SELF_PROFIT_UNLOCK").count(), 2)
+        self.assertEqual(wallet(self.user).self_profit_unlocked, Decimal("156"))
+
+    def test_backfill_marks_purchases_unlocked_by_the_old_task(self):
+        migration = importlib.import_module("core.migrations.0005_purchase_release_flags")
+        Ledger.objects.create(user=self.user, typ="PRINCIPAL_UNLOCK", amount=Decimal("1560"),
+                              meta={"invoice": self.purchases[2].invoice_no})
+        migration.mark_already_released(django_apps, None)
+        self.assertEqual(list(Purchase.objects.filter(principal_released=True).values_list("pk", flat=True)),
+                         [self.purchases[2].pk])
+        self.assertEqual(unlocks.run_unlocks(self.now)["principal"], 1)
+
+
+@override_settings(WALLET_TASK_DUTY_CYCLE=1)
+class DailyLedgerTests(TestCase):
+    def setUp(self):
+        self.users = [make_user(f"EQ-daily-{i}") for i in range(3)]
+
+    def test_writer_flushes_in_batches_and_on_exit(self):
+        at = datetime(2026, 1, 2, tzinfo=dt_timezone.utc)
+        with bulk.LedgerWriter(batch_size=2) as ledger:
+            for user in self.users:
+                ledger.add(user.id, "REF_BONUS", Decimal("1.5"), invoice="INV", meta={"n": user.id}, created_at=at)
+            self.assertEqual(Ledger.objects.count(), 2)
+        self.assertEqual(ledger.written, 3)
+        row = Ledger.objects.get(user=self.users[2])
+        self.assertEqual((row.amount, row.invoice, row.meta, row.created_at),
+                         (Decimal("1.5"), "INV", {"n": self.users[2].id}, at))
+
+    def test_writer_drops_rows_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with bulk.LedgerWriter() as ledger:
+                ledger.add(self.users[0].id, "REF_BONUS", Decimal("1"))
+                raise RuntimeError
+        self.assertFalse(Ledger.objects.exists())
+
+    def test_daily_add_and_month_release_write_a_row_per_wallet(self):
+        tasks.daily_reward_add(run_key="DAILY_ADD:a", shards=1)
+        tasks.daily_reward_add(run_key="DAILY_ADD:b", shards=1)
+        Wallet.objects.filter(user=self.users[0]).update(daily_reward_locked=0)
+        Ledger.objects.filter(user=self.users[0]).delete()
+
+        report = tasks.end_of_month_unlock_daily(run_key="DAILY_RELEASE:m", shards=1)
+        self.assertEqual((report["wallets"], report["ledgers"]), (2, 2))
+        self.assertEqual(Ledger.objects.filter(typ="DAILY_ADD").count(), 4)
+        self.assertEqual(set(Ledger.objects.filter(typ="DAILY_RELEASE").values_list("amount", flat=True)),
+                         {Decimal("2")})
+        self.assertEqual(wallet(self.users[1]).daily_reward_unlocked, Decimal("2"))
+        for user in self.users:
+            self.assertEqual(audit.audit_wallet(user.id), [])
+
+    def test_grouped_update_applies_each_users_deltas(self):
+        deltas = bulk.WalletDeltas()
+        deltas.add(self.users[0].id, "referral_bonus", Decimal("2"))
+        deltas.move(self.users[1].id, "principal_locked", "principal_unlocked", Decimal("3"))
+        self.assertEqual(deltas.apply(), 2)
+        self.assertEqual(wallet(self.users[0]).referral_bonus, Decimal("2"))
+        w = wallet(self.users[1])
+        self.assertEqual((w.principal_locked, w.principal_unlocked), (Decimal("-3"), Decimal("3")))
+        self.assertEqual(wallet(self.users[2]).referral_bonus, Decimal("0"))
+
+
+class WalletCounterTests(TestCase):
+    def setUp(self):
+        self.inviter = make_user("EQ-counter-inviter")
+        self.invitees = [services.get_or_create_user(f"EQ-counter-{i}") for i in range(2)]
+
+    def test_withdrawable_total_follows_every_bucket_update(self):
+        services.credit_wallet(self.inviter.id, referral_bonus=Decimal("2"), self_profit_locked=Decimal("3"),
+                               principal_locked=Decimal("100"))
+        self.assertEqual(wallet(self.inviter).withdrawable_total, Decimal("5"))
+        services.debit_wallet(self.inviter.id, "referral_bonus", Decimal("2"))
+        self.assertEqual(wallet(self.inviter).withdrawable_total, Decimal("3"))
+
+    def test_referral_bumps_invitee_count_once(self):
+        for invitee in self.invitees:
+            services.apply_referral(self.inviter.referral_code, invitee)
+        services.apply_referral(self.inviter.referral_code, self.invitees[0])
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.invitee_count, 2)
+        response = APIClient().get("/api/referrals/count/", {"wallet_address": self.inviter.wallet_address})
+        self.assertEqual(response.data, {"count": 2})
+
+    def test_rebuild_restores_drifted_counters(self):
+        for invitee in self.invitees:
+            services.apply_referral(self.inviter.referral_code, invitee)
+        Ledger.objects.create(user=self.invitees[0], typ="DAILY_UNLOCK", amount=Decimal("1"))
+        AppUser.objects.filter(pk=self.inviter.pk).update(invitee_count=7)
+        Wallet.objects.filter(user=self.inviter).update(rewards_count=4)
+
+        call_command("rebuild_wallet_counters", "--chunk-size", "1", stdout=io.StringIO())
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.invitee_count, 2)
+        self.assertEqual(wallet(self.inviter).rewards_count, 0)
+        self.assertEqual(wallet(self.invitees[0]).rewards_count, 1)
+
+
+class WalletCacheTests(TestCase):
+    def setUp(self):
+        static_rate(self)
+        self.user = services.get_or_create_user("EQ-cache")
+        self.client = APIClient()
+
+    def principal(self, address="EQ-cache"):
+        return Decimal(self.client.get(f"/api/wallet/{address}/").data["principal_locked"])
+
+    def test_purchase_invalidates_after_commit(self):
+        self.assertEqual(self.principal(), Decimal("0"))
+        Wallet.objects.filter(user=self.user).update(principal_locked=Decimal("1"))
+        self.assertEqual(self.principal(), Decimal("0"))  # served from the cache
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            services.register_purchase(self.user, Decimal("1"), "tx-cache")
+        self.assertEqual(self.principal(), Decimal("0"))  # not before the commit
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.principal(), Decimal("1561"))
+
+    def test_unknown_address_is_cached_until_it_connects(self):
+        self.assertEqual(self.principal("EQ-cache-new"), Decimal("0"))
+        self.assertFalse(AppUser.objects.filter(wallet_address="EQ-cache-new").exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            user = services.get_or_create_user("EQ-cache-new")
+        services.credit_wallet(user.id, principal_locked=Decimal("2"))
+        self.assertEqual(self.principal("EQ-cache-new"), Decimal("2"))
+
+    def test_bulk_invalidation_orphans_every_entry(self):
+        self.assertEqual(self.principal(), Decimal("0"))
+        Wallet.objects.update(principal_locked=Decimal("3"))
+        with self.captureOnCommitCallbacks(execute=True):
+            wallet_cache.invalidate_all_wallets()
+        self.assertEqual(self.principal(), Decimal("3"))
+
+    def test_none_is_not_cached(self):
+        build = mock.Mock(side_effect=[None, {"ok": 1}])
+        self.assertIsNone(wallet_cache.get_or_build("wallet", "EQ-cache-none", build))
+        self.assertEqual(wallet_cache.get_or_build("wallet", "EQ-cache-none", build), {"ok": 1})
+        self.assertEqual(wallet_cache.get_or_build("wallet", "EQ-cache-none", build), {"ok": 1})
+        self.assertEqual(build.call_count, 2)
+
+
+class WalletAdminTests(TestCase):
+    def setUp(self):
+        self.user = make_user("EQ-admin", referral_bonus=Decimal("3"), downline_profit_instant=Decimal("4"))
+        self.request = RequestFactory().post("/admin/core/wallet/")
+        self.request.user = mock.Mock(is_superuser=True)
+        self.admin = WalletAdmin(Wallet, django_admin.site)
+
+    def edit(self, **changes):
+        w = wallet(self.user)
+        data = {f.name: getattr(w, f.attname) for f in Wallet._meta.concrete_fields
+                if f.editable and not f.primary_key}
+        data.update(changes)
+        return self.admin.get_form(self.request, w)(data, instance=w)
+
+    def test_edit_keeps_concurrent_updates(self):
+        form = self.edit(referral_bonus=Decimal("5"))
+        self.assertTrue(form.is_valid(), form.errors)
+        # credits that land between opening and saving the form
+        services.credit_wallet(self.user.id, referral_bonus=Decimal("1"), downline_profit_instant=Decimal("2"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.save_model(self.request, form.save(commit=False), form, change=True)
+        w = wallet(self.user)
+        self.assertEqual((w.referral_bonus, w.downline_profit_instant), (Decimal("6"), Decimal("6")))
+
+    def test_unchanged_form_writes_nothing(self):
+        form = self.edit()
+        self.assertTrue(form.is_valid(), form.errors)
+        services.credit_wallet(self.user.id, referral_bonus=Decimal("1"))
+        self.admin.save_model(self.request, form.save(commit=False), form, change=True)
+        self.assertEqual(wallet(self.user).referral_bonus, Decimal("4"))
+
+
+class ReadOnlyLookupTests(TestCase):
+    GETS = (
+        ("/api/wallet/EQ-readonly/", {}),
+        ("/api/wallet/reward_status/", {"wallet_address": "EQ-readonly"}),
+        ("/api/referrals/count/", {"wallet_address": "EQ-readonly"}),
+        ("/api/referrals/levels/", {"wallet_address": "EQ-readonly"}),
+        ("/api/referrals/volume/", {"wallet_address": "EQ-readonly"}),
+        ("/api/referrals/upline/", {"wallet_address": "EQ-readonly"}),
+        ("/api/purchase/list/", {"wallet": "EQ-readonly"}),
+        ("/api/ledger/list/", {"wallet": "EQ-readonly"}),
+    )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_endpoints_do_not_create_users(self):
+        client = APIClient()
+        for url, params in self.GETS:
+            self.assertEqual(client.get(url, params).status_code, 200, url)
+        self.assertFalse(AppUser.objects.filter(wallet_address="EQ-readonly").exists())
+        self.assertFalse(Wallet.objects.exists())
+
+    def test_lookup_drops_a_stale_cached_id(self):
+        first = services.get_or_create_user("EQ-readonly")
+        self.assertEqual(services.find_user("EQ-readonly").id, first.id)
+        first.delete()
+        self.assertIsNone(services.find_user("EQ-readonly"))
+        second = services.get_or_create_user("EQ-readonly")
+        self.assertEqual(services.find_user("EQ-readonly").id, second.id)
+        self.assertEqual(async_to_sync(services.afind_user)("EQ-readonly").id, second.id)
+
+
+class ReferralClosureTests(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d = (services.get_or_create_user(f"EQ-ref-{n}") for n in "abcd")
+
+    def refer(self, inviter, user):
+        user.refresh_from_db()
+        services.apply_referral(inviter.referral_code, user)
+
+    def paths(self):
+        return set(ReferralPath.objects.values_list("ancestor_id", "descendant_id", "depth"))
+
+    def test_linking_a_subtree_connects_every_upline(self):
+        self.refer(self.c, self.d)
+        self.refer(self.a, self.b)
+        self.refer(self.b, self.c)
+        a, b, c, d = (u.id for u in (self.a, self.b, self.c, self.d))
+        self.assertEqual(self.paths(), {(a, b, 1), (b, c, 1), (c, d, 1), (a, c, 2), (b, d, 2), (a, d, 3)})
+
+        client = APIClient()
+        levels = client.get("/api/referrals/levels/", {"wallet_address": self.a.wallet_address}).data
+        self.assertEqual(levels, {"levels": [{"depth": 1, "count": 1}, {"depth": 2, "count": 1},
+                                             {"depth": 3, "count": 1}], "total": 3})
+        upline = client.get("/api/referrals/upline/", {"wallet_address": self.d.wallet_address}).data["upline"]
+        self.assertEqual([u["wallet_address"] for u in upline], ["EQ-ref-c", "EQ-ref-b", "EQ-ref-a"])
+
+    def test_cycles_and_self_referrals_are_rejected(self):
+        self.refer(self.a, self.b)
+        self.refer(self.b, self.c)
+        before = self.paths()
+        self.refer(self.c, self.a)
+        self.refer(self.a, self.a)
+        self.a.refresh_from_db()
+        self.assertIsNone(self.a.inviter_id)
+        self.assertEqual(self.paths(), before)
+        self.assertFalse(Ledger.objects.filter(user=self.c, typ="REF_BONUS").exists())
+        self.assertEqual(Ledger.objects.filter(typ="REF_BONUS").count(), 2)
+
+    def test_backfill_rebuilds_the_same_table(self):
+        self.refer(self.a, self.b)
+        self.refer(self.b, self.c)
+        self.refer(self.a, self.d)
+        expected = self.paths()
+        ReferralPath.objects.all().delete()
+        levels = referrals.backfill_paths(AppUser, ReferralPath)
+        self.assertEqual(levels, {1: 3, 2: 1})
+        self.assertEqual(self.paths(), expected)
+
+
+class RecordingCursor:
+    """Cursor stand-in that records SQL and answers ``to_regclass`` lookups from ``existing``."""
+
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.sql = []
+        self.rowcount = 0
+        self._row = None
+
+    def execute(self, sql, params=None):
+        self.sql.append(sql)
+        self._row = (params[0] if params[0] in self.existing else None,) if "to_regclass" in sql else None
+        self.rowcount = 2 if sql.startswith("WITH moved") else 0
+
+    def fetchone(self):
+        return self._row
+
+
+class LedgerPartitionTests(TestCase):
+    def test_month_arithmetic(self):
+        self.assertEqual(partitions.next_month(datetime(2026, 12, 5, tzinfo=dt_timezone.utc)),
+                         datetime(2027, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.months_ahead(datetime(2026, 10, 18, tzinfo=dt_timezone.utc), 3),
+                         datetime(2027, 2, 1, tzinfo=dt_timezone.utc))
+
+    def test_missing_months_move_their_rows_out_of_default(self):
+        cursor = RecordingCursor(existing={"core_ledger_p2026_10", "core_ledger_default"})
+        start, stop = datetime(2026, 10, 18, tzinfo=dt_timezone.utc), datetime(2026, 12, 1, tzinfo=dt_timezone.utc)
+        created = partitions.create_month_partitions(cursor, "core_ledger", start, stop)
+        self.assertEqual(created, [("core_ledger_p2026_11", 2)])
+        statements = [sql.split(" (")[0] for sql in cursor.sql if "to_regclass" not in sql]
+        self.assertEqual(statements, [
+            "CREATE TABLE core_ledger_p2026_11",
+            "LOCK TABLE core_ledger_default IN ACCESS EXCLUSIVE MODE",
+            "WITH moved AS",
+            "ALTER TABLE core_ledger ATTACH PARTITION core_ledger_p2026_11 FOR VALUES FROM",
+        ])
+
+    def test_off_postgresql_nothing_is_partitioned(self):
+        self.assertEqual(partitions.ensure_partitions(), [])
+        self.assertEqual(tasks.extend_ledger_partitions(), [])
+        with self.assertRaises(CommandError):
+            call_command("ledger_partitions", "--convert")
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        static_rate(self)
+        self.user = services.get_or_create_user("EQ-history")
+        self.purchases = [services.register_purchase(self.user, Decimal("1"), f"tx-history-{i}") for i in range(3)]
+        limit = mock.patch.object(pagination, "DEFAULT_LIMIT", 2)
+        limit.start()
+        self.addCleanup(limit.stop)
+        self.client = APIClient()
+
+    def invoices(self, response):
+        return [row["invoice_no"] for row in response.data]
+
+    def test_purchase_list_without_limit_or_cursor_is_complete(self):
+        response = self.client.get("/api/purchase/list/", {"wallet": "EQ-history"})
+        self.assertEqual(self.invoices(response), [p.invoice_no for p in reversed(self.purchases)])
+        self.assertNotIn("X-Next-Cursor", response)
+
+    def test_purchase_list_follows_the_cursor_when_asked(self):
+        first = self.client.get("/api/purchase/list/", {"wallet": "EQ-history", "limit": 2, "fields": "invoice_no"})
+        self.assertEqual(self.invoices(first), [p.invoice_no for p in reversed(self.purchases[1:])])
+        self.assertEqual(set(first.data[0]), {"invoice_no"})
+        rest = self.client.get("/api/purchase/list/", {"wallet": "EQ-history", "cursor": first["X-Next-Cursor"]})
+        self.assertEqual(self.invoices(rest), [self.purchases[0].invoice_no])
+        self.assertNotIn("X-Next-Cursor", rest)
+
+    def test_ledger_list_is_paginated_by_default(self):
+        response = self.client.get("/api/ledger/list/", {"wallet": "EQ-history", "typ": "BUY_PRINCIPAL"})
+        self.assertEqual(len(response.data), 2)
+        self.assertIn("X-Next-Cursor", response)
+        self.assertEqual(self.client.get("/api/ledger/list/", {"wallet": "EQ-history", "cursor": "x"}).status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+    def test_summary_statistics(self):
+        summary = benchmarks.summarize([40, 10, 30, 20], queries=[2, 4], errors=1, wall_s=2.0)
+        self.assertEqual(summary, {"requests": 4, "errors": 1, "rps": 2.0, "p50_ms": 25.0, "p95_ms": 38.5,
+                                   "p99_ms": 39.7, "queries_per_request": 3.0})
+        self.assertIsNone(benchmarks.summarize([], [], 0, 0)["p50_ms"])
+
+    def test_compare_walks_shared_numeric_results(self):
+        old = {"endpoints": {"tick": {"c1": {"requests": 10, "p50_ms": 4.0, "queries_per_request": 0}}}}
+        new = {"endpoints": {"tick": {"c1": {"requests": 20, "p50_ms": 5.0, "queries_per_request": 3}}},
+               "micro": {"register_purchase": {"p50_ms": 1.0}}}
+        self.assertEqual(list(benchmarks.compare(old, new)), [
+            ("endpoints/tick/c1", "p50_ms", 4.0, 5.0, 25.0),
+            ("endpoints/tick/c1", "queries_per_request", 0, 3, None),
+        ])
+
+    def test_query_count_header(self):
+        def app(environ, start_response):
+            AppUser.objects.count()
+            Wallet.objects.count()
+            start_response("200 OK", [])
+            return [b"ok"]
+
+        headers = []
+        benchmarks.QueryCountingApp(app)({}, lambda status, h, exc_info=None: headers.extend(h))
+        self.assertEqual(dict(headers)[benchmarks.QUERIES_HEADER], "2")
+
+    def test_rate_stub_feeds_the_coingecko_source(self):
+        stub = benchmarks.start_rate_stub("6.5")
+        self.addCleanup(stub.shutdown)
+        source = rates.CoinGeckoSource(url=benchmarks.server_url(stub) + "/simple/price", timeout=5)
+        self.assertEqual(source.fetch(), Decimal("6.5"))
+
+    def test_command_rejects_unknown_endpoints(self):
+        with self.assertRaisesMessage(CommandError, "unknown endpoints: nope"):
+            call_command("benchmark", "--endpoints", "tick,nope")
+
+
+class DatasetGeneratorTests(TestCase):
+    NOW = datetime(2026, 3, 10, 12, tzinfo=dt_timezone.utc)
+    SPEC = datasets.DatasetSpec(users=40, depth=2, fanout=3, claims=5, daily_days=20, withdraw_ratio=0.5,
+                                history_days=200, seed=7)
+
+    def generate(self, spec=SPEC):
+        return datasets.DatasetGenerator(spec, chunk_size=16, now=self.NOW).run()
+
+    def snapshot(self):
+        return (sorted(Ledger.objects.values_list("user_id", "typ", "amount", "created_at")),
+                sorted(Purchase.objects.values_list("user_id", "ton_amount", "created_at")))
+
+    def test_forest_layout(self):
+        forest = datasets.ReferralForest(users=15, depth=2, fanout=3)
+        self.assertEqual(forest.tree_size, 13)
+        self.assertEqual(forest.ancestors(12), [(3, 1), (0, 2)])
+        self.assertIsNone(forest.parent(13))
+        self.assertEqual(forest.child_count(0), 3)
+        self.assertEqual(forest.child_count(13), 1)
+
+    def test_generated_data_passes_reconciliation(self):
+        report = self.generate()
+        self.assertEqual(report["users"], 40)
+        self.assertEqual(AppUser.objects.count(), 40)
+        self.assertEqual(Ledger.objects.count(), report["ledgers"])
+        self.assertEqual(ReferralPath.objects.count(), report["paths"])
+        self.assertTrue(WithdrawRequest.objects.exists())
+        self.assertEqual(list(audit.reconcile()), [])
+
+    def test_same_seed_gives_the_same_rows(self):
+        self.generate()
+        first = self.snapshot()
+        for model in (Ledger, WithdrawRequest, Purchase, ReferralPath, Wallet, AppUser):
+            model.objects.all().delete()
+        self.generate()
+        self.assertEqual(self.snapshot(), first)
+
+        for model in (Ledger, WithdrawRequest, Purchase, ReferralPath, Wallet, AppUser):
+            model.objects.all().delete()
+        self.generate(datasets.DatasetSpec(**dict(vars(self.SPEC), seed=8)))
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_command_validates_its_shape(self):
+        with self.assertRaisesMessage(CommandError, "--users and --fanout must be positive"):
+            call_command("generate_dataset", "--users", "0")
+
+
+class ProductionSettingsTests(SimpleTestCase):
+    PREFIXES = ("DJANGO_", "POSTGRES_", "DB_", "SERVER_MODE", "PURCHASE_VERIFICATION", "GUNICORN_")
+
+    def load(self, path, **env):
+        clean = {k: v for k, v in os.environ.items() if not k.startswith(self.PREFIXES)}
+        with mock.patch.dict(os.environ, dict(clean, **env), clear=True), mock.patch("dotenv.load_dotenv"):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, path))
+
+    def test_dev_defaults_are_refused_without_debug(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "DJANGO_SECRET_KEY must be set"):
+            self.load("config/settings.py", DJANGO_DEBUG="0")
+        with self.assertRaisesMessage(ImproperlyConfigured, "DJANGO_ALLOWED_HOSTS must list"):
+            self.load("config/settings.py", DJANGO_DEBUG="0", DJANGO_SECRET_KEY="k")
+        loaded = self.load("config/settings.py", DJANGO_DEBUG="0", DJANGO_SECRET_KEY="k",
+                           DJANGO_ALLOWED_HOSTS="app.example")
+        self.assertEqual((loaded["DEBUG"], loaded["ALLOWED_HOSTS"]), (False, ["app.example"]))
+
+    def test_postgres_pool_or_persistent_connections(self):
+        pooled = self.load("config/settings.py", POSTGRES_DB="app", DB_POOL_MAX_SIZE="10")["DATABASES"]["default"]
+        self.assertEqual(pooled["CONN_MAX_AGE"], 0)
+        self.assertEqual(pooled["OPTIONS"]["pool"], {"min_size": 2, "max_size": 10, "timeout": 10})
+        persistent = self.load("config/settings.py", POSTGRES_DB="app")["DATABASES"]["default"]
+        self.assertEqual(persistent["CONN_MAX_AGE"], 60)
+        self.assertNotIn("pool", persistent["OPTIONS"])
+
+    def test_gunicorn_server_modes(self):
+        wsgi = self.load("gunicorn.conf.py", WEB_CONCURRENCY="3")
+        self.assertEqual((wsgi["wsgi_app"], wsgi["worker_class"], wsgi["workers"]),
+                         ("config.wsgi:application", "gthread", 3))
+        asgi = self.load("gunicorn.conf.py", SERVER_MODE="asgi")
+        self.assertEqual((asgi["wsgi_app"], asgi["worker_class"]),
+                         ("config.asgi:application", "uvicorn_worker.UvicornWorker"))
+
+
+class AsyncPollingViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user("EQ-async", referral_bonus=Decimal("3"), principal_unlocked=Decimal("2"))
+        self.client = APIClient()
+
+    def call(self, view, path, *args, **params):
+        response = async_to_sync(view)(RequestFactory().get(path, params), *args)
+        return response.status_code, json.loads(response.content)
+
+    def test_same_payload_as_the_sync_views(self):
+        sync_wallet = self.client.get("/api/wallet/EQ-async/")
+        cache.clear()
+        self.assertEqual(self.call(async_views.wallet_view, "/api/wallet/EQ-async/", "EQ-async"),
+                         (200, json.loads(sync_wallet.content)))
+
+        sync_status = self.client.get("/api/wallet/reward_status/", {"wallet_address": "EQ-async"})
+        cache.clear()
+        self.assertEqual(self.call(async_views.reward_status, "/api/wallet/reward_status/", wallet_address="EQ-async"),
+                         (200, json.loads(sync_status.content)))
+
+    def test_unknown_wallet_and_missing_address(self):
+        sync_unknown = self.client.get("/api/wallet/EQ-async-none/")
+        self.assertEqual(self.call(async_views.wallet_view, "/api/wallet/EQ-async-none/", "EQ-async-none"),
+                         (200, json.loads(sync_unknown.content)))
+        self.assertFalse(AppUser.objects.filter(wallet_address="EQ-async-none").exists())
+        self.assertEqual(self.call(async_views.reward_status, "/api/wallet/reward_status/"),
+                         (400, {"error": "wallet_address required"}))
+
+    def test_cached_until_invalidated(self):
+        self.call(async_views.wallet_view, "/api/wallet/EQ-async/", "EQ-async")
+        services.credit_wallet(self.user.id, referral_bonus=Decimal("1"))
+        _, cached = self.call(async_views.wallet_view, "/api/wallet/EQ-async/", "EQ-async")
+        self.assertEqual(Decimal(cached["referral_bonus"]), Decimal("3"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            wallet_cache.invalidate_wallet("EQ-async")
+        _, fresh = self.call(async_views.wallet_view, "/api/wallet/EQ-async/", "EQ-async")
+        self.assertEqual(Decimal(fresh["referral_bonus"]), Decimal("4"))
+
+
+class TracingTests(TestCase):
+    def setUp(self):
+        static_rate(self)
+        self.inviter = services.get_or_create_user("EQ-trace-inviter")
+        self.buyer = services.get_or_create_user("EQ-trace-buyer")
+
+    def test_sampled_purchase_logs_one_nested_trace(self):
+        services.apply_referral(self.inviter.referral_code, self.buyer)
+        self.buyer.refresh_from_db()
+        with self.assertLogs("core.tracing", "INFO") as logs, tracing.sampling(True):
+            services.register_purchase(self.buyer, Decimal("1"), "tx-trace")
+        self.assertEqual(len(logs.output), 1)
+        line = logs.output[0]
+        self.assertIn("[TRACE]", line)
+        self.assertIn(" register_purchase ", line)
+        for child in ("> duplicate_check", "> purchase_insert", "> pay_upline"):
+            self.assertIn(child, line)
+
+    @override_settings(TRACE_SAMPLE_RATE=0)
+    def test_unsampled_traces_are_not_recorded(self):
+        with self.assertNoLogs("core.tracing", "INFO"):
+            services.apply_referral(self.inviter.referral_code, self.buyer)
+            with tracing.span("outer") as sp:
+                self.assertIs(sp, tracing.NOOP)
+                self.assertFalse(tracing.sampled())
+                with tracing.span("inner") as inner:
+                    self.assertIs(inner, tracing.NOOP)
+
+    def test_errors_are_recorded_on_the_span(self):
+        with self.assertLogs("core.tracing", "INFO") as logs, tracing.sampling(True):
+            with self.assertRaises(ValueError):
+                with tracing.span("outer"), tracing.span("inner"):
+                    raise ValueError("boom")
+        self.assertIn("inner", logs.output[0])
+        self.assertIn("{error=ValueError}", logs.output[0])
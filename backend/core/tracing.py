@@ -0,0 +1,154 @@
+"""
+Sampled span tracing for the service layer.
+
+``span(name, **attrs)`` opens a span in the current context. The outermost
+span of a call tree is the trace root; it decides once, with probability
+``TRACE_SAMPLE_RATE``, whether the whole tree is recorded. In an unsampled
+trace every nested ``span`` is a shared no-op, so instrumented code pays for
+a context-variable set/reset and nothing else.
+
+A sampled trace is written as a single ``[TRACE]`` log line when its root
+closes: every span with its duration and attributes, nested in call order.
+Code that wants expensive diagnostics (extra queries, big payloads) checks
+``sampled()`` first and attaches the result to the span with ``set``::
+
+    with tracing.span("register_purchase", tx=tx) as sp:
+        ...
+        if tracing.sampled():
+            sp.set(balance=wallet_balance_from_db())
+
+``sampling(True)`` forces (or suppresses) sampling for a block, e.g. in a
+shell session or a management command.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import logging
+import random
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "trace_id", "children", "started", "duration")
+
+    sampled = True
+
+    def __init__(self, name: str, trace_id: str, attrs: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self.children = []
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    sampled = False
+    trace_id = None
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+NOOP = _NoopSpan()
+
+_current = ContextVar("trace_span", default=None)
+_forced = ContextVar("trace_forced", default=None)
+
+
+def _sample_root() -> bool:
+    forced = _forced.get()
+    if forced is not None:
+        return forced
+    rate = settings.TRACE_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def current():
+    """The innermost open span (``NOOP`` outside a sampled trace)."""
+    return _current.get() or NOOP
+
+
+def sampled() -> bool:
+    """Whether the current trace is being recorded."""
+    return current().sampled
+
+
+@contextmanager
+def span(name: str, **attrs):
+    parent = _current.get()
+    if parent is None:
+        sampled_root = _sample_root()
+        if not sampled_root:
+            token = _current.set(NOOP)
+            try:
+                yield NOOP
+            finally:
+                _current.reset(token)
+            return
+        sp = Span(name, uuid.uuid4().hex[:16], attrs)
+    elif not parent.sampled:
+        yield NOOP
+        return
+    else:
+        sp = Span(name, parent.trace_id, attrs)
+        parent.children.append(sp)
+
+    token = _current.set(sp)
+    try:
+        yield sp
+    except Exception as exc:
+        sp.set(error=type(exc).__name__)
+        raise
+    finally:
+        sp.finish()
+        _current.reset(token)
+        if parent is None:
+            logger.info("[TRACE] %s %s", sp.trace_id, format_span(sp))
+
+
+def traced(name: str = None):
+    """Decorator form of ``span`` (the function name by default)."""
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def sampling(enabled: bool = True):
+    """Force the sampling decision for traces started inside this block."""
+    token = _forced.set(enabled)
+    try:
+        yield
+    finally:
+        _forced.reset(token)
+
+
+def format_span(sp: Span, depth: int = 0) -> str:
+    attrs = " ".join(f"{k}={v}" for k, v in sp.attrs.items())
+    text = f"{'>' * depth}{' ' if depth else ''}{sp.name} {sp.duration * 1000:.1f}ms"
+    if attrs:
+        text += f" {{{attrs}}}"
+    return " | ".join([text] + [format_span(child, depth + 1) for child in sp.children])
@@ -1,19 +1,28 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# endpoint های polling: نسخه‌ی async زیر ASGI، نسخه‌ی sync زیر WSGI
+polling = async_views if settings.ASYNC_POLLING_VIEWS else views
 
 urlpatterns = [
     path("connect/", views.connect_wallet),
 
     # ✅ اول مسیرهای ثابت
-    path("wallet/reward_status/", views.reward_status),
+    path("wallet/reward_status/", polling.reward_status),
     path("wallet/tick/", views.tick),
 
     path("referrals/count/", views.referral_count),
+    path("referrals/levels/", views.referral_levels),
+    path("referrals/volume/", views.referral_volume),
+    path("referrals/upline/", views.referral_upline),
 
     # ✅ بعد مسیر داینامیک
-    path("wallet/<str:wallet_address>/", views.wallet_view),
+    path("wallet/<str:wallet_address>/", polling.wallet_view),
 
     path("purchase/create/", views.create_purchase),
+    path("purchase/status/", views.purchase_status, name="purchase-status"),
     path("purchase/list/", views.list_purchases),
+    path("ledger/list/", views.ledger_history),
     path("withdraw/request/", views.request_withdraw),
 ]
\ No newline at end of file
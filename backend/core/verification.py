@@ -0,0 +1,212 @@
+"""
+On-chain verification of purchases.
+
+With ``PURCHASE_VERIFICATION`` on, ``register_purchase`` stores the purchase as
+``PENDING`` and credits nothing; the request path does no chain I/O. The
+``verify_purchases`` task (beat, plus a debounced kick after each new
+purchase) then works through the pending purchases in batches:
+
+- up to ``CHAIN_VERIFY_BATCH_SIZE`` due purchases are read, oldest first;
+- their transactions are looked up through the chain client (``core.chain``)
+  with at most ``CHAIN_VERIFY_CONCURRENCY`` requests in flight, outside any
+  database transaction;
+- one short transaction then locks the rows that are still ``PENDING`` and
+  records every outcome with a single ``bulk_update``. Verified purchases get
+  their locked credits, the upline's 5% and the ledger rows of a normal purchase
+  (grouped ``WalletDeltas`` + ``LedgerWriter``).
+
+A transaction the chain does not know yet (or a client error) is retried with
+exponential backoff (``verification_next_at``) and rejected after
+``CHAIN_VERIFY_MAX_ATTEMPTS``. A transaction that was aborted, was not sent
+from the buyer's wallet, went to another address than ``TON_RECEIVER_ADDRESS``
+or carried less TON than claimed is rejected right away, and so is one whose
+canonical hash (``ChainTransaction.tx_hash``) already verified another
+purchase: the same transfer can be submitted under another encoding of its
+hash, so ``Purchase.chain_tx_hash`` (unique) is what keeps it from being
+credited twice. Without a receiver
+address nothing is verified (``ImproperlyConfigured``). Rejected
+purchases never credit anything and are skipped by the unlock engine.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .bulk import LedgerWriter, WalletDeltas
+from .cache import invalidate_wallet
+from .chain import get_client, same_address
+from .models import Purchase
+from .services import UPLINE_RATE
+
+logger = logging.getLogger(__name__)
+
+KICK_LOCK_KEY = "verification:kick"
+KICK_DEBOUNCE = 2  # seconds between queued worker runs triggered by new purchases
+MAX_RETRY_DELAY = 3600
+
+
+@dataclass
+class VerificationReport:
+    checked: int = 0
+    verified: int = 0
+    rejected: int = 0
+    retried: int = 0
+    skipped: int = 0  # taken by a concurrent run
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(settings.CHAIN_VERIFY_RETRY_DELAY * 2 ** min(attempts - 1, 16), MAX_RETRY_DELAY))
+
+
+def due_pending(now, limit: int):
+    return list(
+        Purchase.objects.filter(verification_status="PENDING")
+        .filter(Q(verification_next_at__isnull=True) | Q(verification_next_at__lte=now))
+        .order_by("id")
+        .values_list("id", "ton_tx_hash", "ton_amount", "user__wallet_address")[:limit]
+    )
+
+
+def lookup(client, candidates) -> dict:
+    """``{purchase id: ChainTransaction | None | Exception}`` with bounded parallelism."""
+
+    def fetch(row):
+        purchase_id, tx_hash, ton_amount, sender = row
+        try:
+            return purchase_id, client.get_transaction(tx_hash, claimed_amount=ton_amount, claimed_source=sender)
+        except Exception as exc:
+            return purchase_id, exc
+
+    workers = max(1, min(settings.CHAIN_VERIFY_CONCURRENCY, len(candidates)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chain-verify") as pool:
+        return dict(pool.map(fetch, candidates))
+
+
+def decide(purchase: Purchase, result):
+    """``(status, error)``; status ``None`` means try again later."""
+    if isinstance(result, Exception):
+        return None, f"chain client error: {result}"[:255]
+    if result is None:
+        return None, "transaction not found"
+    if not result.success:
+        return "REJECTED", "transaction aborted on chain"
+    if not same_address(result.source, purchase.user.wallet_address):
+        return "REJECTED", f"sender {result.source or '-'} is not the buyer's wallet"[:255]
+    if not same_address(result.destination, settings.TON_RECEIVER_ADDRESS):
+        return "REJECTED", f"destination {result.destination or '-'} is not the receiver"[:255]
+    if result.ton_amount < purchase.ton_amount:
+        return "REJECTED", f"chain amount {result.ton_amount} < claimed {purchase.ton_amount}"
+    return "VERIFIED", ""
+
+
+def verify_batch(client=None, now=None, batch_size: int = None) -> VerificationReport:
+    if not settings.TON_RECEIVER_ADDRESS:
+        raise ImproperlyConfigured("TON_RECEIVER_ADDRESS is required to verify purchases")
+    client = client or get_client()
+    now = now or timezone.now()
+    report = VerificationReport()
+    candidates = due_pending(now, batch_size or settings.CHAIN_VERIFY_BATCH_SIZE)
+    if not candidates:
+        return report
+    results = lookup(client, candidates)
+
+    with transaction.atomic():
+        purchases = list(
+            Purchase.objects.filter(id__in=list(results), verification_status="PENDING")
+            .select_related("user", "user__inviter")
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("id")
+        )
+        report.skipped = len(results) - len(purchases)
+        found = [r.tx_hash for r in results.values() if r is not None and not isinstance(r, Exception)]
+        credited = dict(Purchase.objects.filter(chain_tx_hash__in=found).values_list("chain_tx_hash", "invoice_no"))
+        deltas = WalletDeltas()
+        touched = set()
+        with LedgerWriter() as ledger:
+            for p in purchases:
+                report.checked += 1
+                status, error = decide(p, results[p.id])
+                if status == "VERIFIED":
+                    canonical = results[p.id].tx_hash
+                    if canonical in credited:
+                        status, error = "REJECTED", f"transaction already credited to invoice {credited[canonical]}"
+                    else:
+                        credited[canonical] = p.invoice_no
+                        p.chain_tx_hash = canonical
+                p.verification_attempts += 1
+                p.verification_error = error
+                if status is None and p.verification_attempts >= settings.CHAIN_VERIFY_MAX_ATTEMPTS:
+                    status = "REJECTED"
+                if status is None:
+                    p.verification_next_at = now + retry_delay(p.verification_attempts)
+                    report.retried += 1
+                    continue
+                p.verification_status = status
+                p.verification_next_at = None
+                if status == "REJECTED":
+                    report.rejected += 1
+                    logger.warning("[VERIFY] rejected invoice=%s tx=%s: %s", p.invoice_no, p.ton_tx_hash, error)
+                    continue
+                p.verified_at = now
+                report.verified += 1
+                _credit(p, deltas, ledger, now)
+                touched.add(p.user.wallet_address)
+                if p.user.inviter_id:
+                    touched.add(p.user.inviter.wallet_address)
+        Purchase.objects.bulk_update(purchases, ["verification_status", "verification_attempts",
+                                                 "verification_next_at", "verification_error", "verified_at",
+                                                 "chain_tx_hash"])
+        deltas.apply()
+        invalidate_wallet(*touched)
+
+    logger.info("[VERIFY] %s", report.as_dict())
+    return report
+
+
+def _credit(p: Purchase, deltas: WalletDeltas, ledger: LedgerWriter, now) -> None:
+    # the same credits and ledger rows as record_purchase + pay_upline
+    meta = {"invoice": p.invoice_no, "tx": p.ton_tx_hash, "source": "verification"}
+    deltas.add(p.user_id, "principal_locked", p.ecg_value)
+    deltas.add(p.user_id, "self_profit_locked", p.self_profit_5)
+    ledger.add(p.user_id, "BUY_PRINCIPAL", p.ecg_value, invoice=p.invoice_no, meta=meta, created_at=now)
+    ledger.add(p.user_id, "BUY_SELF_PROFIT", p.self_profit_5, invoice=p.invoice_no, meta=meta, created_at=now)
+    if p.user.inviter_id:
+        upline_bonus = p.ecg_value * UPLINE_RATE
+        deltas.add(p.user.inviter_id, "downline_profit_instant", upline_bonus)
+        ledger.add(p.user.inviter_id, "DOWNLINE_PROFIT", upline_bonus, invoice=p.invoice_no,
+                   meta={"from": p.user.wallet_address, **meta}, created_at=now)
+
+
+def run_verification(client=None, max_batches: int = 50) -> dict:
+    """Verify batches until nothing is due (or ``max_batches``); returns the summed report."""
+    total = VerificationReport()
+    batch_size = settings.CHAIN_VERIFY_BATCH_SIZE
+    for _ in range(max_batches):
+        report = verify_batch(client, batch_size=batch_size)
+        for key, value in report.as_dict().items():
+            setattr(total, key, getattr(total, key) + value)
+        if report.checked + report.skipped < batch_size:
+            break
+    return total.as_dict()
+
+
+def schedule_verification() -> None:
+    """Queue a worker run soon after a new pending purchase (at most one per ``KICK_DEBOUNCE``)."""
+    if not cache.add(KICK_LOCK_KEY, 1, timeout=KICK_DEBOUNCE):
+        return
+    try:
+        from .tasks import verify_purchases
+        verify_purchases.delay()
+    except Exception:
+        logger.exception("[VERIFY] could not queue verification run")
+        cache.delete(KICK_LOCK_KEY)
@@ -2,11 +2,32 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from decimal import Decimal
-from datetime import timedelta
+import logging
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.urls import reverse
 from django.utils import timezone
-from .services import get_or_create_user, apply_referral, register_purchase
-from .models import WithdrawRequest, Ledger
-from .serializers import WalletSerializer, PurchaseSerializer, UserSerializer
+from django.utils.http import urlencode
+from . import cache as wallet_cache
+from .chain import normalize_tx_hash
+from .services import (
+    get_or_create_user, find_user, apply_referral, register_purchase, submit_purchase,
+    request_withdrawal, claim_daily, InsufficientBalance, WITHDRAW_SCOPES, DAILY_CLAIM_COOLDOWN,
+)
+from .models import Ledger, Purchase, PurchaseIntake, ReferralPath, Wallet
+from .pagination import keyset_page, parse_fields, parse_limit, set_next_headers
+from .serializers import WalletSerializer, PurchaseSerializer, UserSerializer, PurchaseIntakeSerializer, LedgerSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def empty_wallet() -> Wallet:
+    """کیف پول صفر (ذخیره‌نشده) برای آدرس‌هایی که هنوز کاربر ندارند"""
+    zero = Decimal("0.000000")
+    w = Wallet(**{f.name: zero for f in Wallet._meta.concrete_fields
+                  if f.get_internal_type() == "DecimalField" and not f.generated})
+    w.withdrawable_total = zero
+    return w
 
 
 @api_view(["POST"])
@@ -27,15 +48,22 @@ def connect_wallet(request):
     }, status=status.HTTP_200_OK)
 
 
+def wallet_payload(user) -> dict:
+    """خروجی wallet_view (کش‌شونده)؛ همین را نسخه‌ی async هم استفاده می‌کند"""
+    return WalletSerializer(user.wallet if user else empty_wallet()).data
+
+
 @api_view(["GET"])
 def wallet_view(request, wallet_address):
-    user = get_or_create_user(wallet_address)
-    return Response(WalletSerializer(user.wallet).data, status=status.HTTP_200_OK)
+    def build():
+        return wallet_payload(find_user(wallet_address))
+
+    return Response(wallet_cache.get_or_build("wallet", wallet_address, build), status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
 def create_purchase(request):
-    print("DATA:", request.data)
+    logger.debug("[BUY] create_purchase data=%s", request.data)
 
     wallet_address = request.data.get("wallet_address")
     ton_amount = request.data.get("ton_amount")
@@ -53,24 +81,95 @@ def create_purchase(request):
 
     user = get_or_create_user(wallet_address)
 
+    if settings.PURCHASE_INGEST_MODE == "async":
+        try:
+            intake = submit_purchase(user, ton_amount, str(ton_tx_hash))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        data = PurchaseIntakeSerializer(intake).data
+        data["status_url"] = request.build_absolute_uri(
+            reverse("purchase-status") + "?" + urlencode({"tx": intake.ton_tx_hash})
+        )
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
     try:
         p = register_purchase(user, ton_amount, str(ton_tx_hash))
     except Exception as e:
-        print("REGISTER ERROR:", e)
+        logger.exception("[BUY] register_purchase failed wallet=%s tx=%s", wallet_address, ton_tx_hash)
         return Response({"error": str(e)}, status=400)
 
     return Response(PurchaseSerializer(p).data, status=201)
 
 
+@api_view(["GET"])
+def purchase_status(request):
+    ton_tx_hash = request.query_params.get("tx")
+    if not ton_tx_hash:
+        return Response({"error": "tx param required"}, status=400)
+
+    intake = PurchaseIntake.objects.select_related("purchase").filter(
+        ton_tx_hash=normalize_tx_hash(ton_tx_hash)).first()
+    if intake is None:
+        return Response({"error": "not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    data = PurchaseIntakeSerializer(intake).data
+    if intake.purchase is not None:
+        data["purchase"] = PurchaseSerializer(intake.purchase).data
+    return Response(data, status=status.HTTP_200_OK)
+
+
 @api_view(["GET"])
 def list_purchases(request):
     wallet_address = request.query_params.get("wallet")
     if not wallet_address:
         return Response({"error": "wallet param required"}, status=400)
 
-    user = get_or_create_user(wallet_address)
-    qs = user.purchases.order_by("-created_at")
-    return Response(PurchaseSerializer(qs, many=True).data)
+    user = find_user(wallet_address)
+    if user is None:
+        return Response([])
+    # بدون limit/cursor کل تاریخچه (رفتار قبلی؛ صفحه‌ی Purchase همین را می‌خواند)
+    return history_page(request, Purchase.objects.filter(user=user), PurchaseSerializer, paginate=False)
+
+
+@api_view(["GET"])
+def ledger_history(request):
+    wallet_address = request.query_params.get("wallet")
+    if not wallet_address:
+        return Response({"error": "wallet param required"}, status=400)
+
+    typ = request.query_params.get("typ")
+    if typ and typ not in dict(Ledger.TYPE_CHOICES):
+        return Response({"error": "invalid typ"}, status=400)
+
+    user = find_user(wallet_address)
+    if user is None:
+        return Response([])
+    qs = Ledger.objects.filter(user=user)
+    if typ:
+        qs = qs.filter(typ=typ)
+    return history_page(request, qs, LedgerSerializer)
+
+
+def history_page(request, qs, serializer_class, paginate=True):
+    """
+    صفحه‌بندی keyset روی (created_at, id) + ?fields= با .only()
+    با paginate=False فقط وقتی limit یا cursor فرستاده شود صفحه‌بندی می‌شود
+    """
+    params = request.query_params
+    try:
+        fields = parse_fields(params.get("fields"), serializer_class().fields)
+        if fields:
+            qs = qs.only(*{"id", "created_at", *fields})
+        if paginate or "limit" in params or "cursor" in params:
+            rows, next_cursor = keyset_page(qs, params.get("cursor"), parse_limit(params.get("limit")))
+        else:
+            rows, next_cursor = qs.order_by("-created_at", "-id"), None
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    response = Response(serializer_class(rows, many=True, fields=fields).data)
+    return set_next_headers(response, request, next_cursor)
 
 
 @api_view(["POST"])
@@ -86,53 +185,19 @@ def request_withdraw(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    user = get_or_create_user(wallet_address)
-    w = user.wallet
-
     if amount < Decimal("60"):
         return Response({"error": "min withdraw is 60 ECG"}, status=status.HTTP_400_BAD_REQUEST)
 
-    if scope == "DOWNLINE_ONLY":
-        if amount > w.downline_profit_instant:
-            return Response({"error": "insufficient downline instant balance"}, status=status.HTTP_400_BAD_REQUEST)
-
-        w.downline_profit_instant = w.downline_profit_instant - amount
-        w.save(update_fields=["downline_profit_instant"])
-
-    elif scope == "ALL_WITHDRAWABLE":
-        if amount > w.withdrawable_total():
-            return Response({"error": "insufficient withdrawable total"}, status=status.HTTP_400_BAD_REQUEST)
-
-        remaining = amount
-
-        def take(field):
-            nonlocal remaining
-            if remaining <= 0:
-                return
-            val = getattr(w, field)
-            if val <= 0:
-                return
-            use = min(val, remaining)
-            setattr(w, field, val - use)
-            remaining -= use
-
-        take("downline_profit_instant")
-        take("referral_bonus")
-        take("daily_reward_unlocked")
-        take("self_profit_unlocked")
-        take("principal_unlocked")
-        w.save()
-
-    else:
+    if scope not in WITHDRAW_SCOPES:
         return Response({"error": "invalid scope"}, status=status.HTTP_400_BAD_REQUEST)
 
-    req = WithdrawRequest.objects.create(
-        user=user,
-        scope=scope,
-        amount=amount,
-        destination_wallet=dest,
-        status="PENDING"
-    )
+    user = get_or_create_user(wallet_address)
+
+    try:
+        req = request_withdrawal(user, scope, amount, dest)
+    except InsufficientBalance as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
     return Response({"id": req.id, "status": req.status}, status=status.HTTP_201_CREATED)
 
 
@@ -142,44 +207,115 @@ def referral_count(request):
     if not wallet_address:
         return Response({"error": "wallet_address required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    user = get_or_create_user(wallet_address)
-    return Response({"count": user.invitees.count()}, status=status.HTTP_200_OK)
+    user = find_user(wallet_address)
+    return Response({"count": user.invitee_count if user else 0}, status=status.HTTP_200_OK)
 
 
-# =======================
-# Timer endpoints
-# =======================
+@api_view(["GET"])
+def referral_levels(request):
+    wallet_address = request.query_params.get("wallet_address")
+    if not wallet_address:
+        return Response({"error": "wallet_address required"}, status=status.HTTP_400_BAD_REQUEST)
 
-DAILY_REWARD = Decimal("1.0")
-COOLDOWN = timedelta(hours=24)
+    user = find_user(wallet_address)
+    levels = []
+    if user is not None:
+        levels = list(
+            ReferralPath.objects.filter(ancestor=user)
+            .values("depth").annotate(count=Count("id")).order_by("depth")
+        )
+    return Response({"levels": levels, "total": sum(l["count"] for l in levels)}, status=status.HTTP_200_OK)
 
 
 @api_view(["GET"])
-def reward_status(request):
+def referral_volume(request):
     wallet_address = request.query_params.get("wallet_address")
     if not wallet_address:
         return Response({"error": "wallet_address required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    user = get_or_create_user(wallet_address)
-    w = user.wallet
-    now = timezone.now()
+    user = find_user(wallet_address)
+    levels = []
+    if user is not None:
+        # فقط خریدهای تاییدشده (PENDING/REJECTED حجم حساب نمی‌شوند)
+        verified = Q(descendant__purchases__verification_status="VERIFIED")
+        levels = list(
+            ReferralPath.objects.filter(ancestor=user)
+            .values("depth")
+            .annotate(purchases=Count("descendant__purchases", filter=verified),
+                      ecg_value=Sum("descendant__purchases__ecg_value", filter=verified))
+            .order_by("depth")
+        )
+    total = Decimal("0")
+    for level in levels:
+        level["ecg_value"] = level["ecg_value"] or Decimal("0")
+        total += level["ecg_value"]
+    return Response({"levels": levels, "ecg_value": total}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def referral_upline(request):
+    wallet_address = request.query_params.get("wallet_address")
+    if not wallet_address:
+        return Response({"error": "wallet_address required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    user = find_user(wallet_address)
+    upline = []
+    if user is not None:
+        upline = list(
+            ReferralPath.objects.filter(descendant=user)
+            .values("depth", wallet_address=F("ancestor__wallet_address")).order_by("depth")
+        )
+    return Response({"upline": upline}, status=status.HTTP_200_OK)
+
+
+# =======================
+# Timer endpoints
+# =======================
+
+def reward_status_payload(user) -> dict:
+    """بخش کش‌شونده‌ی reward_status"""
+    w = user.wallet if user else empty_wallet()
+    return {
+        "next_daily_claim_at": user.next_daily_claim_at if user else None,
+        "balance_ecg": str(w.withdrawable_total),
+        "total_rewards": str(w.withdrawable_total),
+        "referral_points": str(w.referral_bonus),
+        "rewards_count": w.rewards_count,
+    }
+
 
-    # ✅ این فیلد باید در مدل AppUser وجود داشته باشد
-    next_at = user.next_daily_claim_at
+def reward_status_response(cached: dict, now=None) -> dict:
+    now = now or timezone.now()
+
+    # ✅ زمان باقی‌مانده هر بار از next_daily_claim_at کش‌شده حساب می‌شود
+    next_at = cached["next_daily_claim_at"]
 
     if not next_at:
         seconds_remaining = 0
     else:
         seconds_remaining = max(0, int((next_at - now).total_seconds()))
 
-    return Response({
+    return {
         "status": "ok",
         "seconds_remaining": seconds_remaining,
-        "balance_ecg": str(w.withdrawable_total()),
-        "total_rewards": str(w.withdrawable_total()),
-        "referral_points": str(w.referral_bonus),
-        "rewards_count": user.ledgers.filter(typ="DAILY_UNLOCK").count(),
-    }, status=status.HTTP_200_OK)
+        "balance_ecg": cached["balance_ecg"],
+        "total_rewards": cached["total_rewards"],
+        "referral_points": cached["referral_points"],
+        "rewards_count": cached["rewards_count"],
+    }
+
+
+@api_view(["GET"])
+def reward_status(request):
+    wallet_address = request.query_params.get("wallet_address")
+    if not wallet_address:
+        return Response({"error": "wallet_address required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    def build():
+        return reward_status_payload(find_user(wallet_address))
+
+    return Response(reward_status_response(wallet_cache.get_or_build("reward_status", wallet_address, build)),
+                    status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
@@ -188,41 +324,24 @@ def tick(request):
     if not wallet_address:
         return Response({"error": "wallet_address required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    user = get_or_create_user(wallet_address)
-    w = user.wallet
     now = timezone.now()
+    # ✅ cooldown + زمان بعدی + افزایش موجودی در یک تراکنش کوتاه (services.claim_daily)
+    claim = claim_daily(wallet_address, now=now)
 
-    next_at = user.next_daily_claim_at
-
-    if next_at and next_at > now:
-        seconds_remaining = int((next_at - now).total_seconds())
+    if not claim.rewarded:
+        seconds_remaining = max(0, int((claim.next_claim_at - now).total_seconds()))
         return Response({
             "status": "too_early",
             "message": "Please wait for the timer to finish.",
             "seconds_remaining": seconds_remaining,
         }, status=status.HTTP_400_BAD_REQUEST)
 
-    # ✅ افزایش موجودی داخلی
-    w.daily_reward_unlocked = w.daily_reward_unlocked + DAILY_REWARD
-    w.save(update_fields=["daily_reward_unlocked"])
-
-    Ledger.objects.create(
-        user=user,
-        typ="DAILY_UNLOCK",
-        amount=DAILY_REWARD,
-        meta={"source": "timer"}
-    )
-
-    # ✅ ست کردن زمان بعدی
-    user.next_daily_claim_at = now + COOLDOWN
-    user.save(update_fields=["next_daily_claim_at"])
-
     return Response({
         "status": "rewarded",  # ✅ دقیقا چیزی که فرانت می‌خواهد
         "message": "1 ECG added",
-        "balance_ecg": str(w.withdrawable_total()),
-        "total_rewards": str(w.withdrawable_total()),
-        "referral_points": str(w.referral_bonus),
-        "rewards_count": user.ledgers.filter(typ="DAILY_UNLOCK").count(),
-        "seconds_remaining": int(COOLDOWN.total_seconds()),
-    }, status=status.HTTP_200_OK)
\ No newline at end of file
+        "balance_ecg": str(claim.withdrawable_total),
+        "total_rewards": str(claim.withdrawable_total),
+        "referral_points": str(claim.referral_bonus),
+        "rewards_count": claim.rewards_count,
+        "seconds_remaining": int(DAILY_CLAIM_COOLDOWN.total_seconds()),
+    }, status=status.HTTP_200_OK)